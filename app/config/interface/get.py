@@ -2,6 +2,7 @@
 Функции получения данных конфигурации
 Возвращают данные в едином формате
 """
+import hashlib
 import json
 from ..models import Models, Assistant, AssistantInputer
 from app.product.models import Satellite, Products
@@ -405,4 +406,76 @@ def get_history(count: int = 10, offset: int = 0, task_id: str = None, model_id:
             "data": None,
             "count": 0,
             "error": f"Ошибка при получении истории: {str(e)}"
-        }
\ No newline at end of file
+        }
+
+
+def get_assistant_limits():
+    """
+    Получение лимитов ассистентов для сервиса ассистентов
+    
+    Returns:
+        dict: {
+            "success": bool,
+            "data": dict {key_title: {"max_output_tokens": int или None}},
+            "error": str или None
+        }
+    """
+    try:
+        data = {
+            key_title: {"max_output_tokens": maks_token}
+            for key_title, maks_token in Assistant.objects.values_list('key_title', 'maks_token')
+        }
+        
+        return {
+            "success": True,
+            "data": data,
+            "error": None
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Ошибка при получении лимитов ассистентов: {str(e)}"
+        }
+
+
+def get_llm_endpoints():
+    """
+    Получение активных AI моделей (URL и ключей) для маршрутизации запросов сервиса ассистентов
+    
+    Ключи отдаются в зашифрованном виде, сервис ассистентов расшифровывает их сам (ENCRYPTION_KEY).
+    version меняется при любом изменении активных моделей.
+    
+    Returns:
+        dict: {
+            "success": bool,
+            "data": dict {"version": str, "models": [{"id", "name", "url", "encrypted_key"}]},
+            "error": str или None
+        }
+    """
+    try:
+        models = [
+            {
+                "id": str(model_id),
+                "name": name,
+                "url": url,
+                "encrypted_key": encrypted_key,
+            }
+            for model_id, name, url, encrypted_key in Models.objects.filter(is_active=True)
+                .order_by('id').values_list('id', 'name', 'url', 'encrypted_key')
+        ]
+        version = hashlib.sha256(json.dumps(models, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        
+        return {
+            "success": True,
+            "data": {"version": version, "models": models},
+            "error": None
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Ошибка при получении AI моделей: {str(e)}"
+        }
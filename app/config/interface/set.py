@@ -3,7 +3,10 @@
 Возвращают результат в едином формате
 """
 import json
+import queue
 import asyncio
+import threading
+from django.db import connection
 from ..models import Models, Assistant
 from app.product.models import Satellite
 from app.response.models import Response
@@ -42,108 +45,25 @@ def generate_content(task_id: str, model_id: str, domain_id: str, fields: list,
         dict: {"success": bool, "data": dict, "error": str}
     """
     try:
-        # Валидация ассистента по ID
-        try:
-            assistant = Assistant.objects.get(id=task_id)
-        except Assistant.DoesNotExist:
-            return {
-                "success": False,
-                "data": None,
-                "error": f"Ассистент с ID '{task_id}' не найден"
-            }
-        
-        # Валидация модели
-        try:
-            model = Models.objects.get(id=model_id)
-        except Models.DoesNotExist:
-            return {
-                "success": False,
-                "data": None,
-                "error": f"Модель с ID '{model_id}' не найдена"
-            }
-        
-        # Определяем домен
-        if domain_id == 'main':
-            domain_value = "main"
-        else:
-            try:
-                satellite = Satellite.objects.get(id=domain_id)
-                domain_value = satellite.domen
-            except Satellite.DoesNotExist:
-                return {
-                    "success": False,
-                    "data": None,
-                    "error": f"Домен с ID '{domain_id}' не найден"
-                }
-        
-        # Проверяем, есть ли метод для этого ассистента
-        method_name = ASSISTANT_METHODS.get(assistant.key_title)
-        if not method_name:
-            return {
-                "success": False,
-                "data": None,
-                "error": f"Неизвестный тип ассистента: '{assistant.key_title}'"
-            }
-        
-        # Преобразуем fields в словарь {name: value}
-        fields_dict = {field.get('name'): field.get('value') for field in fields}
-        
-        # Формируем payload для API
-        payload = _build_payload(
-            assistant_key=assistant.key_title,
-            llm_model=model.name,
-            domain=domain_value,
-            fields_dict=fields_dict,
-            files=files
-        )
+        prepared = _prepare_generation(task_id, model_id, domain_id, fields, files)
+        if not prepared["success"]:
+            return prepared
+        generation = prepared["data"]
         
-        if payload is None:
-            return {
-                "success": False,
-                "data": None,
-                "error": f"Не удалось сформировать payload для ассистента '{assistant.key_title}'"
-            }
-        
-        # Вызываем API ассистента
-        print(f"=== PAYLOAD для {assistant.key_title} ===")
-        print(json.dumps(payload, indent=2, ensure_ascii=False, default=str))
-        print("=" * 50)
-        
-        api = AssistantsAPI()
-        method = getattr(api, method_name)
+        api = AssistantsAPI(user=user)
+        method = getattr(api, generation["method_name"])
         
         # Запускаем async метод в sync контексте
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         try:
-            result = loop.run_until_complete(method(**payload))
+            result = loop.run_until_complete(method(**generation["payload"]))
         finally:
             loop.close()
         
-        # Обрабатываем результат
-        generated_html = _format_result(assistant.key_title, result)
-        generated_text = _strip_html(generated_html)
-        
-        # Формируем параметры для сохранения
-        params = json.dumps(fields, ensure_ascii=False)
-        
-        # Сохраняем в Response
-        Response.objects.create(
-            parametrs=params,
-            domen=domain_value,
-            html=generated_html,
-            user=user,
-            model=model.name,
-            assistant=assistant.title,
-            source='manual'
-        )
-        
         return {
             "success": True,
-            "data": {
-                "html": generated_html,
-                "text": generated_text
-            },
+            "data": _save_generation(generation, fields, user, result),
             "error": None
         }
         
@@ -155,6 +75,189 @@ def generate_content(task_id: str, model_id: str, domain_id: str, fields: list,
         }
 
 
+def generate_content_stream(task_id: str, model_id: str, domain_id: str, fields: list, user: str = "anonymous", files: dict = None):
+    """
+    Генерация контента в режиме SSE
+    
+    Параметры как у generate_content. Генератор строк SSE для StreamingHttpResponse:
+    промежуточные события сервиса ассистентов (start, delta) ретранслируются как есть,
+    в конце отправляется result {html, text} или error {error}.
+    """
+    try:
+        prepared = _prepare_generation(task_id, model_id, domain_id, fields, files)
+    except Exception as e:
+        prepared = {"success": False, "error": f"Ошибка при генерации: {str(e)}"}
+    if not prepared["success"]:
+        yield _format_sse("error", {"error": prepared["error"]})
+        return
+    generation = prepared["data"]
+    
+    events = queue.Queue()
+    
+    # Запрос к сервису ассистентов выполняется в отдельном потоке со своим event loop,
+    # события передаются в текущий поток через очередь
+    def run_generation():
+        api = AssistantsAPI(on_event=lambda event, data: events.put((event, data)), user=user)
+        method = getattr(api, generation["method_name"])
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            result = loop.run_until_complete(method(**generation["payload"]))
+        except Exception as e:
+            events.put(("_failed", f"Ошибка при генерации: {str(e)}"))
+            return
+        finally:
+            loop.close()
+        # Результат сохраняется в этом же потоке: если браузер закрыл соединение и генератор
+        # остановлен, сгенерированный (и оплаченный) текст все равно попадает в Response
+        try:
+            events.put(("_done", _save_generation(generation, fields, user, result)))
+        except Exception as e:
+            events.put(("_failed", f"Ошибка при сохранении результата: {str(e)}"))
+        finally:
+            connection.close()
+    
+    threading.Thread(target=run_generation, daemon=True).start()
+    
+    while True:
+        event, data = events.get()
+        if event == "_done":
+            yield _format_sse("result", data)
+            return
+        if event == "_failed":
+            yield _format_sse("error", {"error": data})
+            return
+        yield _format_sse(event, data)
+
+
+def _prepare_generation(task_id: str, model_id: str, domain_id: str, fields: list, files: dict = None) -> dict:
+    """
+    Валидация параметров генерации и формирование payload для AssistantsAPI
+    
+    Returns:
+        dict: {
+            "success": bool,
+            "data": dict {assistant, model, domain, method_name, payload},
+            "error": str или None
+        }
+    """
+    # Валидация ассистента по ID
+    try:
+        assistant = Assistant.objects.get(id=task_id)
+    except Assistant.DoesNotExist:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Ассистент с ID '{task_id}' не найден"
+        }
+    
+    # Валидация модели
+    try:
+        model = Models.objects.get(id=model_id)
+    except Models.DoesNotExist:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Модель с ID '{model_id}' не найдена"
+        }
+    
+    # Определяем домен
+    if domain_id == 'main':
+        domain_value = "main"
+    else:
+        try:
+            satellite = Satellite.objects.get(id=domain_id)
+            domain_value = satellite.domen
+        except Satellite.DoesNotExist:
+            return {
+                "success": False,
+                "data": None,
+                "error": f"Домен с ID '{domain_id}' не найден"
+            }
+    
+    # Проверяем, есть ли метод для этого ассистента
+    method_name = ASSISTANT_METHODS.get(assistant.key_title)
+    if not method_name:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Неизвестный тип ассистента: '{assistant.key_title}'"
+        }
+    
+    # Преобразуем fields в словарь {name: value}
+    fields_dict = {field.get('name'): field.get('value') for field in fields}
+    
+    # Формируем payload для API
+    payload = _build_payload(
+        assistant_key=assistant.key_title,
+        llm_model=model.name,
+        domain=domain_value,
+        fields_dict=fields_dict,
+        files=files
+    )
+    
+    if payload is None:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Не удалось сформировать payload для ассистента '{assistant.key_title}'"
+        }
+    
+    print(f"=== PAYLOAD для {assistant.key_title} ===")
+    print(json.dumps(payload, indent=2, ensure_ascii=False, default=str))
+    print("=" * 50)
+    
+    return {
+        "success": True,
+        "data": {
+            "assistant": assistant,
+            "model": model,
+            "domain": domain_value,
+            "method_name": method_name,
+            "payload": payload,
+        },
+        "error": None
+    }
+
+
+def _save_generation(generation: dict, fields: list, user: str, result) -> dict:
+    """
+    Форматирует результат генерации и сохраняет его в Response
+    
+    Returns:
+        dict: {"html": str, "text": str}
+    """
+    assistant = generation["assistant"]
+    
+    # Обрабатываем результат
+    generated_html = _format_result(assistant.key_title, result)
+    generated_text = _strip_html(generated_html)
+    
+    # Формируем параметры для сохранения
+    params = json.dumps(fields, ensure_ascii=False)
+    
+    # Сохраняем в Response
+    Response.objects.create(
+        parametrs=params,
+        domen=generation["domain"],
+        html=generated_html,
+        user=user,
+        model=generation["model"].name,
+        assistant=assistant.title,
+        source='manual'
+    )
+    
+    return {
+        "html": generated_html,
+        "text": generated_text
+    }
+
+
+def _format_sse(event: str, data: dict) -> str:
+    """Форматирует событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 def _build_payload(assistant_key: str, llm_model: str, domain: str, fields_dict: dict, files: dict = None) -> dict:
     """
     Формирует payload для конкретного ассистента
@@ -374,7 +477,6 @@ def generate_excel_content(task_id: str, model_id: str, excel_link: str, user_id
     Returns:
         dict: {"success": bool, "data": dict, "error": str}
     """
-    import threading
     from interface import SheetsAPI
     from app.users.models import UserAssistant
     
@@ -440,28 +542,22 @@ def generate_excel_content(task_id: str, model_id: str, excel_link: str, user_id
         print(json.dumps(payload, indent=2, ensure_ascii=False))
         print("=" * 50)
         
-        # Функция для запуска в отдельном потоке
-        def run_sheets_processing():
-            api = SheetsAPI()
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(api.process_sheet(**payload))
-                print(f"=== SHEETS PROCESSING COMPLETED для {assistant.key_title} ===")
-            except Exception as e:
-                print(f"=== SHEETS PROCESSING ERROR для {assistant.key_title}: {e} ===")
-            finally:
-                loop.close()
-        
-        # Запускаем обработку в отдельном потоке (не ждём завершения)
-        thread = threading.Thread(target=run_sheets_processing, daemon=True)
-        thread.start()
+        # Сервис Sheets только создает задание и сразу отвечает: задание выполняется
+        # и возобновляется после перезапуска на его стороне, поток не ждет обработки листа
+        api = SheetsAPI(timeout=30.0)
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(api.process_sheet(**payload, background=True))
+        finally:
+            loop.close()
+        print(f"=== SHEETS JOB {result.get('job_id')} запущено для {assistant.key_title} ===")
         
         return {
             "success": True,
             "data": {
                 "html": "Обработка запущена в фоновом режиме",
-                "text": "Обработка запущена в фоновом режиме"
+                "text": "Обработка запущена в фоновом режиме",
+                "job_id": result.get("job_id"),
             },
             "error": None
         }
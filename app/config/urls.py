@@ -10,5 +10,7 @@ urlpatterns = [
     path('generation/generate-excel', views.generate_excel, name='generate_excel'),
     path('history/filters', views.history_filters, name='history_filters'),
     path('history', views.history, name='history'),
+    path('assistants/limits', views.assistant_limits, name='assistant_limits'),
+    path('assistants/models', views.llm_endpoints, name='llm_endpoints'),
 ]
 
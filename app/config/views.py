@@ -1,10 +1,10 @@
 import json
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from core.decorators import login_required_api
-from .interface.get import get_filters_for_generation, get_filters_for_history, get_form_config, get_history
-from .interface.set import generate_content, generate_excel_content
+from core.decorators import login_required_api, service_token_required
+from .interface.get import get_filters_for_generation, get_filters_for_history, get_form_config, get_history, get_assistant_limits, get_llm_endpoints
+from .interface.set import generate_content, generate_content_stream, generate_excel_content
 
 
 @require_http_methods(["GET"])
@@ -125,6 +125,28 @@ def form_config(request):
         }, status=404)
 
 
+@require_http_methods(["GET"])
+def assistant_limits(request):
+    """
+    GET /api/assistants/limits
+    Лимиты ассистентов (Assistant.maks_token) для сервиса ассистентов
+    
+    Авторизация: не требуется (внутренний запрос сервиса)
+    
+    Возвращает:
+        dict: {key_title: {"max_output_tokens": int | None}}
+    """
+    result = get_assistant_limits()
+    
+    if result['success']:
+        return JsonResponse(result['data'], status=200)
+    else:
+        return JsonResponse({
+            'success': False,
+            'error': result['error']
+        }, status=500)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @login_required_api
@@ -139,6 +161,9 @@ def generate(request):
     Принимает:
     - application/json: {"filters": {...}, "fields": [...]}
     - multipart/form-data: filters[taskId], filters[modelId], filters[domainId], fields[0][name], fields[0][value], photo1, photo2
+    
+    Стриминг (?stream=1 или Accept: text/event-stream):
+    - ответ text/event-stream с событиями start, delta {text}, result {html, text}, error {error}
     """
     content_type = request.content_type or ''
     
@@ -183,6 +208,22 @@ def generate(request):
     # Получаем пользователя из авторизации (login для сохранения в Response)
     user = request.user.login
     
+    if request.GET.get('stream') in ('1', 'true') or 'text/event-stream' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(
+            generate_content_stream(
+                task_id=task_id,
+                model_id=model_id,
+                domain_id=domain_id,
+                fields=fields,
+                user=user,
+                files=files
+            ),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
     result = generate_content(
         task_id=task_id,
         model_id=model_id,
@@ -388,3 +429,26 @@ def _parse_form_data(request) -> tuple[dict, dict]:
             files[file_key] = uploaded_file.read()
     
     return data, files if files else None
+
+
+@require_http_methods(["GET"])
+@service_token_required
+def llm_endpoints(request):
+    """
+    GET /api/assistants/models
+    Активные AI модели (URL и зашифрованные ключи) для маршрутизации запросов сервиса ассистентов
+    
+    Авторизация: требуется (заголовок X-Service-Token = SERVICE_API_TOKEN)
+    
+    Возвращает:
+        dict: {"version": str, "models": [{"id", "name", "url", "encrypted_key"}]}
+    """
+    result = get_llm_endpoints()
+    
+    if result['success']:
+        return JsonResponse(result['data'], status=200)
+    else:
+        return JsonResponse({
+            'success': False,
+            'error': result['error']
+        }, status=500)
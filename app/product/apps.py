@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProductConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app.product'
+
+    def ready(self):
+        # Подключаем сигналы инвалидации версии каталога
+        from . import signals  # noqa: F401
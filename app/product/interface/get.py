@@ -2,7 +2,7 @@
 Функции получения данных товаров
 Возвращают данные в едином формате
 """
-from ..models import Products, Satellite, List
+from ..models import Products, Satellite, List, CatalogVersion
 
 
 def get_related_products_by_domain(product_names: list, domain_url: str = None):
@@ -189,6 +189,103 @@ def get_product_link_by_domain(product_names: list, domain_url: str = None):
         }
 
 
+def get_catalog_documents(domain_url: str = None):
+    """
+    Получение товаров домена с текстами для поискового индекса сервиса ассистентов
+    
+    Args:
+        domain_url: title или URL домена (None/"main" = базовые ссылки)
+    
+    Returns:
+        dict: {
+            "success": bool,
+            "data": list [{title, link, description, relations}],
+            "error": str или None
+        }
+    """
+    try:
+        satellite = None
+        if domain_url and domain_url != "main":
+            satellite = Satellite.objects.filter(title=domain_url).first()
+            if not satellite:
+                domain_with_slash = domain_url.rstrip('/') + '/'
+                domain_without_slash = domain_url.rstrip('/')
+                satellite = Satellite.objects.filter(domen__in=[domain_with_slash, domain_without_slash]).first()
+            
+            if not satellite:
+                return {
+                    "success": False,
+                    "data": None,
+                    "error": f"Домен '{domain_url}' не найден"
+                }
+        
+        # Те же товары, что и в get_product_link_by_domain(["_all"])
+        if satellite is None:
+            products = Products.objects.filter(baseLink__isnull=False).exclude(baseLink='')
+        else:
+            products = satellite.products.filter(satelitLink__isnull=False).exclude(satelitLink='')
+        
+        # Описания связей, в которых товар рекомендуется к другим товарам
+        relations = {}
+        for product_id, description in List.objects.exclude(description__isnull=True).exclude(description='') \
+                .values_list('related_product_id', 'description'):
+            relations.setdefault(product_id, []).append(description)
+        
+        result = []
+        for product in products:
+            link = product.baseLink if satellite is None else _join_url(satellite.domen, product.satelitLink)
+            result.append({
+                "title": product.title,
+                "link": link,
+                "description": product.description or "",
+                "relations": " ".join(relations.get(product.id, [])),
+            })
+        
+        return {
+            "success": True,
+            "data": result,
+            "error": None
+        }
+    
+    except Exception as e:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Ошибка при получении каталога: {str(e)}"
+        }
+
+
+def get_catalog_version():
+    """
+    Получение текущей версии каталога товаров
+    
+    Returns:
+        dict: {
+            "success": bool,
+            "data": dict {version, updated_at},
+            "error": str или None
+        }
+    """
+    try:
+        catalog_version = CatalogVersion.objects.filter(id=1).first()
+        
+        return {
+            "success": True,
+            "data": {
+                "version": catalog_version.version if catalog_version else 0,
+                "updated_at": catalog_version.updateAt.isoformat() if catalog_version else None
+            },
+            "error": None
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Ошибка при получении версии каталога: {str(e)}"
+        }
+
+
 def _join_url(domain: str, path: str) -> str:
     """
     Склеивает домен и путь, убирая дублирующийся слеш
@@ -2,4 +2,33 @@
 Функции обновления данных товаров
 Возвращают результат в едином формате
 """
+from django.db.models import F
+from django.utils import timezone
+from ..models import CatalogVersion
 
+
+def bump_catalog_version():
+    """
+    Увеличивает версию каталога товаров
+    
+    Returns:
+        dict: {"success": bool, "error": str или None}
+    """
+    try:
+        updated = CatalogVersion.objects.filter(id=1).update(
+            version=F('version') + 1,
+            updateAt=timezone.now()
+        )
+        if not updated:
+            CatalogVersion.objects.get_or_create(id=1, defaults={'version': 1})
+        
+        return {
+            "success": True,
+            "error": None
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Ошибка при обновлении версии каталога: {str(e)}"
+        }
@@ -98,3 +98,19 @@ class List(models.Model):
     
     def __str__(self):
         return f"{self.product.title} -> {self.related_product.title}"
+
+
+class CatalogVersion(models.Model):
+    """Версия каталога товаров (увеличивается при любом изменении товаров, сателлитов и связей)"""
+    
+    id = models.BigAutoField(primary_key=True, verbose_name='ID')
+    version = models.BigIntegerField(default=0, verbose_name='Версия')
+    updateAt = models.DateTimeField(default=timezone.now, verbose_name='Дата обновления')
+    
+    class Meta:
+        db_table = 'catalog_version'
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = 'Версии каталога'
+    
+    def __str__(self):
+        return f"v{self.version}"
@@ -0,0 +1,26 @@
+"""
+Сигналы каталога товаров
+Любое изменение Products/Satellite/List увеличивает версию каталога,
+по которой сервис ассистентов сбрасывает свой кэш ссылок
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .interface.put import bump_catalog_version
+from .models import List, Products, Satellite
+
+
+@receiver(post_save, sender=Products)
+@receiver(post_delete, sender=Products)
+@receiver(post_save, sender=Satellite)
+@receiver(post_delete, sender=Satellite)
+@receiver(post_save, sender=List)
+@receiver(post_delete, sender=List)
+def on_catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=Products.satelitDomens.through)
+def on_satellite_domains_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
@@ -1,7 +1,7 @@
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from .interface.get import get_related_products_by_domain, get_product_link_by_domain
+from .interface.get import get_related_products_by_domain, get_product_link_by_domain, get_catalog_version, get_catalog_documents
 from .interface.set import populate_products_from_data, populate_assistants_from_data, populate_products_from_csv, populate_base_config
 import json
 
@@ -129,6 +129,53 @@ def get_product_link(request):
         }, status=500)
 
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def catalog_version(request):
+    """
+    Получение версии каталога товаров
+    
+    Версия увеличивается при любом изменении товаров, сателлитов и связей.
+    Используется сервисом ассистентов для инвалидации кэша ссылок.
+    
+    Возвращает:
+        dict: {version: int, updated_at: str | None}
+    """
+    result = get_catalog_version()
+    
+    if result['success']:
+        return JsonResponse(result['data'], status=200)
+    else:
+        return JsonResponse({
+            'success': False,
+            'error': result['error']
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def catalog_documents(request):
+    """
+    Получение товаров домена с описаниями для поискового индекса сервиса ассистентов
+    
+    Входные параметры:
+        - domain_url/domain_title: str | None (title или URL домена, None/"main" = базовые ссылки)
+    
+    Возвращает:
+        list: [{title, link, description, relations}]
+    """
+    domain_url = request.GET.get('domain_url') or request.GET.get('domain_title')
+    result = get_catalog_documents(domain_url=domain_url)
+    
+    if result['success']:
+        return JsonResponse(result['data'], status=200, safe=False)
+    else:
+        return JsonResponse({
+            'success': False,
+            'error': result['error']
+        }, status=404)
+
+
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
 def populate_database(request):
@@ -1,7 +1,9 @@
 """
 Декораторы для авторизации и проверки прав доступа
 """
+import hmac
 from functools import wraps
+from django.conf import settings
 from django.http import JsonResponse
 
 
@@ -104,3 +106,25 @@ def admin_or_self_required(view_func):
         )
     return wrapper
 
+
+def service_token_required(view_func):
+    """
+    Декоратор для внутренних эндпоинтов микросервисов.
+    
+    Сравнивает заголовок X-Service-Token с SERVICE_API_TOKEN из .env.
+    Если токен не задан в настройках - эндпоинт недоступен (403).
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        expected_token = getattr(settings, 'SERVICE_API_TOKEN', '')
+        token = request.headers.get('X-Service-Token', '')
+        if not expected_token or not hmac.compare_digest(token.encode(), expected_token.encode()):
+            return JsonResponse(
+                {
+                    "success": False,
+                    "error": "Недействительный сервисный токен"
+                },
+                status=403
+            )
+        return view_func(request, *args, **kwargs)
+    return wrapper
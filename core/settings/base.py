@@ -131,3 +131,7 @@ API_BEARER_TOKEN = os.environ.get('API_BEARER_TOKEN', 'politaks-api-secret-token
 
 # Время жизни CSRF токена в секундах (по умолчанию 5 минут)
 CSRF_TOKEN_TTL = int(os.environ.get('CSRF_TOKEN_TTL', '300'))
+
+# Токен внутренних запросов микросервисов (заголовок X-Service-Token), например /api/assistants/models.
+# Пустой - такие эндпоинты отвечают 403
+SERVICE_API_TOKEN = os.environ.get('SERVICE_API_TOKEN', '')
@@ -2,16 +2,25 @@
 Интерфейс для работы с сервисом Assistants (порт 8001)
 """
 import os
+import json
+import time
 import httpx
-from typing import Optional
+from typing import AsyncIterator, Callable, Optional
 
 
 class AssistantsAPI:
     """Клиент для API сервиса Assistants"""
     
-    def __init__(self, base_url: str = None, timeout: float = 120.0):
+    def __init__(self, base_url: str = None, timeout: float = 120.0, on_event: Optional[Callable[[str, dict], None]] = None,
+                 deadline_margin: float = 2.0, user: Optional[str] = None):
         self.base_url = base_url or os.getenv('ASSISTANTS_API_URL', 'http://localhost:7999')
         self.timeout = timeout
+        # Сервис должен ответить 504 раньше, чем клиент перестанет ждать ответ по таймауту
+        self.deadline_margin = deadline_margin
+        # Если задан - запросы выполняются в режиме SSE, промежуточные события (start, delta) передаются в on_event
+        self.on_event = on_event
+        # Пользователь, от имени которого идет генерация: сервис делит слоты OpenAI поровну между пользователями
+        self.user = user
     
     def _normalize_domain(self, domain: Optional[str]) -> str:
         """Нормализует domain: None или пустая строка → 'main'"""
@@ -19,19 +28,82 @@ class AssistantsAPI:
             return "main"
         return domain
     
+    def _headers(self) -> dict:
+        """
+        Заголовки запроса: X-Request-Deadline (Unix time), после которого сервис прекращает генерацию,
+        ответ на которую клиент уже не дождется, и X-User-ID для планировщика вызовов OpenAI
+        """
+        headers = {"X-Request-Deadline": f"{time.time() + self.timeout - self.deadline_margin:.3f}"}
+        if self.user:
+            headers["X-User-ID"] = str(self.user)
+        return headers
+    
     async def _post(self, endpoint: str, payload: dict) -> dict:
         """Базовый POST запрос"""
+        if self.on_event:
+            return await self._post_stream(endpoint, json=payload)
         async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(f"{self.base_url}{endpoint}", json=payload)
+            response = await client.post(f"{self.base_url}{endpoint}", json=payload, headers=self._headers())
             response.raise_for_status()
             return response.json()
     
     async def _post_multipart(self, endpoint: str, data: dict, files: dict = None) -> dict:
         """POST запрос с multipart/form-data"""
+        if self.on_event:
+            return await self._post_stream(endpoint, data=data, files=files)
         async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(f"{self.base_url}{endpoint}", data=data, files=files)
+            response = await client.post(f"{self.base_url}{endpoint}", data=data, files=files, headers=self._headers())
             response.raise_for_status()
             return response.json()
+    
+    async def _post_stream(self, endpoint: str, **kwargs) -> dict:
+        """
+        POST запрос в режиме SSE (?stream=1)
+        
+        Промежуточные события передаются в on_event по мере поступления.
+        
+        Returns:
+            dict: итоговый ответ (событие result) в том же формате, что и без стриминга
+        """
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            async with client.stream(
+                "POST", f"{self.base_url}{endpoint}", params={"stream": 1}, headers=self._headers(), **kwargs,
+            ) as response:
+                response.raise_for_status()
+                event = "message"
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data = json.loads(line[len("data:"):].strip())
+                        if event == "result":
+                            return data
+                        if event == "error":
+                            raise RuntimeError(f"{data.get('status_code')} - {data.get('detail')}")
+                        self.on_event(event, data)
+        
+        raise RuntimeError(f"Поток {endpoint} завершился без результата")
+
+    async def batch(self, items: list, concurrency: Optional[int] = None) -> AsyncIterator[dict]:
+        """
+        Пакетная генерация (/api/v1/batch)
+        
+        Args:
+            items: [{"id": ..., "kind": "description", "request": {...}}, ...],
+                kind и request - как у одиночных эндпоинтов (фото work_results в base64)
+            concurrency: ограничение параллельности на стороне сервиса
+        
+        Yields:
+            dict: результат элемента {"index", "id", "kind", "status", "result" | "error"}
+                по мере готовности, последним - итог {"done": True, ...}
+        """
+        payload = {"items": items, "concurrency": concurrency}
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            async with client.stream("POST", f"{self.base_url}/api/v1/batch", json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
 
     # =========================================================================
     # /api/v1/change/...
@@ -13,10 +13,17 @@ class SheetsAPI:
         self.base_url = base_url or os.getenv('SHEETS_API_URL', 'http://localhost:7998')
         self.timeout = timeout  # Большой таймаут для обработки таблиц
     
-    async def _post(self, endpoint: str, payload: dict) -> dict:
+    async def _post(self, endpoint: str, payload: dict, params: dict = None) -> dict:
         """Базовый POST запрос"""
         async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(f"{self.base_url}{endpoint}", json=payload)
+            response = await client.post(f"{self.base_url}{endpoint}", json=payload, params=params)
+            response.raise_for_status()
+            return response.json()
+
+    async def _get(self, endpoint: str) -> dict:
+        """Базовый GET запрос"""
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(f"{self.base_url}{endpoint}")
             response.raise_for_status()
             return response.json()
 
@@ -29,6 +36,7 @@ class SheetsAPI:
         from_row: int = 3,
         to_row: int = -1,
         user_id: Optional[int] = None,
+        background: bool = False,
     ) -> dict:
         """
         Обработка одного листа Google таблицы
@@ -52,9 +60,12 @@ class SheetsAPI:
             from_row: Начальная строка (минимум 3)
             to_row: Конечная строка (-1 = до конца)
             user_id: ID пользователя
+            background: Только запустить задание, не дожидаясь завершения
+                (задание переживает перезапуск сервиса, состояние - get_job)
         
         Returns:
-            {"status_code": 200, "detail": "success"}
+            {"status_code": 200, "detail": "success", "job_id": "..."}
+            (с background=True - {"status_code": 202, "detail": "accepted", "job_id": "..."})
         """
         payload = {
             "llm_model": llm_model,
@@ -65,7 +76,18 @@ class SheetsAPI:
             "to_row": to_row,
             "user_id": user_id,
         }
-        return await self._post("/process/google_sheet", payload)
+        params = {"background": "true"} if background else None
+        return await self._post("/process/google_sheet", payload, params)
+
+    async def get_job(self, job_id: str) -> dict:
+        """
+        Состояние задания обработки листа
+        
+        Returns:
+            {"job_id": "...", "status": "pending|running|done|failed", "error": None,
+             "rows": {"pending": 0, "running": 0, "done": 10, "failed": 0, "unwritten": 0, "unsaved": 0}, ...}
+        """
+        return await self._get(f"/process/jobs/{job_id}")
 
     async def process_sheets(
         self,
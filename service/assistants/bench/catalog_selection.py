@@ -0,0 +1,154 @@
+"""Задержка change_tech_instruction со всем каталогом в промпте и с top-k товаров по BM25.
+
+Каталог - testData/csv (товары и связанные товары), Django API и OpenAI Responses API - локальная
+заглушка, которая отвечает сразу. Поэтому измеряется только то, что зависит от сервиса: запросы
+каталога, поиск по индексу и сборка промпта (p50/p99 в миллисекундах), и размер входа модели.
+Время обработки входа самой моделью без доступа к API не измерить, оно растет с числом входных
+токенов. Запуск из корня репозитория:
+
+    python service/assistants/bench/catalog_selection.py
+"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+CALLS = 200
+ROOT = Path(__file__).resolve().parents[3]
+TECH_INSTRUCTION = (
+    "Полиуретановый наливной пол наносится на подготовленное бетонное основание. Основание "
+    "обеспыливают и грунтуют полиуретановой грунтовкой, затем наносят базовый слой толщиной 2 мм "
+    "и финишный лак. Покрытие устойчиво к истиранию, маслам и топливу, подходит для цехов и складов."
+)
+SEO = ("наливной пол полиуретановый", "грунтовка для бетона", "лак для наливного пола")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PORT = free_port()
+STUB_URL = f"http://127.0.0.1:{PORT}"
+os.environ.update(
+    DEBUG="False",
+    OPENAI_API_KEY="bench",
+    OPENAI_BASE_URL=f"{STUB_URL}/v1",
+    DJANGO_API_URL=STUB_URL,
+    LLM_CACHE_ENABLED="false",
+    PRODUCT_LINKS_MODE="placeholders",
+)
+os.environ.pop("SERVICE_API_TOKEN", None)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src import llm_utils  # noqa: E402
+from src.rate_limiter import estimate_tokens  # noqa: E402
+
+
+def load_catalog() -> tuple[dict, list[dict]]:
+    with open(ROOT / "testData/csv/product.csv", encoding="utf-8") as f:
+        products = {row["name"]: row["main_link"] for row in csv.DictReader(f)}
+    relations: dict[str, list[str]] = {}
+    with open(ROOT / "testData/csv/link_product.csv", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            relations.setdefault(row["main_name"], []).append(row["relation_description"])
+    documents = [
+        {"title": title, "link": link, "description": "", "relations": "\n".join(relations.get(title, []))}
+        for title, link in products.items()
+    ]
+    return products, documents
+
+
+class Stub:
+    """Django API (каталог) и OpenAI Responses API, который запоминает размер входа."""
+
+    def __init__(self):
+        self.links, self.documents = load_catalog()
+        self.inputs: list[tuple[int, int]] = []
+        self.app = Starlette(routes=[
+            Route("/v1/responses", self.responses, methods=["POST"]),
+            Route("/api/products/link/", lambda request: JSONResponse(self.links)),
+            Route("/api/products/catalog/", lambda request: JSONResponse(self.documents)),
+            Route("/api/products/catalog-version/", lambda request: JSONResponse({"version": 1})),
+            Route("/api/assistants/limits", lambda request: JSONResponse({})),
+        ])
+
+
+    async def responses(self, request):
+        body = json.loads(await request.body())
+        chars = len(body.get("instructions") or "") + len(body.get("input") or "")
+        self.inputs.append((chars, estimate_tokens(body.get("instructions"), body.get("input"), 0)))
+        return JSONResponse({
+            "id": "resp_1", "object": "response", "created_at": 0, "model": body["model"], "status": "completed",
+            "output": [{
+                "id": "msg_1", "type": "message", "role": "assistant", "status": "completed",
+                "content": [{"type": "output_text", "text": "<p>Инструкция</p>", "annotations": []}],
+            }],
+            "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+            "usage": {
+                "input_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+                "input_tokens_details": {"cached_tokens": 0}, "output_tokens_details": {"reasoning_tokens": 0},
+            },
+        })
+
+
+def start_stub(stub: Stub) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub.app, host="127.0.0.1", port=PORT, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000
+
+
+async def run(agent: llm_utils.OpenAIAgent, stub: Stub, top_k: int) -> None:
+    llm_utils.CATALOG_TOP_K_BY_METHOD["change_tech_instruction"] = top_k
+    # Первый вызов заполняет кэш каталога и индекс, в замер не входит
+    await agent.change_tech_instruction("gpt-4.1", "main", TECH_INSTRUCTION, *SEO)
+    stub.inputs.clear()
+    durations = []
+    for _ in range(CALLS):
+        started = time.perf_counter()
+        await agent.change_tech_instruction("gpt-4.1", "main", TECH_INSTRUCTION, *SEO)
+        durations.append(time.perf_counter() - started)
+    chars, tokens = stub.inputs[-1]
+    label = "full catalog" if top_k <= 0 else f"top-{top_k}"
+    print(
+        f"{label:>12}: p50 {percentile(durations, 0.5):6.2f} ms  p99 {percentile(durations, 0.99):6.2f} ms  "
+        f"input {chars} chars (~{tokens} tokens)"
+    )
+
+
+async def main():
+    logging.disable(logging.WARNING)
+    stub = Stub()
+    server = start_stub(stub)
+    agent = llm_utils.OpenAIAgent()
+    await agent.startup()
+    try:
+        print(f"catalog: {len(stub.links)} products, {CALLS} calls per mode")
+        await run(agent, stub, 0)
+        await run(agent, stub, llm_utils.CATALOG_TOP_K)
+    finally:
+        await agent.shutdown()
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
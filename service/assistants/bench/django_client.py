@@ -0,0 +1,98 @@
+"""Задержка запросов каталога к Django API: клиент на каждый вызов против общего клиента с пулом.
+
+1000 последовательных и 1000 параллельных (по 50) запросов к локальной заглушке Django API,
+p50/p99 в миллисекундах. Запуск из корня репозитория:
+
+    python service/assistants/bench/django_client.py
+"""
+import asyncio
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+REQUESTS = 1000
+CONCURRENCY = 50
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PORT = free_port()
+DJANGO_API_URL = f"http://127.0.0.1:{PORT}"
+os.environ["DJANGO_API_URL"] = DJANGO_API_URL
+os.environ.setdefault("DEBUG", "False")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.other_utils import create_django_client, get_related_products  # noqa: E402
+
+
+async def links(request):
+    return JSONResponse({"product_name": {"x": {"link": "/x", "description": ""}}})
+
+
+def start_stub() -> uvicorn.Server:
+    app = Starlette(routes=[Route("/api/products/links/", links)])
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PORT, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def per_call_client():
+    # Как было до общего клиента: новое соединение на каждый запрос
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.get(f"{DJANGO_API_URL}/api/products/links/", params={"product_name": ["x"]})
+        return response.json()
+
+
+def percentiles(samples: list[float]) -> str:
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2] * 1000
+    p99 = samples[int(len(samples) * 0.99)] * 1000
+    return f"p50/p99 {p50:7.2f}/{p99:7.2f} ms"
+
+
+async def timed(fn) -> float:
+    started = time.perf_counter()
+    await fn()
+    return time.perf_counter() - started
+
+
+async def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    client = create_django_client()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def limited(fn) -> float:
+        async with semaphore:
+            return await timed(fn)
+
+    cases = (("per-call client", per_call_client), ("pooled client", lambda: get_related_products(client, "main", ["x"])))
+    for name, fn in cases:
+        sequential = [await timed(fn) for _ in range(REQUESTS)]
+        concurrent = await asyncio.gather(*(limited(fn) for _ in range(REQUESTS)))
+        print(f"{name:16} sequential {percentiles(sequential)} | {CONCURRENCY} concurrent {percentiles(concurrent)}")
+    await client.aclose()
+
+
+if __name__ == "__main__":
+    server = start_stub()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
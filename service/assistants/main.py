@@ -1,13 +1,57 @@
 
+import asyncio
+import base64
+import binascii
+import hmac
+import io
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import partial
+
 import openai
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile, status
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from src.batch import iter_batch
+from src.cancellation import ClientDisconnected, never_disconnect, run_until_disconnect
+from src.circuit_breaker import CircuitOpen, health
+from src.images import InvalidImageError
 from src.llm_utils import OpenAIAgent
+from src.metrics import CONTENT_TYPE, REGISTRY, metrics_middleware
 from src.models import *
-from src.settings import logger
+from src.resilience import (
+    DeadlineExceeded,
+    get_policy,
+    parse_deadline_header,
+    request_deadline,
+    request_route,
+    run_with_deadline,
+    start_deadline,
+)
+from src.response_cache import cache_bypass, is_cache_bypass_requested
+from src.scheduler import current_job, job_from_request
+from src.settings import BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, BATCH_MAX_ITEMS, SERVICE_API_TOKEN, logger
+from src.streaming import is_stream_requested, iter_sse
+from src.token_budget import TokenBudgetExceeded
+from src.transcripts import request_id
+
+agent = OpenAIAgent()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await agent.startup()
+    try:
+        yield
+    finally:
+        await agent.shutdown()
+
 
 app = FastAPI(
     title="Politaks assistants API",
     version="0.0.1",
+    lifespan=lifespan,
 )
 # app.add_middleware(
 #     CORSMiddleware,
@@ -17,12 +61,156 @@ app = FastAPI(
 #     allow_headers=["*"],
 # )
 
-agent = OpenAIAgent()
 
+app.middleware("http")(metrics_middleware)
+
+
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """Контекст запроса: ID для журнала (X-Request-ID), обход кэша ответов LLM
+    (Cache-Control: no-cache или ?no_cache=1), маршрут и дедлайн для политики повторов,
+    задание для планировщика вызовов OpenAI (X-Priority, X-User-ID, X-Job-ID).
+
+    Дедлайн - более ранний из дедлайна политики маршрута и X-Request-Deadline (Unix time),
+    который передает вызывающая сторона, чтобы не работать на ответ, который уже никто не ждет.
+    """
+    rid = request.headers.get("x-request-id") or uuid.uuid4().hex
+    deadline = time.monotonic() + get_policy(request.url.path).deadline
+    caller_deadline = parse_deadline_header(request.headers.get("x-request-deadline"))
+    if caller_deadline is not None:
+        if caller_deadline <= time.monotonic():
+            return JSONResponse(
+                {"detail": f"Error - {request.url.path} - X-Request-Deadline has already passed"},
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                headers={"X-Request-ID": rid},
+            )
+        deadline = min(deadline, caller_deadline)
+    rid_token = request_id.set(rid)
+    bypass_token = cache_bypass.set(is_cache_bypass_requested(request))
+    route_token = request_route.set(request.url.path)
+    deadline_token = request_deadline.set(deadline)
+    job_token = current_job.set(job_from_request(request, rid))
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = rid
+        return response
+    finally:
+        current_job.reset(job_token)
+        request_deadline.reset(deadline_token)
+        request_route.reset(route_token)
+        cache_bypass.reset(bypass_token)
+        request_id.reset(rid_token)
+
+
+@app.get("/api/v1/stats")
+async def stats_endpoint():
+    return {
+        "response_cache": agent.response_cache.stats(),
+        "single_flight": agent.single_flight.stats(),
+        "scheduler": agent.scheduler.stats(),
+        "rate_limiter": agent.rate_limiter.stats(),
+        "llm_router": agent.llm_router.stats(),
+        "resilience": agent.resilience.stats(),
+        "negative_rules": agent.negative_rules.stats(),
+        "prompt_cache": agent.prompt_cache.stats(),
+        "images": agent.images.stats(),
+        "token_budget": agent.token_budget.stats(),
+    }
+
+
+@app.get("/api/v1/health")
+async def health_endpoint():
+    """Состояние предохранителей OpenAI и Django (503, если генерация невозможна)."""
+    result = health()
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE if result["status"] == "unavailable" else status.HTTP_200_OK
+    return JSONResponse(result, status_code=status_code)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def require_service_token(x_service_token: str = Header(default="")):
+    """Доступ к служебным эндпоинтам по заголовку X-Service-Token = SERVICE_API_TOKEN (без токена закрыты)."""
+    if not SERVICE_API_TOKEN or not hmac.compare_digest(x_service_token.encode(), SERVICE_API_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недействительный сервисный токен")
+
+
+@app.get("/api/v1/transcripts", dependencies=[Depends(require_service_token)])
+async def transcripts_endpoint(
+    date_from: str | None = None,
+    date_to: str | None = None,
+    method: str | None = None,
+    product: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    """Поиск по журналу запросов к LLM (даты в формате YYYY-MM-DD).
+
+    Журнал содержит промпты и ответы, поэтому требуется заголовок X-Service-Token.
+    """
+    return await asyncio.to_thread(agent.transcripts.search, date_from, date_to, method, product, limit)
+
+
+def error_payload(route: str, e: Exception) -> dict:
+    """Ошибка генерации в виде {"status_code", "detail"} для SSE и пакетных ответов."""
+    if isinstance(e, DeadlineExceeded):
+        status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    elif isinstance(e, openai.APITimeoutError):
+        status_code = status.HTTP_408_REQUEST_TIMEOUT
+    elif isinstance(e, openai.APIConnectionError):
+        status_code = status.HTTP_502_BAD_GATEWAY
+    elif isinstance(e, InvalidImageError):
+        status_code = status.HTTP_400_BAD_REQUEST
+    elif isinstance(e, TokenBudgetExceeded):
+        status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    elif isinstance(e, CircuitOpen):
+        status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    elif isinstance(e, (openai.APIStatusError, HTTPException)):
+        status_code = e.status_code
+    else:
+        logger.exception(f"Exception - {route} - {e}")
+        return {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": f"Exception - {route} - {e}"}
+
+    detail = getattr(e, "message", None) or getattr(e, "detail", None) or str(e)
+    if not (isinstance(detail, str) and detail.startswith(f"Error - {route}")):
+        detail = f"Error - {route} - {detail}"
+    logger.error(detail)
+    return {"status_code": status_code, "detail": detail}
+
+
+async def run_generation(route: str, generate, http_request: Request, stream: bool = False):
+    """Выполнение генерации эндпоинта: SSE-поток по запросу клиента, иначе обычный ответ.
+
+    Генерация ограничена дедлайном запроса и отменяется, если клиент отключился.
+    Ошибки OpenAI и прочие исключения приводятся к HTTPException с кодом из error_payload().
+    """
+    if is_stream_requested(http_request, stream):
+        return sse_response(route, partial(run_with_deadline, generate))
 
-@app.post(route1:="/api/v1/change/subdescription", response_model=SubDescriptionResponse)
-async def change_subdescription_endpoint(request: SubDescriptionRequest):
     try:
+        return await run_until_disconnect(http_request, run_with_deadline(generate))
+    except ClientDisconnected as e:
+        # Ответ уже некому отправить, код 499 (как в nginx) остается в логах и метриках
+        raise HTTPException(status_code=499, detail=f"Error - {route} - {e}") from None
+    except Exception as e:
+        error = error_payload(route, e)
+        raise HTTPException(status_code=error["status_code"], detail=error["detail"]) from None
+
+
+def sse_response(route: str, generate) -> StreamingResponse:
+    """Ответ эндпоинта в виде SSE-потока (события start, delta, result, error)."""
+    return StreamingResponse(
+        iter_sse(generate, partial(error_payload, route)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post(route1:="/api/v1/change/subdescription", response_model=SubDescriptionResponse)
+async def change_subdescription_endpoint(request: SubDescriptionRequest, http_request: Request, stream: bool = False):
+    async def generate() -> SubDescriptionResponse:
         sub_description = await agent.get_sub_description(
             request.llm_model,
             request.domain,
@@ -37,38 +225,13 @@ async def change_subdescription_endpoint(request: SubDescriptionRequest):
         return SubDescriptionResponse(
             sub_description=sub_description,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route1} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route1} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route1} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route1} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route1} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route1} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route1} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route1} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route1}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route1} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route1} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route1} - {e}") from e
+
+    return await run_generation(route1, generate, http_request, stream)
 
 
 @app.post(route2:="/api/v1/change/description", response_model=DescriptionResponse)
-async def change_description_endpoint(request: DescriptionRequest):
-    try:
+async def change_description_endpoint(request: DescriptionRequest, http_request: Request, stream: bool = False):
+    async def generate() -> DescriptionResponse:
         description = await agent.get_description(
             request.llm_model,
             request.domain,
@@ -83,38 +246,13 @@ async def change_description_endpoint(request: DescriptionRequest):
         return DescriptionResponse(
             description=description,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route2} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route2} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route2} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route2} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route2} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route2} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route2} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route2} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route2}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route2} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route2} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route2} - {e}") from e
+
+    return await run_generation(route2, generate, http_request, stream)
 
 
 @app.post(route3:="/api/v1/change/usage", response_model=UsageResponse)
-async def change_usage_endpoint(request: UsageRequest):
-    try:
+async def change_usage_endpoint(request: UsageRequest, http_request: Request, stream: bool = False):
+    async def generate() -> UsageResponse:
         usage = await agent.get_usage(
             request.llm_model,
             request.domain,
@@ -125,38 +263,13 @@ async def change_usage_endpoint(request: UsageRequest):
         return UsageResponse(
             usage=usage,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route3} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route3} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route3} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route3} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route3} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route3} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route3} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route3} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route3}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route3} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route3} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route3} - {e}") from e
+
+    return await run_generation(route3, generate, http_request, stream)
 
 
 @app.post(route4:="/api/v1/change/features", response_model=FeaturesResponse)
-async def change_features_endpoint(request: FeaturesRequest):
-    try:
+async def change_features_endpoint(request: FeaturesRequest, http_request: Request, stream: bool = False):
+    async def generate() -> FeaturesResponse:
         features = await agent.get_features(
             request.llm_model,
             request.domain,
@@ -167,38 +280,13 @@ async def change_features_endpoint(request: FeaturesRequest):
         return FeaturesResponse(
             features=features,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route4} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route4} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route4} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route4} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route4} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route4} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route4} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route4} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route4}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route4} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route4} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route4} - {e}") from e
+
+    return await run_generation(route4, generate, http_request, stream)
 
 
 @app.post(route5:="/api/v1/create/previews", response_model=PreviewsResponse)
-async def create_previews_endpoint(request: PreviewsRequest):
-    try:
+async def create_previews_endpoint(request: PreviewsRequest, http_request: Request, stream: bool = False):
+    async def generate() -> PreviewsResponse:
         preview = await agent.get_preview(
             request.llm_model,
             request.domain,
@@ -213,38 +301,13 @@ async def create_previews_endpoint(request: PreviewsRequest):
         return PreviewsResponse(
             preview=preview,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route5} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route5} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route5} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route5} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route5} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route5} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route5} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route5} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route5}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route5} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route5} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route5} - {e}") from e
+
+    return await run_generation(route5, generate, http_request, stream)
 
 
 @app.post(route6:="/api/v1/create/reviews", response_model=ReviewsResponse)
-async def create_reviews_endpoint(request: ReviewsRequest):
-    try:
+async def create_reviews_endpoint(request: ReviewsRequest, http_request: Request, stream: bool = False):
+    async def generate() -> ReviewsResponse:
         reviews = await agent.get_reviews(
             request.llm_model,
             request.product_name,
@@ -258,37 +321,13 @@ async def create_reviews_endpoint(request: ReviewsRequest):
         return ReviewsResponse(
             **reviews,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route6} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route6} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route6} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route6} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route6} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route6} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route6} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route6} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route6}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route6} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route6} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route6} - {e}") from e
+
+    return await run_generation(route6, generate, http_request, stream)
 
 
 @app.post(route7:="/api/v1/create/work_results", response_model=WorkResultsResponse)
 async def create_work_results_endpoint(
+    http_request: Request,
     llm_model: str = Form(...),
     domain: str = Form(...),
     place_name: str = Form(...),
@@ -298,15 +337,17 @@ async def create_work_results_endpoint(
     descriptions: str = Form(...),
     photo1: UploadFile|str = File(None),
     photo2: UploadFile|str = File(None),
+    stream: bool = False,
 ):
-    try:
-        photo1_content = None
-        photo2_content = None
-        if photo1:
-            photo1_content = await photo1.read()
-        if photo2:
-            photo2_content = await photo2.read()
-
+    # Файлы читаются до запуска генерации: при стриминге форма закрывается раньше окончания ответа
+    photo1_content = None
+    photo2_content = None
+    if photo1:
+        photo1_content = await photo1.read()
+    if photo2:
+        photo2_content = await photo2.read()
+
+    async def generate() -> WorkResultsResponse:
         work_results = await agent.get_work_results(
             llm_model,
             domain,
@@ -322,38 +363,13 @@ async def create_work_results_endpoint(
         return WorkResultsResponse(
             work_results=work_results,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route7} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route7} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route7} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route7} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route7} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route7} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route7} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route7} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route7}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route7} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route7} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route7} - {e}") from e
+
+    return await run_generation(route7, generate, http_request, stream)
 
 
 @app.post(route8:="/api/v1/change/article", response_model=ChArticleResponse)
-async def change_article_endpoint(request: ChArticleRequest):
-    try:
+async def change_article_endpoint(request: ChArticleRequest, http_request: Request, stream: bool = False):
+    async def generate() -> ChArticleResponse:
         article = await agent.change_article(
             request.llm_model,
             request.title,
@@ -366,38 +382,13 @@ async def change_article_endpoint(request: ChArticleRequest):
         return ChArticleResponse(
             article=article,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route8} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route8} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route8} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route8} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route8} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route8} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route8} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route8} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route8}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route8} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route8} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route8} - {e}") from e
+
+    return await run_generation(route8, generate, http_request, stream)
 
 
 @app.post(route9:="/api/v1/create/article", response_model=ArticleResponse)
-async def create_article_endpoint(request: ArticleRequest):
-    try:
+async def create_article_endpoint(request: ArticleRequest, http_request: Request, stream: bool = False):
+    async def generate() -> ArticleResponse:
         article = await agent.get_article(
             request.llm_model,
             request.topic,
@@ -410,38 +401,13 @@ async def create_article_endpoint(request: ArticleRequest):
         return ArticleResponse(
             article=article,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route9} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route9} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route9} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route9} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route9} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route9} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route9} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route9} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route9}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route9} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route9} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route9} - {e}") from e
+
+    return await run_generation(route9, generate, http_request, stream)
 
 
 @app.post(route10:="/api/v1/change/tech_instruction", response_model=TechInstructionResponse)
-async def change_tech_instruction_endpoint(request: TechInstructionRequest):
-    try:
+async def change_tech_instruction_endpoint(request: TechInstructionRequest, http_request: Request, stream: bool = False):
+    async def generate() -> TechInstructionResponse:
         tech_instruction = await agent.change_tech_instruction(
             request.llm_model,
             request.domain,
@@ -454,38 +420,13 @@ async def change_tech_instruction_endpoint(request: TechInstructionRequest):
         return TechInstructionResponse(
             tech_instruction=tech_instruction,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route10} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route10} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route10} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route10} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route10} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route10} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route10} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route10} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route10}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route10} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route10} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route10} - {e}") from e
+
+    return await run_generation(route10, generate, http_request, stream)
 
 
 @app.post(route11:="/api/v1/change/category_description", response_model=CategoryDescriptionResponse)
-async def change_category_description_endpoint(request: CategoryDescriptionRequest):
-    try:
+async def change_category_description_endpoint(request: CategoryDescriptionRequest, http_request: Request, stream: bool = False):
+    async def generate() -> CategoryDescriptionResponse:
         category_description = await agent.change_category_description(
             request.llm_model,
             request.domain,
@@ -498,33 +439,85 @@ async def change_category_description_endpoint(request: CategoryDescriptionReque
         return CategoryDescriptionResponse(
             category_description=category_description,
         )
-    except openai.BadRequestError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route11} - {e.message}") from None
-    except openai.AuthenticationError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route11} - {e.message}") from None
-    except openai.PermissionDeniedError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route11} - {e.message}") from None
-    except openai.NotFoundError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route11} - {e.message}") from None
-    except openai.ConflictError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route11} - {e.message}") from None
-    except openai.UnprocessableEntityError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route11} - {e.message}") from None
-    except openai.RateLimitError as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Error - {route11} - {e.message}") from None
-    except openai.APITimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=f"Error - {route11} - {e.message}") from None
-    except openai.APIConnectionError as e:
-        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Error - {route7} - {e.message}") from None
-    except HTTPException as e:
-        if f"Error - {route11}" in e.detail:
-            logger.error(e.detail)
-        else:
-            logger.error(f"Error - {route11} - {e.detail}")
-        raise
-    except Exception as e:
-        logger.exception(f"Exception - {route11} - {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception - {route11} - {e}") from e
+
+    return await run_generation(route11, generate, http_request, stream)
+
+
+async def batch_work_results(request: WorkResultsRequest, http_request: Request):
+    try:
+        photos = [
+            UploadFile(io.BytesIO(base64.b64decode(photo, validate=True))) if photo else None
+            for photo in (request.photo1, request.photo2)
+        ]
+    except binascii.Error as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid base64 photo: {e}",
+        ) from None
+    return await create_work_results_endpoint(
+        http_request,
+        request.llm_model,
+        request.domain,
+        request.place_name,
+        request.location,
+        request.background_info,
+        request.products_name,
+        request.descriptions,
+        *photos,
+    )
+
+
+# Виды элементов пакета: модель запроса и обработчик одиночного эндпоинта
+BATCH_KINDS = {
+    "sub_description": (SubDescriptionRequest, change_subdescription_endpoint),
+    "description": (DescriptionRequest, change_description_endpoint),
+    "usage": (UsageRequest, change_usage_endpoint),
+    "features": (FeaturesRequest, change_features_endpoint),
+    "previews": (PreviewsRequest, create_previews_endpoint),
+    "reviews": (ReviewsRequest, create_reviews_endpoint),
+    "work_results": (WorkResultsRequest, batch_work_results),
+    "change_article": (ChArticleRequest, change_article_endpoint),
+    "article": (ArticleRequest, create_article_endpoint),
+    "tech_instruction": (TechInstructionRequest, change_tech_instruction_endpoint),
+    "category_description": (CategoryDescriptionRequest, change_category_description_endpoint),
+}
+
+
+@app.post(route12:="/api/v1/batch")
+async def batch_endpoint(request: BatchRequest):
+    """Пакетная генерация: элементы любых видов из BATCH_KINDS, результаты построчно в NDJSON."""
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Error - {route12} - too many items ({len(request.items)} > {BATCH_MAX_ITEMS})",
+        )
+    concurrency = min(request.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    # Пустой запрос для обработчиков: элементы пакета всегда выполняются без SSE
+    item_http_request = Request({"type": "http", "headers": [], "query_string": b""}, receive=never_disconnect)
+
+    async def run(item: BatchItem) -> dict:
+        # Бюджет времени отсчитывается для каждого элемента с момента его запуска
+        start_deadline(route12)
+        if item.kind not in BATCH_KINDS:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Unknown kind '{item.kind}'")
+        request_model, handler = BATCH_KINDS[item.kind]
+        try:
+            item_request = request_model.model_validate(item.request)
+        except ValidationError as e:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors(include_url=False)) from None
+        response = await handler(item_request, item_http_request)
+        return response.model_dump()
+
+    def on_error(e: Exception) -> dict:
+        # Ошибки одиночных эндпоинтов уже залогированы и содержат маршрут в detail
+        if isinstance(e, HTTPException):
+            return {"status_code": e.status_code, "detail": e.detail}
+        return error_payload(route12, e)
+
+    return StreamingResponse(
+        iter_batch(request.items, run, on_error, concurrency),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+from .models import BatchItem
+
+
+def batch_item_key(item: BatchItem) -> str:
+    """Ключ для дедупликации: одинаковые kind и тело запроса выполняются один раз."""
+    payload = json.dumps([item.kind, item.request], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def format_ndjson(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+async def iter_batch(
+    items: list[BatchItem],
+    run: Callable[[BatchItem], Awaitable[dict]],
+    on_error: Callable[[Exception], dict],
+    concurrency: int,
+) -> AsyncIterator[str]:
+    """Выполнение элементов пакета с ограничением параллельности и выдачей результатов в NDJSON.
+
+    Строки отдаются по мере завершения (порядок не сохраняется, в каждой есть index и id),
+    ошибка одного элемента не прерывает пакет. Последняя строка - итог с "done": true.
+    """
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    groups: dict[str, list[int]] = {}
+    for index, item in enumerate(items):
+        groups.setdefault(batch_item_key(item), []).append(index)
+
+    async def run_group(indexes: list[int]) -> tuple[list[int], bool, dict]:
+        async with semaphore:
+            try:
+                return indexes, True, await run(items[indexes[0]])
+            except Exception as e:
+                return indexes, False, on_error(e)
+
+    tasks = [asyncio.create_task(run_group(indexes)) for indexes in groups.values()]
+    succeeded = 0
+    failed = 0
+    try:
+        for future in asyncio.as_completed(tasks):
+            indexes, ok, payload = await future
+            for index in indexes:
+                line = {"index": index, "id": items[index].id, "kind": items[index].kind}
+                if ok:
+                    succeeded += 1
+                    line.update(status="ok", result=payload)
+                else:
+                    failed += 1
+                    line.update(status="error", error=payload)
+                yield format_ndjson(line)
+
+        yield format_ndjson({
+            "done": True,
+            "total": len(items),
+            "unique": len(groups),
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed": round(time.perf_counter() - started, 3),
+        })
+    finally:
+        # Клиент отключился - отменяем оставшиеся элементы
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,55 @@
+import asyncio
+from collections.abc import Awaitable
+from typing import Any
+
+from starlette.requests import Request
+
+from .settings import logger
+
+
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение до завершения обработки запроса."""
+
+
+async def never_disconnect() -> dict:
+    """Канал receive для внутренних запросов без соединения (например, элементов пакета)."""
+    await asyncio.Future()
+
+
+async def wait_disconnect(request: Request) -> None:
+    """Ожидание отключения клиента (тело запроса к этому моменту уже прочитано)."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def run_until_disconnect(request: Request, coro: Awaitable[Any]) -> Any:
+    """Выполнение coro с отменой, если клиент отключился раньше.
+
+    Отмена доходит до вызовов OpenAI (стрим закрывается, слот лимитера освобождается)
+    и незавершенных запросов к Django.
+
+    Raises:
+        ClientDisconnected: клиент отключился, coro отменена
+
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(wait_disconnect(request))
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if task.done():
+        return task.result()
+    if watcher.exception() is not None:
+        # Канал receive недоступен - отключение клиента не отслеживается
+        return await task
+
+    task.cancel()
+    # Дожидаемся освобождения ресурсов отмененной задачей
+    await asyncio.gather(task, return_exceptions=True)
+    logger.info(f"run_until_disconnect() - client disconnected from {request.url.path}, generation cancelled")
+    raise ClientDisconnected(f"client disconnected from {request.url.path}")
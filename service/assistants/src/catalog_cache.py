@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import httpx
+
+from .catalog_index import CatalogIndex
+from .other_utils import get_catalog_documents, get_catalog_version, get_products_links
+from .settings import CATALOG_CACHE_TTL, CATALOG_VERSION_CHECK_INTERVAL, logger
+
+
+class CatalogCache:
+    """Кэш ссылок и поисковых индексов товаров домена с инвалидацией по TTL и версии каталога Django.
+
+    Версия каталога запрашивается не чаще, чем раз в version_check_interval секунд,
+    поэтому в установившемся режиме запросы не обращаются к Django за каталогом.
+    """
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL, version_check_interval: float = CATALOG_VERSION_CHECK_INTERVAL):
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._entries: dict[str, tuple[int | None, float, dict]] = {}
+        self._indexes: dict[str, tuple[int | None, float, CatalogIndex]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._index_locks: dict[str, asyncio.Lock] = {}
+        self._version: int | None = None
+        self._version_checked_at = float("-inf")
+        self._version_lock = asyncio.Lock()
+
+
+    async def get_version(self, client: httpx.AsyncClient) -> int | None:
+        """Последняя известная версия каталога (с периодической сверкой с Django)."""
+        if time.monotonic() - self._version_checked_at < self.version_check_interval:
+            return self._version
+
+        async with self._version_lock:
+            if time.monotonic() - self._version_checked_at < self.version_check_interval:
+                return self._version
+
+            version = await get_catalog_version(client)
+            self._version_checked_at = time.monotonic()
+            if version is not None:
+                if self._version is not None and version != self._version:
+                    logger.info(f"CatalogCache - catalog version changed {self._version} -> {version}")
+                self._version = version
+            return self._version
+
+
+    async def get_products_links(self, client: httpx.AsyncClient, domain: str) -> dict:
+        """Словарь {название: ссылка} для всех товаров домена."""
+        key = domain or "main"
+        version = await self.get_version(client)
+
+        entry = self._entries.get(key)
+        if self._is_fresh(entry, version):
+            return entry[2]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if self._is_fresh(entry, version):
+                return entry[2]
+
+            links = await get_products_links(client, domain, ["_all"])
+            # Пустой каталог тоже кэшируется до смены версии, не кэшируется только ошибка запроса
+            if links is not None:
+                self._entries[key] = (version, time.monotonic(), links)
+            elif entry is not None:
+                logger.warning(f"CatalogCache - failed to refresh links for '{key}', serving stale data")
+                return entry[2]
+
+            return links or {}
+
+
+    async def get_index(self, client: httpx.AsyncClient, domain: str) -> CatalogIndex:
+        """Поисковый индекс товаров домена.
+
+        При смене версии каталога или истечении TTL индекс не строится заново,
+        а обновляется по изменившимся товарам.
+        """
+        key = domain or "main"
+        version = await self.get_version(client)
+
+        entry = self._indexes.get(key)
+        if self._is_fresh(entry, version):
+            return entry[2]
+
+        lock = self._index_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._indexes.get(key)
+            if self._is_fresh(entry, version):
+                return entry[2]
+
+            index = entry[2] if entry is not None else CatalogIndex()
+            documents = await get_catalog_documents(client, domain)
+            if documents:
+                stats = index.update(documents)
+                self._indexes[key] = (version, time.monotonic(), index)
+                logger.info(f"CatalogCache - index for '{key}' updated: {stats}")
+            elif entry is not None:
+                logger.warning(f"CatalogCache - failed to refresh index for '{key}', serving stale data")
+
+            return index
+
+
+    def invalidate(self, domain: str | None = None) -> None:
+        """Сброс кэша одного домена или всего кэша."""
+        # Индексы не удаляются: при следующем запросе они обновятся по изменившимся товарам
+        if domain is None:
+            self._entries.clear()
+            for key, (_, _, index) in self._indexes.items():
+                self._indexes[key] = (None, float("-inf"), index)
+        else:
+            self._entries.pop(domain or "main", None)
+            entry = self._indexes.get(domain or "main")
+            if entry is not None:
+                self._indexes[domain or "main"] = (None, float("-inf"), entry[2])
+        self._version_checked_at = float("-inf")
+
+
+    def _is_fresh(self, entry: tuple | None, version: int | None) -> bool:
+        if entry is None:
+            return False
+        entry_version, fetched_at, _ = entry
+        return entry_version == version and time.monotonic() - fetched_at < self.ttl
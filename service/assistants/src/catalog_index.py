@@ -0,0 +1,137 @@
+import hashlib
+import math
+import re
+from collections import Counter
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"[а-яa-z0-9]+")
+# Окончания и суффиксы русских слов (от длинных к коротким), отбрасываются при стемминге
+_SUFFIXES = sorted(
+    (
+        "остью", "ением", "ости", "ость", "ами", "ями", "ыми", "ими", "ого", "его", "ому", "ему",
+        "ние", "ния", "нию", "нии", "ой", "ей", "ый", "ий", "ая", "яя", "ое", "ее", "ые", "ие",
+        "ых", "их", "ую", "юю", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ия", "ию", "ии",
+        "ья", "ье", "ью", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+    ),
+    key=len,
+    reverse=True,
+)
+_MIN_STEM = 3
+_STOP_WORDS = frozenset((
+    "для", "при", "или", "как", "что", "это", "так", "том", "его", "она", "они", "под", "над", "без",
+    "все", "чем", "уже", "еще", "также", "после", "перед", "данной", "данного", "числе",
+))
+
+
+def stem(word: str) -> str:
+    """Упрощенный стемминг: отбрасывание самого длинного окончания с сохранением основы от 3 букв."""
+    if word.isascii():
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Основы слов текста (HTML теги удаляются, регистр и ё/е не различаются)."""
+    text = _TAG_RE.sub(" ", text or "").lower().replace("ё", "е")
+    return [stem(word) for word in _WORD_RE.findall(text) if len(word) > 1 and word not in _STOP_WORDS]
+
+
+class CatalogIndex:
+    """BM25 индекс товаров домена по названию, описанию и описаниям связей (List.description).
+
+    update() сравнивает новый каталог с проиндексированным по хэшу текста товара
+    и переиндексирует только добавленные, измененные и удаленные товары.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, k3: float = 1.5, title_weight: int = 3):
+        self.k1 = k1
+        self.b = b
+        self.k3 = k3
+        self.title_weight = title_weight
+        # название -> (хэш текста, частоты термов, длина в термах)
+        self._documents: dict[str, tuple[str, Counter, int]] = {}
+        # терм -> {название: частота}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._total_length = 0
+
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+
+    def update(self, documents: list[dict]) -> dict:
+        """Приведение индекса к списку товаров [{title, description, relations}].
+
+        Returns:
+            dict: число добавленных, обновленных и удаленных товаров
+
+        """
+        stats = {"added": 0, "updated": 0, "removed": 0}
+        seen = set()
+        for document in documents:
+            title = document.get("title")
+            if not title:
+                continue
+            seen.add(title)
+            text = "\n".join((title, document.get("description") or "", document.get("relations") or ""))
+            digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            current = self._documents.get(title)
+            if current is not None and current[0] == digest:
+                continue
+
+            if current is not None:
+                self._remove(title)
+                stats["updated"] += 1
+            else:
+                stats["added"] += 1
+            terms = Counter(tokenize(title) * self.title_weight)
+            terms.update(tokenize(document.get("description")))
+            terms.update(tokenize(document.get("relations")))
+            self._add(title, digest, terms)
+
+        for title in [title for title in self._documents if title not in seen]:
+            self._remove(title)
+            stats["removed"] += 1
+        return stats
+
+
+    def search(self, query: str, k: int) -> list[str]:
+        """Названия до k товаров, наиболее релевантных запросу (товары без совпадений не возвращаются)."""
+        if not self._documents:
+            return []
+        count = len(self._documents)
+        average_length = self._total_length / count or 1
+        scores: Counter = Counter()
+        for term, query_frequency in Counter(tokenize(query)).items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            # Повторы терма в запросе повышают его вес с насыщением (k3)
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            idf *= query_frequency * (self.k3 + 1) / (query_frequency + self.k3)
+            for title, frequency in postings.items():
+                length = self._documents[title][2]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[title] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return [title for title, _ in scores.most_common(k)]
+
+
+    def _add(self, title: str, digest: str, terms: Counter) -> None:
+        length = sum(terms.values())
+        self._documents[title] = (digest, terms, length)
+        self._total_length += length
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[title] = frequency
+
+
+    def _remove(self, title: str) -> None:
+        _, terms, length = self._documents.pop(title)
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(title, None)
+            if not postings:
+                del self._postings[term]
@@ -0,0 +1,226 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from pydantic import BaseModel
+
+from .metrics import CIRCUIT_REJECTED, CIRCUIT_STATE
+from .settings import (
+    CIRCUIT_BREAKER_ENABLED,
+    CIRCUIT_BREAKER_FAILURES,
+    CIRCUIT_BREAKER_MAX_RECOVERY,
+    CIRCUIT_BREAKER_POLICIES,
+    CIRCUIT_BREAKER_RECOVERY,
+    logger,
+)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Вызов отклонен без обращения к зависимости: предохранитель разомкнут."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit '{name}' is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BreakerPolicy(BaseModel):
+    failure_threshold: int = CIRCUIT_BREAKER_FAILURES
+    recovery_timeout: float = CIRCUIT_BREAKER_RECOVERY
+    # Пауза удваивается после каждого неудачного пробного вызова, но не больше max_recovery_timeout
+    max_recovery_timeout: float = CIRCUIT_BREAKER_MAX_RECOVERY
+    half_open_max_calls: int = 1
+
+
+# "openai" - ключи OpenAI (предохранитель "openai:<хэш ключа>"), "django" - Django API
+POLICIES = {
+    "default": BreakerPolicy(),
+    "openai": BreakerPolicy(),
+    "django": BreakerPolicy(recovery_timeout=15, max_recovery_timeout=120),
+}
+for _name, _overrides in CIRCUIT_BREAKER_POLICIES.items():
+    POLICIES[_name] = POLICIES.get(_name, POLICIES["default"]).model_copy(update=_overrides)
+
+
+def get_policy(name: str) -> BreakerPolicy:
+    return POLICIES.get(name, POLICIES.get(name.split(":")[0], POLICIES["default"]))
+
+
+class CircuitBreaker:
+    """Предохранитель зависимости: closed -> open -> half_open -> closed.
+
+    После failure_threshold ошибок подряд цепь размыкается, и вызовы сразу завершаются CircuitOpen.
+    По истечении паузы пропускается не больше half_open_max_calls пробных вызовов: успех замыкает цепь,
+    ошибка снова размыкает ее с удвоенной паузой. Отмененные вызовы не считаются ни успехом, ни ошибкой.
+    """
+
+    def __init__(self, name: str, policy: BreakerPolicy | None = None, enabled: bool = CIRCUIT_BREAKER_ENABLED):
+        self.name = name
+        self.policy = policy or get_policy(name)
+        self.enabled = enabled
+        self.failures = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self.last_error: str | None = None
+        self._state = CLOSED
+        self._opened_until = 0.0
+        self._recovery = self.policy.recovery_timeout
+        self._probes = 0
+        CIRCUIT_STATE.set(0, circuit=name)
+
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() >= self._opened_until:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+
+    def allows(self) -> bool:
+        """Пропустит ли предохранитель вызов сейчас (без резервирования пробного вызова)."""
+        state = self.state
+        return not self.enabled or state == CLOSED or (state == HALF_OPEN and self._probes < self.policy.half_open_max_calls)
+
+
+    def retry_after(self) -> float:
+        return max(self._opened_until - time.monotonic(), 0.0)
+
+
+    async def call(self, fn: Callable[[], Awaitable[Any]],
+        is_failure: Callable[[Exception], bool] | None = None,
+        is_failed_result: Callable[[Any], bool] | None = None,
+    ) -> Any:
+        """Вызов fn() через предохранитель.
+
+        is_failure(e) - считать ли исключение отказом зависимости (по умолчанию любое),
+        is_failed_result(result) - считать ли отказом успешно полученный результат (например, ответ 5xx).
+
+        Raises:
+            CircuitOpen: цепь разомкнута или лимит пробных вызовов исчерпан
+
+        """
+        if not self.enabled:
+            return await fn()
+
+        probe = self._admit()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._release(probe)
+            raise
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self._on_failure(probe, f"{type(e).__name__}: {e}")
+            else:
+                # Ошибка запроса (например, 400) - зависимость отвечает
+                self._on_success(probe)
+            raise
+
+        if is_failed_result is not None and is_failed_result(result):
+            self._on_failure(probe, f"bad result: {result!r}"[:200])
+        else:
+            self._on_success(probe)
+        return result
+
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+            "opened": self.opened,
+            "retry_after": round(self.retry_after(), 2),
+            "last_error": self.last_error,
+        }
+
+
+    def _admit(self) -> bool:
+        """Проверка перед вызовом. Возвращает True, если вызов пробный."""
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and self._probes < self.policy.half_open_max_calls:
+            self._probes += 1
+            return True
+        self.rejected += 1
+        CIRCUIT_REJECTED.inc(circuit=self.name)
+        raise CircuitOpen(self.name, self.retry_after())
+
+
+    def _release(self, probe: bool) -> None:
+        if probe:
+            self._probes -= 1
+
+
+    def _on_success(self, probe: bool) -> None:
+        self._release(probe)
+        if probe:
+            logger.info(f"CircuitBreaker - '{self.name}' recovered, closed")
+            self._recovery = self.policy.recovery_timeout
+            self._set_state(CLOSED)
+        # Успех вызова, начатого до размыкания, не замыкает цепь - это решают пробные вызовы
+        if self._state == CLOSED:
+            self.failures = 0
+
+
+    def _on_failure(self, probe: bool, error: str) -> None:
+        self._release(probe)
+        self.total_failures += 1
+        self.last_error = error
+        if probe:
+            self._recovery = min(self._recovery * 2, self.policy.max_recovery_timeout)
+            self._open()
+        elif self._state == CLOSED:
+            self.failures += 1
+            if self.failures >= self.policy.failure_threshold:
+                self._open()
+
+
+    def _open(self) -> None:
+        self.opened += 1
+        self._opened_until = time.monotonic() + self._recovery
+        self._set_state(OPEN)
+        logger.warning(f"CircuitBreaker - '{self.name}' opened for {self._recovery:.0f}s after: {self.last_error}")
+
+
+    def _set_state(self, state: str) -> None:
+        if state == CLOSED:
+            self.failures = 0
+        self._state = state
+        CIRCUIT_STATE.set(_STATE_VALUES[state], circuit=self.name)
+
+
+BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Общий для процесса предохранитель зависимости name."""
+    breaker = BREAKERS.get(name)
+    if breaker is None:
+        breaker = BREAKERS[name] = CircuitBreaker(name)
+    return breaker
+
+
+def health() -> dict:
+    """Состояние предохранителей для эндпоинта проверки здоровья.
+
+    status: ok - все цепи замкнуты, degraded - часть зависимостей недоступна,
+    unavailable - разомкнуты цепи всех ключей OpenAI (генерация невозможна).
+    """
+    circuits = {name: breaker.stats() for name, breaker in BREAKERS.items()}
+    openai_breakers = [breaker for name, breaker in BREAKERS.items() if name.startswith("openai:")]
+    if openai_breakers and not any(breaker.allows() for breaker in openai_breakers):
+        status = "unavailable"
+    elif any(circuit["state"] != CLOSED for circuit in circuits.values()):
+        status = "degraded"
+    else:
+        status = "ok"
+    return {"status": status, "circuits": circuits}
@@ -0,0 +1,176 @@
+import asyncio
+import base64
+import hashlib
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .settings import (
+    IMAGE_CACHE_ITEMS,
+    IMAGE_FORMAT,
+    IMAGE_MAX_BYTES,
+    IMAGE_MAX_EDGE,
+    IMAGE_PREPROCESS_ENABLED,
+    IMAGE_QUALITY,
+    IMAGE_WORKERS,
+    logger,
+)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+# Сигнатуры форматов, которые принимает OpenAI
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+class InvalidImageError(ValueError):
+    """Загруженный файл не является поддерживаемым изображением."""
+
+
+def detect_mime(data: bytes) -> str | None:
+    """MIME тип изображения по сигнатуре (JPEG, PNG, GIF, WebP)."""
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def to_data_url(data: bytes, mime: str) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+class ImageProcessor:
+    """Проверка и подготовка фото перед отправкой в OpenAI.
+
+    Фото поворачивается по EXIF, уменьшается до max_edge по длинной стороне и
+    перекодируется в JPEG/WebP с заданным качеством. Обработка выполняется в отдельном
+    пуле потоков, результаты кэшируются по хэшу содержимого.
+    Без Pillow фото только проверяются по сигнатуре и отправляются как есть.
+    """
+
+    def __init__(self,
+        enabled: bool = IMAGE_PREPROCESS_ENABLED, max_edge: int = IMAGE_MAX_EDGE, image_format: str = IMAGE_FORMAT,
+        quality: int = IMAGE_QUALITY, max_bytes: int = IMAGE_MAX_BYTES, cache_items: int = IMAGE_CACHE_ITEMS,
+        workers: int = IMAGE_WORKERS,
+    ):
+        if image_format not in _FORMATS:
+            raise ValueError(f"IMAGE_FORMAT must be one of {list(_FORMATS)}, got '{image_format}'")
+        self.enabled = enabled and Image is not None
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.cache_items = cache_items
+        self.workers = workers
+        self.processed = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._cache: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self._executor: ThreadPoolExecutor | None = None
+        if enabled and Image is None:
+            logger.warning("ImageProcessor - Pillow is not installed, images are sent without preprocessing")
+
+
+    async def prepare(self, data: bytes) -> tuple[bytes, str]:
+        """Подготовленное изображение и его MIME тип.
+
+        Raises:
+            InvalidImageError: файл слишком большой или не является изображением
+
+        """
+        if len(data) > self.max_bytes:
+            raise InvalidImageError(f"image is too large: {len(data)} bytes (max {self.max_bytes})")
+        mime = detect_mime(data)
+        if mime is None:
+            raise InvalidImageError("unsupported image format (expected JPEG, PNG, GIF or WebP)")
+        if not self.enabled:
+            return data, mime
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="images")
+        loop = asyncio.get_running_loop()
+        # Хэш файла до max_bytes тоже считается в пуле, не задерживая event loop
+        key = await loop.run_in_executor(self._executor, _digest, data)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+
+        result = await loop.run_in_executor(self._executor, self._process, data, mime)
+
+        self.processed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(result[0])
+        self._cache[key] = result
+        if len(self._cache) > self.cache_items:
+            self._cache.popitem(last=False)
+        return result
+
+
+    async def to_data_url(self, data: bytes) -> str:
+        return to_data_url(*await self.prepare(data))
+
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "processed": self.processed,
+            "cache_hits": self.cache_hits,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+    def _process(self, data: bytes, mime: str) -> tuple[bytes, str]:
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.load()
+                # Анимацию не трогаем (перекодирование оставило бы только первый кадр)
+                if getattr(image, "is_animated", False):
+                    return data, mime
+                rotated = image.getexif().get(0x0112, 1) != 1
+                image = ImageOps.exif_transpose(image)
+                resized = max(image.size) > self.max_edge
+                image.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+                if image.mode in ("RGBA", "LA", "P"):
+                    image = image.convert("RGBA")
+                    background = Image.new("RGB", image.size, (255, 255, 255))
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+                elif image.mode != "RGB":
+                    image = image.convert("RGB")
+
+                pil_format, out_mime = _FORMATS[self.image_format]
+                output = io.BytesIO()
+                image.save(output, pil_format, quality=self.quality, optimize=True)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise InvalidImageError(f"cannot decode image: {e}") from None
+
+        result = output.getvalue()
+        # Небольшое фото без поворота, которое после перекодирования не стало меньше, отправляется как есть
+        if not (rotated or resized) and len(result) >= len(data):
+            return data, mime
+        return result, out_mime
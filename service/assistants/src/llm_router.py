@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+import openai
+from cryptography.fernet import Fernet, InvalidToken
+from openai import AsyncOpenAI
+
+from .circuit_breaker import BREAKERS, CircuitOpen, get_breaker
+from .other_utils import get_llm_endpoints
+from .rate_limiter import retry_after
+from .settings import (
+    ENCRYPTION_KEY,
+    LLM_ROUTER_BAN,
+    LLM_ROUTER_COOLDOWN,
+    LLM_ROUTER_ENABLED,
+    LLM_ROUTER_REFRESH,
+    OPENAI_API_KEY,
+    PROXY,
+    SERVICE_API_TOKEN,
+    logger,
+)
+from .streaming import deltas_sent
+
+# Пути эндпоинтов, которые могут быть указаны в Models.url вместо базового адреса API
+_API_PATHS = ("/chat/completions", "/completions", "/responses")
+
+
+def base_url(url: str | None) -> str | None:
+    """Базовый адрес API для AsyncOpenAI (None - адрес OpenAI по умолчанию)."""
+    url = (url or "").strip().rstrip("/")
+    for path in _API_PATHS:
+        if url.endswith(path):
+            url = url[: -len(path)]
+            break
+    return url or None
+
+
+def key_id(api_key: str | None) -> str:
+    """Хэш ключа: лимиты OpenAI действуют на ключ, в статистике ключ виден только по хэшу."""
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:8]
+
+
+def is_failover_error(e: Exception) -> bool:
+    """Ошибки ключа или сервера, при которых запрос переносится на другой ключ: сеть, 401, 403, 429 и 5xx."""
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in (401, 403, 429) or e.status_code >= 500
+    return isinstance(e, CircuitOpen)
+
+
+def is_outage_error(e: Exception) -> bool:
+    """Отказы, которые учитывает предохранитель ключа: сеть, таймауты и 5xx (но не 429 и не ошибки ключа)."""
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+class Endpoint:
+    """Клиент OpenAI с собственным пулом соединений для пары (базовый адрес, ключ)."""
+
+    def __init__(self, url: str | None, api_key: str | None, event_hooks: dict | None = None):
+        self.base_url = url
+        self.key_id = key_id(api_key)
+        self.breaker = get_breaker(f"openai:{self.key_id}")
+        self.models: list[str] = []
+        # Повторы выполняет Resilience с учетом дедлайна запроса, встроенные повторы SDK отключены
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=url,
+            http_client=httpx.AsyncClient(proxy=PROXY if PROXY else None, event_hooks=event_hooks),
+            max_retries=0,
+        )
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+    def stats(self) -> dict:
+        return {
+            "key": self.key_id,
+            "host": urlsplit(self.base_url).netloc if self.base_url else "api.openai.com",
+            "models": self.models,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "cooldown": round(max(self.cooldown_until - time.monotonic(), 0), 2),
+            "circuit": self.breaker.state,
+        }
+
+
+class LLMRouter:
+    """Распределение вызовов OpenAI по ключам активных моделей из Django (Models).
+
+    Строки Models с одинаковым названием - ключи (и адреса API) одной модели. Вызов получает ключ
+    с наименьшим числом выполняющихся запросов относительно веса ключа (лимита запросов в минуту,
+    который лимитер узнал из заголовков OpenAI). При 429, 5xx, 401/403 и ошибках сети ключ
+    ставится на паузу, а вызов сразу переносится на следующий ключ. Ключи с разомкнутым
+    предохранителем (см. CircuitBreaker) не используются, пока он не пропустит пробный вызов.
+
+    Список моделей перечитывается из Django не чаще раза в refresh секунд и применяется, только если
+    изменилась его версия. Клиенты ключей, оставшихся в списке, переиспользуются; клиенты удаленных
+    ключей закрываются после завершения их запросов. Для моделей без строк Models (и при недоступном
+    Django до первой загрузки) используется ключ OPENAI_API_KEY.
+    """
+
+    def __init__(self, event_hooks: dict | None = None, enabled: bool = LLM_ROUTER_ENABLED,
+        refresh: float = LLM_ROUTER_REFRESH, cooldown: float = LLM_ROUTER_COOLDOWN, ban: float = LLM_ROUTER_BAN,
+    ):
+        self.event_hooks = event_hooks
+        # Эндпоинт ключей Django закрыт сервисным токеном: без него используется только OPENAI_API_KEY
+        self.enabled = enabled and bool(SERVICE_API_TOKEN)
+        if enabled and not SERVICE_API_TOKEN:
+            logger.warning("LLMRouter - SERVICE_API_TOKEN is not set, Models keys are not loaded (OPENAI_API_KEY only)")
+        self.refresh = refresh
+        self.cooldown = cooldown
+        self.ban = ban
+        self.default = Endpoint(None, OPENAI_API_KEY, event_hooks)
+        self.version: str | None = None
+        self.reloads = 0
+        self.failovers = 0
+        self._endpoints: dict[tuple[str | None, str], Endpoint] = {}
+        self._routes: dict[str, list[Endpoint]] = {}
+        self._retired: list[Endpoint] = []
+        # Зашифрованный ключ -> расшифрованный (None - расшифровать не удалось)
+        self._keys: dict[str, str | None] = {}
+        self._fernet: Fernet | None = None
+        self._checked_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+
+    async def endpoints(self, client: httpx.AsyncClient, model: str) -> list[Endpoint]:
+        """Ключи модели (при необходимости список моделей перечитывается из Django)."""
+        await self._refresh(client)
+        return self._routes.get(model.strip().lower()) or [self.default]
+
+
+    def order(self, endpoints: list[Endpoint], weight: Callable[[Endpoint], float]) -> list[Endpoint]:
+        """Порядок попыток: доступные ключи по (outstanding + 1) / weight, затем ключи на паузе.
+
+        Raises:
+            CircuitOpen: предохранители всех ключей разомкнуты
+
+        """
+        allowed = [endpoint for endpoint in endpoints if endpoint.breaker.allows()]
+        if not allowed:
+            breaker = min((endpoint.breaker for endpoint in endpoints), key=lambda breaker: breaker.retry_after())
+            raise CircuitOpen(breaker.name, breaker.retry_after())
+        endpoints = allowed
+        now = time.monotonic()
+        ready = [endpoint for endpoint in endpoints if endpoint.cooldown_until <= now]
+        ready.sort(key=lambda endpoint: ((endpoint.outstanding + 1) / max(weight(endpoint), 1e-9), endpoint.requests))
+        cooling = sorted(
+            (endpoint for endpoint in endpoints if endpoint.cooldown_until > now),
+            key=lambda endpoint: endpoint.cooldown_until,
+        )
+        return ready + cooling
+
+
+    async def call(self, client: httpx.AsyncClient, model: str,
+        fn: Callable[[Endpoint, bool], Awaitable[Any]], weight: Callable[[Endpoint], float],
+    ) -> Any:
+        """Выполнение вызова fn(endpoint, last) с переносом на следующий ключ модели при ошибке ключа.
+
+        last=True - ключей для переноса больше нет (например, лимитер может вернуть вызов в свою очередь).
+        """
+        endpoints = self.order(await self.endpoints(client, model), weight)
+        for index, endpoint in enumerate(endpoints):
+            last = index == len(endpoints) - 1
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            sent = deltas_sent()
+            try:
+                return await endpoint.breaker.call(lambda: fn(endpoint, last), is_failure=is_outage_error)
+            except Exception as e:
+                if not is_failover_error(e):
+                    raise
+                # Пробный вызов ключа уже занят другим запросом - ключ пропускается без паузы
+                if not isinstance(e, CircuitOpen):
+                    endpoint.failures += 1
+                    self._cool_down(endpoint, e)
+                # Часть ответа уже ушла в SSE-поток - другой ключ начал бы ответ заново
+                if last or deltas_sent() > sent:
+                    raise
+                self.failovers += 1
+                logger.warning(f"LLMRouter - {type(e).__name__} for key {endpoint.key_id} ({model}), failover")
+            finally:
+                endpoint.outstanding -= 1
+
+
+    async def shutdown(self) -> None:
+        for endpoint in {self.default, *self._endpoints.values(), *self._retired}:
+            await endpoint.client.close()
+        self._endpoints = {}
+        self._routes = {}
+        self._retired = []
+
+
+    def stats(self) -> dict:
+        endpoints = [self.default, *self._endpoints.values()]
+        return {
+            "enabled": self.enabled,
+            "version": self.version,
+            "reloads": self.reloads,
+            "failovers": self.failovers,
+            "retired": len(self._retired),
+            "endpoints": [endpoint.stats() for endpoint in endpoints],
+        }
+
+
+    def _cool_down(self, endpoint: Endpoint, e: Exception) -> None:
+        status_code = getattr(e, "status_code", None)
+        if status_code in (401, 403) or getattr(e, "code", None) == "insufficient_quota":
+            seconds = self.ban
+        else:
+            response = getattr(e, "response", None)
+            seconds = self.cooldown
+            if status_code == 429 and response is not None:
+                seconds = max(seconds, retry_after(response.headers))
+        endpoint.cooldown_until = max(endpoint.cooldown_until, time.monotonic() + seconds)
+
+
+    async def _refresh(self, client: httpx.AsyncClient) -> None:
+        if not self.enabled or time.monotonic() - self._checked_at < self.refresh:
+            return
+
+        async with self._lock:
+            if time.monotonic() - self._checked_at < self.refresh:
+                return
+            data = await get_llm_endpoints(client)
+            # При недоступном Django остается прежний список до следующей попытки
+            self._checked_at = time.monotonic()
+            if data is not None and data.get("version") != self.version:
+                self._load(data)
+            await self._close_retired()
+
+
+    def _load(self, data: dict) -> None:
+        endpoints: dict[tuple[str | None, str], Endpoint] = {}
+        routes: dict[str, list[Endpoint]] = {}
+        keys = {}
+        for row in data.get("models") or []:
+            encrypted_key = row.get("encrypted_key") or ""
+            api_key = keys[encrypted_key] = self._decrypt(encrypted_key)
+            if not api_key:
+                logger.warning(f"LLMRouter - cannot decrypt key of model {row.get('id')} ({row.get('name')}), skipped")
+                continue
+            key = (base_url(row.get("url")), api_key)
+            endpoint = endpoints.get(key) or self._endpoints.get(key) or Endpoint(key[0], api_key, self.event_hooks)
+            endpoints[key] = endpoint
+            route = routes.setdefault((row.get("name") or "").strip().lower(), [])
+            if endpoint not in route:
+                route.append(endpoint)
+
+        for endpoint in endpoints.values():
+            endpoint.models = sorted(name for name, route in routes.items() if endpoint in route)
+        self._retired.extend(endpoint for key, endpoint in self._endpoints.items() if key not in endpoints)
+        self._endpoints = endpoints
+        self._routes = routes
+        self._keys = keys
+        self.version = data.get("version")
+        self.reloads += 1
+        logger.info(f"LLMRouter - loaded {len(endpoints)} keys for {len(routes)} models (version {self.version})")
+
+
+    def _decrypt(self, encrypted_key: str) -> str | None:
+        """Ключ расшифровывается один раз на значение Models.encrypted_key."""
+        if encrypted_key in self._keys:
+            return self._keys[encrypted_key]
+        if not encrypted_key or not ENCRYPTION_KEY:
+            return None
+        try:
+            if self._fernet is None:
+                self._fernet = Fernet(ENCRYPTION_KEY.encode())
+            return self._fernet.decrypt(encrypted_key.encode()).decode()
+        except (InvalidToken, ValueError) as e:
+            logger.error(f"LLMRouter - key decryption error: {type(e).__name__}")
+            return None
+
+
+    async def _close_retired(self) -> None:
+        """Закрытие клиентов удаленных ключей, у которых не осталось выполняющихся запросов."""
+        idle = [endpoint for endpoint in self._retired if endpoint.outstanding == 0]
+        self._retired = [endpoint for endpoint in self._retired if endpoint.outstanding > 0]
+        active = {endpoint.key_id for endpoint in (self.default, *self._endpoints.values(), *self._retired)}
+        for endpoint in idle:
+            await endpoint.client.close()
+            if endpoint.key_id not in active:
+                BREAKERS.pop(endpoint.breaker.name, None)
@@ -1,71 +1,309 @@
 
-import base64
+import asyncio
+import contextvars
 import json
 import time
 
 import httpx
 from openai import AsyncOpenAI
 
+from .catalog_cache import CatalogCache
+from .images import ImageProcessor
 from .llm_instructions import *
+from .llm_router import Endpoint, LLMRouter
+from .metrics import (
+    OPENAI_ERRORS,
+    OPENAI_REQUEST_DURATION,
+    OPENAI_REQUESTS_IN_FLIGHT,
+    OPENAI_TIME_TO_FIRST_TOKEN,
+    record_usage,
+)
 from .models import ReviewsResponse
-from .other_utils import get_products_links, get_related_products
-from .settings import LOGS_DIR, OPENAI_API_KEY, PROXY, logger
+from .negative_rules import RuleEngine
+from .other_utils import create_django_client, get_products_links, get_related_products
+from .product_links import format_products_list, resolve_product_markers
+from .prompt_cache import PromptCacheStats
+from .rate_limiter import RateLimiter, estimate_tokens
+from .resilience import Resilience, request_deadline
+from .response_cache import ResponseCache, cache_bypass
+from .scheduler import Scheduler, current_job, priority_rank
+from .single_flight import SingleFlight
+from .settings import (
+    CATALOG_TOP_K,
+    CATALOG_TOP_K_BY_METHOD,
+    IMAGE_DETAIL,
+    NEGATIVE_PASS_MODE,
+    NEGATIVE_PASS_MODES,
+    PRODUCT_LINKS_MODE,
+    RATE_LIMIT_CHARS_PER_TOKEN,
+    RATE_LIMIT_OUTPUT_TOKENS,
+    logger,
+)
+from .streaming import emit, stream_sink
+from .token_budget import AssistantLimits, TokenBudget
+from .transcripts import TranscriptStore
+
+
+def _shared_context() -> contextvars.Context:
+    """Контекст общего вызова SingleFlight: без дедлайна и SSE-потока вызвавшего его запроса.
+
+    Каждый ожидающий ограничен своим дедлайном (run_with_deadline), общий вызов - политикой маршрута.
+    """
+    context = contextvars.copy_context()
+    context.run(request_deadline.set, None)
+    context.run(stream_sink.set, None)
+    return context
 
 
 class OpenAIAgent:
     def __init__(self):
-        _http_client = httpx.AsyncClient(proxy=PROXY if PROXY else None)
-        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_http_client)
+        self.rate_limiter = RateLimiter()
+        # Очередь вызовов OpenAI: интерактивные генерации раньше фоновых, фоновые задания делят слоты поровну
+        self.scheduler = Scheduler()
+        # Клиенты OpenAI по ключам моделей из Django (Models), лимиты обновляются по заголовкам ответов
+        self.llm_router = LLMRouter(event_hooks={"response": [self.rate_limiter.on_response]})
+        # 429 повторяет лимитер (возврат в очередь), Resilience - только остальные временные ошибки
+        self.resilience = Resilience(retry_rate_limits=not self.rate_limiter.enabled)
+        self._django_client: httpx.AsyncClient | None = None
+        self.catalog_cache = CatalogCache()
+        self.response_cache = ResponseCache()
+        self.single_flight = SingleFlight()
+        self.transcripts = TranscriptStore()
+        self.negative_rules = RuleEngine()
+        self.prompt_cache = PromptCacheStats()
+        self.images = ImageProcessor()
+        self.token_budget = TokenBudget()
+        self.assistant_limits = AssistantLimits()
+
+
+    @property
+    def django_client(self) -> httpx.AsyncClient:
+        """Общий пул соединений к Django API (создается лениво, если не было startup())."""
+        if self._django_client is None or self._django_client.is_closed:
+            self._django_client = create_django_client()
+        return self._django_client
+
+
+    async def startup(self) -> None:
+        """Инициализация долгоживущих ресурсов агента (вызывается из lifespan)."""
+        _ = self.django_client
+        await self.transcripts.start()
+
+
+    async def shutdown(self) -> None:
+        """Закрытие пулов соединений агента."""
+        await self.transcripts.stop()
+        if self._django_client is not None:
+            await self._django_client.aclose()
+            self._django_client = None
+        self.response_cache.close()
+        self.images.shutdown()
+        await self.llm_router.shutdown()
 
 
     async def get_llm_answer(self,
         instruction: str|None=None, prompt: str|None=None, text_format=None,
         model: str="gpt-4.1", temperature: float|None = None,
+        method: str|None = None, product_name: str|None = None, max_output_tokens: int|None = None,
     ):
-        """Функция для отправки запроса в OpenAI API."""
+        """Функция для отправки запроса в OpenAI API.
+
+        method и product_name используются для журнала запросов (см. TranscriptStore),
+        method также передается в OpenAI как prompt_cache_key. Если max_output_tokens не задан,
+        берется Assistant.maks_token ассистента метода из Django.
+
+        OpenAI кэширует общий префикс запросов, поэтому промпты собираются от стабильного к изменчивому:
+        инструкция и общий для домена каталог, затем данные строки (связанные товары, поля, SEO-теги,
+        подобранные для строки товары).
+        """
+        started = time.perf_counter()
         try:
             logger.info(f"get_llm_answer() PROMPT = {prompt}")
-            if text_format:
-                response = await self.client.responses.parse(
+            if max_output_tokens is None:
+                max_output_tokens = await self.assistant_limits.max_output_tokens(self.django_client, method, model)
+            request_key = self.response_cache.make_key(model, instruction, temperature, prompt, text_format, max_output_tokens)
+            if self.response_cache.enabled and not cache_bypass.get():
+                cached_response = await self.response_cache.get(request_key)
+                if cached_response is not None:
+                    logger.info(f"get_llm_answer() cache hit - {request_key}")
+                    await emit("start", {"model": model, "cached": True})
+                    await emit("delta", {"text": cached_response.output_text})
+                    self.transcripts.record(method, model, cached_response, time.perf_counter() - started, "cache", product_name)
+                    return cached_response
+
+            def request():
+                return self._request_llm_answer(
+                    request_key, instruction, prompt, text_format, model, temperature, method, max_output_tokens,
+                )
+
+            # Одновременные одинаковые запросы ждут один общий вызов OpenAI. Вызов со стримингом
+            # не объединяется: дельты ответа уходят только в SSE-поток своего запроса
+            if stream_sink.get() is not None:
+                response, shared = await request(), False
+            else:
+                response, shared = await self.single_flight.do(
+                    request_key, request, context=_shared_context(), rank=priority_rank(current_job.get()),
+                )
+            if shared:
+                logger.info(f"get_llm_answer() coalesced - {request_key}")
+
+        except Exception as e:
+            logger.error(f"Exception get_llm_answer() - {e}")
+            raise
+        else:
+            self.transcripts.record(
+                method, model, response, time.perf_counter() - started,
+                "coalesced" if shared else "openai", product_name,
+            )
+            return response
+
+
+    async def _request_llm_answer(self, request_key: str, instruction: str|None, prompt: str|None, text_format,
+        model: str, temperature: float|None, method: str|None = None, max_output_tokens: int|None = None,
+    ):
+        cost = estimate_tokens(instruction, prompt, max_output_tokens or RATE_LIMIT_OUTPUT_TOKENS)
+
+        async def call(endpoint: Endpoint, last: bool):
+            # Пока есть другие ключи модели, 429 переносит вызов на них, а не в очередь лимитера
+            return await self.rate_limiter.run(
+                endpoint.key_id, model, cost,
+                lambda: self._call_llm(endpoint.client, instruction, prompt, text_format, model, temperature, method, max_output_tokens),
+                requeue=last,
+            )
+
+        async def request():
+            # Хеджирование не используется при стриминге (дельты уже уходят клиенту)
+            # и когда лимитеры всех ключей модели и так держат запросы в очереди
+            endpoints = await self.llm_router.endpoints(self.django_client, model)
+            hedge = stream_sink.get() is None and not all(
+                self.rate_limiter.get(endpoint.key_id, model).waiting for endpoint in endpoints
+            )
+            return await self.resilience.call(
+                model,
+                lambda: self.llm_router.call(
+                    self.django_client, model, call,
+                    weight=lambda endpoint: self.rate_limiter.get(endpoint.key_id, model).rpm,
+                ),
+                hedge=hedge,
+            )
+
+        # Слот планировщика занимается на весь вызов вместе с повторами
+        response = await self.scheduler.run(cost, request)
+        self.prompt_cache.record(method, response)
+
+        if self.response_cache.enabled:
+            await self.response_cache.set(request_key, response)
+        return response
+
+
+    async def _call_llm(self, client: AsyncOpenAI, instruction: str|None, prompt: str|None, text_format, model: str,
+        temperature: float|None, method: str|None = None, max_output_tokens: int|None = None,
+    ):
+        # Запросы одного ассистента направляются на одни и те же серверы OpenAI, где лежит их префикс
+        kwargs = {"prompt_cache_key": method} if method else {}
+        if max_output_tokens:
+            kwargs["max_output_tokens"] = max_output_tokens
+        started = time.perf_counter()
+        OPENAI_REQUESTS_IN_FLIGHT.inc(model=model)
+        try:
+            if stream_sink.get() is not None:
+                response = await self._stream_llm_answer(client, instruction, prompt, text_format, model, temperature, method, **kwargs)
+            elif text_format:
+                response = await client.responses.parse(
                     input=prompt,
                     model=model,
                     text_format=text_format,
                     instructions=instruction,
                     store=False,
                     temperature=temperature,
+                    **kwargs,
                 )
             else:
-                response = await self.client.responses.create(
+                response = await client.responses.create(
                     input=prompt,
                     model=model,
                     instructions=instruction,
                     store=False,
                     temperature=temperature,
+                    **kwargs,
                 )
-
+        except asyncio.CancelledError:
+            OPENAI_ERRORS.inc(model=model, error="CancelledError")
+            raise
         except Exception as e:
-            logger.error(f"Exception get_llm_answer() - {e}")
+            OPENAI_ERRORS.inc(model=model, error=type(e).__name__)
             raise
         else:
+            OPENAI_REQUEST_DURATION.observe(time.perf_counter() - started, model=model, method=method or "unknown")
+            record_usage(model, method, response)
             return response
+        finally:
+            OPENAI_REQUESTS_IN_FLIGHT.dec(model=model)
+
+
+    async def _stream_llm_answer(self, client: AsyncOpenAI, instruction: str|None, prompt: str|None, text_format, model: str,
+        temperature: float|None, method: str|None = None, **kwargs,
+    ):
+        """Запрос в OpenAI API в режиме стриминга с трансляцией дельт текста в SSE-поток."""
+        if text_format:
+            kwargs["text_format"] = text_format
+        await emit("start", {"model": model})
+        started = time.perf_counter()
+        first_token = True
+        async with client.responses.stream(
+            input=prompt,
+            model=model,
+            instructions=instruction,
+            store=False,
+            temperature=temperature,
+            **kwargs,
+        ) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    if first_token:
+                        first_token = False
+                        OPENAI_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, model=model, method=method or "unknown")
+                    await emit("delta", {"text": event.delta})
+            return await stream.get_final_response()
+
+
+    async def fit_budget(self, llm_model: str, method: str, **fields) -> tuple:
+        """Поля запроса, уложенные в бюджет токенов метода (см. TokenBudget), в порядке аргументов."""
+        async def summarize(text: str, max_tokens: int) -> str:
+            prompt = f"<text>\nТекст:\n{text}\n</text>"
+            prompt = f"{prompt}\n\n<max_size>\nОбъем ответа: не более {int(max_tokens * RATE_LIMIT_CHARS_PER_TOKEN)} символов\n</max_size>"
+            # Сжатый текст - служебный запрос, в SSE-поток клиента он не транслируется
+            token = stream_sink.set(None)
+            try:
+                response = await self.get_llm_answer(
+                    summarize_instruction, prompt, model=llm_model, method="summarize", max_output_tokens=max_tokens,
+                )
+            finally:
+                stream_sink.reset(token)
+            return response.output_text
+
+        return tuple((await self.token_budget.fit(method, fields, summarize)).values())
 
 
     async def get_sub_description(self, llm_model: str, domain: str, product_name: str, description: str, usage: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> str:
-        related_products = await get_related_products(domain, [product_name])
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        description, usage, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "get_sub_description", description=description, usage=usage,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        related_products = await get_related_products(self.django_client, domain, [product_name])
+        prompt = ""
+        if related_products:
+            prompt = f"<related_products>\nСвязанные товары:\n{related_products}\n</related_products>\n\n"
+        prompt = f"{prompt}<description>\nОписание:\n{description}\n</description>"
+        prompt = f"{prompt}\n<usage>\nПрименение:\n{usage}\n</usage>"
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
         prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
         prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<description>\nОписание:\n{description}\n</description>"
-        prompt = f"{prompt}\n<usage>\nПрименение:\n{usage}\n</usage>"
-        if related_products:
-            prompt = f"{prompt}\n<related_products>\nСвязанные товары:\n{related_products}\n</related_products>"
 
-        temp_response = await self.get_llm_answer(subdescription_instruction, prompt, model=llm_model)
-        response_output = await self.negative_prompt(llm_model, temp_response.output_text)
-
-        await self.log_to_file("get_sub_description_log", temp_response)
+        temp_response = await self.get_llm_answer(subdescription_instruction, prompt, model=llm_model, method="get_sub_description", product_name=product_name)
+        response_output = await self.negative_pass(llm_model, temp_response.output_text, "get_sub_description")
 
         return response_output.replace("\n", "")
 
@@ -73,53 +311,65 @@ class OpenAIAgent:
     async def get_description(self, llm_model: str, domain: str, product_name: str, description: str, usage: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> str:
-        related_products = await get_related_products(domain, [product_name])
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
-        prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
-        prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<description>\nОписание:\n{description}\n</description>"
+        description, usage, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "get_description", description=description, usage=usage,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        related_products = await get_related_products(self.django_client, domain, [product_name])
+        prompt = ""
+        if related_products:
+            prompt = f"<related_products>\nСвязанные товары:\n{related_products}\n</related_products>\n\n"
+        prompt = f"{prompt}<description>\nОписание:\n{description}\n</description>"
         if usage:
             prompt = f"{prompt}\n<usage>\nПрименение:\n{usage}\n</usage>"
-        if related_products:
-            prompt = f"{prompt}\n<related_products>\nСвязанные товары:\n{related_products}\n</related_products>"
-
-        temp_response = await self.get_llm_answer(description_instruction, prompt, model=llm_model)
-        response_output = await self.negative_prompt(llm_model, temp_response.output_text)
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
+        prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
 
-        await self.log_to_file("get_description_log", temp_response)
+        temp_response = await self.get_llm_answer(description_instruction, prompt, model=llm_model, method="get_description", product_name=product_name)
+        response_output = await self.negative_pass(llm_model, temp_response.output_text, "get_description")
 
         return response_output.replace("\n", "")
 
 
+    async def negative_pass(self, llm_model: str, result: str, method: str) -> str:
+        """Проверка текста по negative_instruction в режиме, заданном для ассистента (NEGATIVE_PASS_MODES)."""
+        mode = NEGATIVE_PASS_MODES.get(method, NEGATIVE_PASS_MODE)
+        if mode == "llm":
+            return await self.negative_prompt(llm_model, result)
+
+        result, unresolved = self.negative_rules.apply(result)
+        if unresolved and mode != "rules_only":
+            logger.info(f"negative_pass() {method} - LLM fallback for {unresolved}")
+            return await self.negative_prompt(llm_model, result)
+        return result
+
+
     async def negative_prompt(self, llm_model: str, result: str) -> str:
         prompt = f"**Полученный результат:**\n{result}"
-        response = await self.get_llm_answer(negative_instruction, prompt, model=llm_model)
-
-        await self.log_to_file("negative_prompt_log", response)
+        response = await self.get_llm_answer(negative_instruction, prompt, model=llm_model, method="negative_prompt")
 
         return response.output_text
 
 
     async def get_usage(self, llm_model: str, domain: str, product_name: str, usage: str) -> str:
-        # related_products = await get_related_products(domain, [product_name])
+        (usage,) = await self.fit_budget(llm_model, "get_usage", usage=usage)
+        # related_products = await get_related_products(self.django_client, domain, [product_name])
         prompt = f"<usage>\nПрименение:\n{usage}\n</usage>"
         # if related_products:
         #     prompt = f"{prompt}\n<related_products>\nСвязанные товары:\n{related_products}\n</related_products>"
-        response = await self.get_llm_answer(usage_instruction, prompt, model=llm_model)
-
-        await self.log_to_file("get_usage_log", response)
+        response = await self.get_llm_answer(usage_instruction, prompt, model=llm_model, method="get_usage", product_name=product_name)
 
         return response.output_text#.replace("\n", "")
 
 
     async def get_features(self, llm_model: str, domain: str, product_name: str, features: str) -> str:
-        # related_products = await get_related_products(domain, [product_name])
+        (features,) = await self.fit_budget(llm_model, "get_features", features=features)
+        # related_products = await get_related_products(self.django_client, domain, [product_name])
         prompt = f"<features>\nСвойства:\n{features}\n</features>"
         # if related_products:
         #     prompt = f"{prompt}\n<related_products>\nСвязанные товары:\n{related_products}\n</related_products>"
-        response = await self.get_llm_answer(features_instruction, prompt, model=llm_model)
-
-        await self.log_to_file("get_features_log", response)
+        response = await self.get_llm_answer(features_instruction, prompt, model=llm_model, method="get_features", product_name=product_name)
 
         return response.output_text
 
@@ -127,18 +377,21 @@ class OpenAIAgent:
     async def get_preview(self, llm_model: str, domain: str, product_name: str, description: str, usage: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> str:
-        related_products = await get_related_products(domain, [product_name])
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
-        prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
-        prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<description>\nОписание:\n{description}\n</description>"
+        description, usage, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "get_preview", description=description, usage=usage,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        related_products = await get_related_products(self.django_client, domain, [product_name])
+        prompt = ""
+        if related_products:
+            prompt = f"<related_products>\nСвязанные товары:\n{related_products}\n</related_products>\n\n"
+        prompt = f"{prompt}<description>\nОписание:\n{description}\n</description>"
         if usage:
             prompt = f"{prompt}\n<usage>\nПрименение:\n{usage}\n</usage>"
-        if related_products:
-            prompt = f"{prompt}\n<related_products>\nСвязанные товары:\n{related_products}\n</related_products>"
-        response = await self.get_llm_answer(preview_instruction, prompt, model=llm_model)
-
-        await self.log_to_file("get_previews_log", response)
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
+        prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
+        response = await self.get_llm_answer(preview_instruction, prompt, model=llm_model, method="get_preview", product_name=product_name)
 
         return response.output_text
 
@@ -146,17 +399,19 @@ class OpenAIAgent:
     async def get_reviews(self, llm_model: str, product_name: str, description: str, usage: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> list[str]:
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
-        prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
-        prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<product_name>\nНазвание товара:\n{product_name}\n</product_name>"
+        description, usage, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "get_reviews", description=description, usage=usage,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        prompt = f"<product_name>\nНазвание товара:\n{product_name}\n</product_name>"
         prompt = f"{prompt}\n<description>\nОписание:\n{description}\n</description>"
         if usage:
             prompt = f"{prompt}\n<usage>\nПрименение:\n{usage}\n</usage>"
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
+        prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
 
-        response = await self.get_llm_answer(review_instruction, prompt, text_format=ReviewsResponse, model=llm_model)
-
-        await self.log_to_file("get_reviews_log", response)
+        response = await self.get_llm_answer(review_instruction, prompt, text_format=ReviewsResponse, model=llm_model, method="get_reviews", product_name=product_name)
 
         return json.loads(response.output_text)
 
@@ -166,28 +421,26 @@ class OpenAIAgent:
         products_name: str, descriptions: str,
         photo1: bytes, photo2: bytes,
     ) -> str:
-        products_links = await get_products_links(domain, [name.strip() for name in products_name.split(",")])
-        prompt = f"<place_name>\nНазвание места/объекта:\n{place_name}\n</place_name>"
+        place_name, location, background_info, descriptions = await self.fit_budget(
+            llm_model, "get_work_results", place_name=place_name, location=location,
+            background_info=background_info, descriptions=descriptions,
+        )
+        products_links = await get_products_links(self.django_client, domain, [name.strip() for name in products_name.split(",")]) or {}
+        prompt = f"<used_products>\nИспользованные товары:\n{products_links}\n</used_products>"
+        prompt = f"{prompt}\n<descriptions>\nОписания использованных товаров:\n{descriptions}\n</descriptions>"
+        prompt = f"{prompt}\n\n<place_name>\nНазвание места/объекта:\n{place_name}\n</place_name>"
         prompt = f"{prompt}\n<location>\nРасположение:\n{location}\n</location>"
         prompt = f"{prompt}\n<background_info>\nДополнительная информация:\n{background_info}\n</background_info>"
-        prompt = f"{prompt}\n<used_products>\nИспользованные товары:\n{products_links}\n</used_products>"
-        prompt = f"{prompt}\n<descriptions>\nОписания использованных товаров:\n{descriptions}\n</descriptions>"
         content = [{ "type": "input_text", "text": prompt }]
 
-        if photo1:
-            b64_image1 = base64.b64encode(photo1).decode("utf-8")
-            content.append(
-                {
-                    "type": "input_image",
-                    "image_url": f"data:image/jpeg;base64,{b64_image1}",
-                },
-            )
-        if photo2:
-            b64_image2 = base64.b64encode(photo2).decode("utf-8")
+        # Фото проверяются и уменьшаются в пуле потоков параллельно
+        photos = [photo for photo in (photo1, photo2) if photo]
+        for image_url in await asyncio.gather(*(self.images.to_data_url(photo) for photo in photos)):
             content.append(
                 {
                     "type": "input_image",
-                    "image_url": f"data:image/jpeg;base64,{b64_image2}",
+                    "image_url": image_url,
+                    "detail": IMAGE_DETAIL,
                 },
             )
 
@@ -196,9 +449,7 @@ class OpenAIAgent:
             "content": content,
         }]
 
-        response = await self.get_llm_answer(work_results_instruction, prompt, model=llm_model)
-
-        await self.log_to_file("get_work_results_log", response)
+        response = await self.get_llm_answer(work_results_instruction, prompt, model=llm_model, method="get_work_results", product_name=products_name)
 
         return response.output_text
 
@@ -206,15 +457,17 @@ class OpenAIAgent:
     async def change_article(self, llm_model: str, title: str, article: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> str:
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        title, article, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "change_article", title=title, article=article,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        prompt = f"<title>\nНазвание статьи:\n{title}\n</title>"
+        prompt = f"{prompt}\n<article>\nСтатья:\n{article}\n</article>"
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
         prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
         prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<title>\nНазвание статьи:\n{title}\n</title>"
-        prompt = f"{prompt}\n<article>\nСтатья:\n{article}\n</article>"
-
-        response = await self.get_llm_answer(ch_article_instruction, prompt, model=llm_model)
 
-        await self.log_to_file("change_article_log", response)
+        response = await self.get_llm_answer(ch_article_instruction, prompt, model=llm_model, method="change_article")
 
         return response.output_text
 
@@ -222,15 +475,17 @@ class OpenAIAgent:
     async def get_article(self, llm_model: str, topic: str, comment: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> str:
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        topic, comment, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "get_article", topic=topic, comment=comment,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        prompt = f"<topic>\nТема:\n{topic}\n</topic>"
+        prompt = f"{prompt}\n<comment>\nКомментарий:\n{comment}\n</comment>"
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
         prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
         prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<topic>\nТема:\n{topic}\n</topic>"
-        prompt = f"{prompt}\n<comment>\nКомментарий:\n{comment}\n</comment>"
-
-        response = await self.get_llm_answer(article_instruction, prompt, model=llm_model)
 
-        await self.log_to_file("get_article_log", response)
+        response = await self.get_llm_answer(article_instruction, prompt, model=llm_model, method="get_article")
 
         return response.output_text
 
@@ -238,46 +493,91 @@ class OpenAIAgent:
     async def change_tech_instruction(self, llm_model: str, domain: str, tech_instruction: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> str:
-        products_links = await get_products_links(domain, ["_all"])
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        tech_instruction, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "change_tech_instruction", tech_instruction=tech_instruction,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        products_links = await self.catalog_cache.get_products_links(self.django_client, domain)
+        prompt = f"<tech_instruction>\nТехническая инструкция:\n{tech_instruction}\n</tech_instruction>"
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
         prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
         prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<tech_instruction>\nТехническая инструкция:\n{tech_instruction}\n</tech_instruction>"
-        prompt = f"{prompt}\n<products_links>\nСсылки на товары:\n{products_links}\n</products_links>"
-        response = await self.get_llm_answer(tech_instruction_instruction, prompt, model=llm_model)
-
-        await self.log_to_file("change_tech_instruction_log", response)
-
-        return response.output_text
+        query = "\n".join((tech_instruction, seo_high_freq, seo_medium_freq, seo_low_freq))
+        return await self._answer_with_product_links(
+            tech_instruction_instruction, prompt, domain, query, products_links, llm_model, "change_tech_instruction",
+        )
 
 
     async def change_category_description(self, llm_model: str, domain: str, category_description: str,
         seo_high_freq: str, seo_medium_freq: str, seo_low_freq: str,
     ) -> str:
-        products_links = await get_products_links(domain, ["_all"])
-        prompt = f"<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
+        category_description, seo_high_freq, seo_medium_freq, seo_low_freq = await self.fit_budget(
+            llm_model, "change_category_description", category_description=category_description,
+            seo_high_freq=seo_high_freq, seo_medium_freq=seo_medium_freq, seo_low_freq=seo_low_freq,
+        )
+        products_links = await self.catalog_cache.get_products_links(self.django_client, domain)
+        prompt = f"<category_description>\nОписание в (под)категории:\n{category_description}\n</category_description>"
+        prompt = f"{prompt}\n\n<seo_high_freq>\nВЧ:\n{seo_high_freq}\n</seo_high_freq>"
         prompt = f"{prompt}\n<seo_medium_freq>\nСЧ:\n{seo_medium_freq}\n</seo_medium_freq>"
         prompt = f"{prompt}\n<seo_low_freq>\nНЧ:\n{seo_low_freq}\n</seo_low_freq>"
-        prompt = f"{prompt}\n\n<category_description>\nОписание в (под)категории:\n{category_description}\n</category_description>"
-        prompt = f"{prompt}\n<products_links>\nСсылки на товары:\n{products_links}\n</products_links>"
-        response = await self.get_llm_answer(category_description_instruction, prompt, model=llm_model)
+        query = "\n".join((category_description, seo_high_freq, seo_medium_freq, seo_low_freq))
+        return await self._answer_with_product_links(
+            category_description_instruction, prompt, domain, query, products_links, llm_model, "change_category_description",
+        )
 
-        await self.log_to_file("change_category_description_log", response)
 
-        return response.output_text
+    async def _answer_with_product_links(self, instruction: str, prompt: str, domain: str, query: str,
+        products_links: dict, llm_model: str, method: str,
+    ) -> str:
+        """Запрос с каталогом товаров домена в режиме PRODUCT_LINKS_MODE.
+
+        В промпт попадают только товары, релевантные query (см. select_products).
+        В режиме placeholders модель получает только названия и ставит маркеры [[product:...]],
+        которые затем заменяются на ссылки из products_links.
+
+        Весь каталог одинаков для всех строк домена и идет в начале промпта, сразу после инструкции,
+        как часть кэшируемого префикса. Подборка top-k своя у каждой строки, поэтому идет после полей строки.
+        """
+        titles = await self.select_products(domain, query, products_links, method)
+        if PRODUCT_LINKS_MODE != "placeholders":
+            selected_links = products_links if titles is None else {title: products_links[title] for title in titles}
+            block = f"<products_links>\nСсылки на товары:\n{selected_links}\n</products_links>"
+        else:
+            instruction = f"{instruction}\n{product_markers_instruction}"
+            block = f"<products>\nТовары:\n{format_products_list(list(products_links) if titles is None else titles)}\n</products>"
+        prompt = f"{block}\n\n{prompt}" if titles is None else f"{prompt}\n\n{block}"
+
+        response = await self.get_llm_answer(instruction, prompt, model=llm_model, method=method)
+        if PRODUCT_LINKS_MODE != "placeholders":
+            return response.output_text
+
+        result, unresolved = resolve_product_markers(response.output_text, products_links)
+        if unresolved:
+            logger.warning(f"{method}() - unknown product markers: {unresolved}")
+        return result
+
+
+    async def select_products(self, domain: str, query: str, products_links: dict, method: str) -> list[str] | None:
+        """Названия товаров домена для промпта: top-k по BM25 индексу каталога.
+
+        k задается CATALOG_TOP_K_BY_METHOD/CATALOG_TOP_K; при k=0, пустом индексе
+        или отсутствии совпадений возвращается None - в промпт идет весь каталог.
+        """
+        k = CATALOG_TOP_K_BY_METHOD.get(method, CATALOG_TOP_K)
+        if k <= 0:
+            return None
+
+        index = await self.catalog_cache.get_index(self.django_client, domain)
+        titles = [title for title in index.search(query, k) if title in products_links]
+        if not titles:
+            logger.warning(f"{method}() - no relevant products found, using full catalog")
+            return None
+        return titles
 
 
     async def correct_result(self, llm_model: str, result: str, facts: str) -> str:
         prompt = f"Полученный результат:\n{result}\n\n---\n\nФакты:\n{facts}"
-        response = await self.get_llm_answer(correct_res_instruction, prompt, model=llm_model)
-
-        await self.log_to_file("correct_res_log", response)
+        response = await self.get_llm_answer(correct_res_instruction, prompt, model=llm_model, method="correct_result")
 
         return response.output_text
 
-
-    async def log_to_file(self, file_name: str, response) -> None:
-        header = f"[{time.strftime('%Y-%m-%d %H:%M:%S')} LOG]"
-        buffer = (str(res) for res in response)
-        with open(LOGS_DIR / f"{file_name}.log", "a", encoding="utf-8") as f:
-            f.write(f"{header}\n{'\n'.join(buffer)}\n\n")
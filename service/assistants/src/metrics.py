@@ -0,0 +1,217 @@
+import time
+from bisect import bisect_left
+
+from starlette.requests import Request
+from starlette.routing import Match
+
+# Тип содержимого текстового формата Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # метки -> (число наблюдений по корзинам, сумма)
+        self._histograms: dict[tuple, tuple[list[int], list[float]]] = {}
+
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._histograms.get(key)
+        if entry is None:
+            entry = self._histograms[key] = ([0] * len(self.buckets), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self._histograms.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(round(total[0], 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса, отдаваемый эндпоинтом /metrics в текстовом формате Prometheus.
+
+    Метрики хранятся в памяти процесса: при нескольких воркерах uvicorn
+    каждый воркер отдает свои значения.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Длительность HTTP запросов до начала ответа",
+    ("route", "method", "status"),
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Выполняющиеся HTTP запросы", ("route",),
+))
+OPENAI_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "openai_request_duration_seconds", "Длительность вызовов OpenAI (одна попытка)", ("model", "method"),
+))
+OPENAI_TIME_TO_FIRST_TOKEN = REGISTRY.register(Histogram(
+    "openai_time_to_first_token_seconds", "Время до первой дельты текста при стриминге", ("model", "method"),
+))
+OPENAI_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "openai_requests_in_flight", "Выполняющиеся вызовы OpenAI", ("model",),
+))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    "openai_tokens_total", "Токены OpenAI по типам (input, output, cached)", ("model", "method", "type"),
+))
+OPENAI_ERRORS = REGISTRY.register(Counter(
+    "openai_errors_total", "Ошибки вызовов OpenAI по классам исключений", ("model", "error"),
+))
+CIRCUIT_STATE = REGISTRY.register(Gauge(
+    "circuit_breaker_state", "Состояние предохранителя зависимости (0 - замкнут, 1 - пробный вызов, 2 - разомкнут)",
+    ("circuit",),
+))
+CIRCUIT_REJECTED = REGISTRY.register(Counter(
+    "circuit_breaker_rejected_total", "Вызовы, отклоненные разомкнутым предохранителем", ("circuit",),
+))
+SCHEDULER_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "scheduler_queue_depth", "Вызовы OpenAI, ожидающие слота планировщика", ("priority",),
+))
+SCHEDULER_ACTIVE = REGISTRY.register(Gauge(
+    "scheduler_active", "Вызовы OpenAI, получившие слот планировщика", ("priority",),
+))
+SCHEDULER_WAIT = REGISTRY.register(Histogram(
+    "scheduler_wait_seconds", "Ожидание слота планировщика", ("priority",),
+))
+SCHEDULER_PROMOTED = REGISTRY.register(Counter(
+    "scheduler_promoted_total", "Вызовы, получившие слот вне очереди после max_wait ожидания", ("priority",),
+))
+
+
+def record_usage(model: str, method: str | None, response) -> None:
+    """Учет токенов из usage ответа OpenAI."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    input_details = getattr(usage, "input_tokens_details", None)
+    method = method or "unknown"
+    OPENAI_TOKENS.inc(getattr(usage, "input_tokens", None) or 0, model=model, method=method, type="input")
+    OPENAI_TOKENS.inc(getattr(usage, "output_tokens", None) or 0, model=model, method=method, type="output")
+    OPENAI_TOKENS.inc(getattr(input_details, "cached_tokens", None) or 0, model=model, method=method, type="cached")
+
+
+def route_label(request: Request) -> str:
+    """Шаблон маршрута запроса (несуществующие пути объединяются, чтобы не плодить метки)."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
+
+
+async def metrics_middleware(request: Request, call_next):
+    """Middleware FastAPI: длительность и число выполняющихся HTTP запросов по маршрутам."""
+    route = route_label(request)
+    started = time.perf_counter()
+    status_code = 500
+    HTTP_REQUESTS_IN_FLIGHT.inc(route=route)
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec(route=route)
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started, route=route, method=request.method, status=status_code,
+        )
@@ -145,3 +145,27 @@ class CategoryDescriptionRequest(BaseModel):
 
 class CategoryDescriptionResponse(BaseModel):
     category_description: str
+
+
+# "/api/v1/create/work_results" в составе пакета (фото в base64)
+class WorkResultsRequest(BaseModel):
+    llm_model: str
+    domain: str
+    place_name: str
+    location: str
+    background_info: str
+    products_name: str
+    descriptions: str
+    photo1: str | None = None
+    photo2: str | None = None
+
+
+# "/api/v1/batch"
+class BatchItem(BaseModel):
+    id: str | None = None
+    kind: str
+    request: dict
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem]
+    concurrency: int | None = Field(None, ge=1)
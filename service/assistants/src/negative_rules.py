@@ -0,0 +1,97 @@
+import re
+from collections.abc import Callable
+
+# Правила из negative_instruction в виде (шаблон, замена).
+# Замена None - формулировку нельзя исправить механически, текст нужно отдать модели.
+NEGATIVE_RULES: list[tuple[str, str | Callable[[re.Match], str] | None]] = [
+    # Тавтологии и странные формулировки, которые заменяются однозначно
+    (r"исключить возможность возникновения искр", "исключить образование искр"),
+    (r"возможност[ьи] возникновения искр", "образование искр"),
+    (r"для максимальной долговечности", "для увеличения срока службы"),
+    (r"(?<!воз)действи([еяю]) (топлива|масел|нефтепродуктов)", r"воздействи\1 \2"),
+    (r"срок службы системы пола", "срок службы системы покрытий"),
+    (r"использование данных компонентов", "использование данных материалов"),
+    (r"высококачественные полимерные полы", "полимерные полы"),
+    (r"гарантия долгосрочной защиты", "долговременная защита"),
+    (r"совершенное визуальное решение основания", "эстетичный внешний вид основания"),
+    # После времени сушки/высыхания/перекрытия обязательно указывается температура,
+    # если ее еще нет: "при +20°C", "при температуре 20 градусов", "t +20"
+    (
+        r"((?:сушк|высыхани|перекрыти|полимеризаци|отверждени)\w*[^.<;()]{0,60}?"
+        r"\d+(?:[,.]\d+)?(?:\s*[-–]\s*\d+(?:[,.]\d+)?)?\s*(?:час(?:а|ов)?|ч|минут[аы]?|мин|сут(?:ок|ки)?)\b)"
+        r"(?!\.?[,\s]*\(?(?:при\b[^;<]{0,40}?(?:°|\bград)|t\s*=?\s*[+-]?\d))",
+        r"\1 (при t +20°C)",
+    ),
+    # Требуют переписывания по смыслу
+    # "краски и эмали" может быть фактом о товаре (грунт под краски и эмали) - решает модель
+    (r"\b(?:краски|краска) и эмали\b", None),
+    (r"безыскровые покрытия рекомендуются для объектов с риском возникновения искр", None),
+    (r"двухкомпонентный состав\s*[—-]\s*основа и отвердитель", None),
+    (r"искробезопасность\s*[—-]\s*предотвращает возникновение искр", None),
+    (r"широкий выбор фасовок", None),
+    (r"это двухкомпонентная система наливного покрытия", None),
+    (r"<h3>\s*основные характеристики\s*</h3>", None),
+    (r"<h3>\s*системы и совместимость\s*</h3>", None),
+    (r"рекомендуется применять в комплексе системы", None),
+    (r"в составе комплексных систем в системе покрытий", None),
+    (r"и для защиты основания", None),
+    (r"(?:полиуретанов\w+ (?:эмал|наливн)\w*[^.<]{0,80}?)устойчив\w* к кислотам", None),
+    (r"нанесени\w+ (?:ещ[её] )?одного слоя топпинга", None),
+]
+
+
+def _keep_case(source: str, replacement: str) -> str:
+    if source[:1].isupper() and replacement[:1].islower():
+        return replacement[:1].upper() + replacement[1:]
+    return replacement
+
+
+class RuleEngine:
+    """Механическое исправление текста по правилам negative_instruction.
+
+    Все шаблоны собраны в одно регулярное выражение, поэтому текст просматривается за один проход.
+    """
+
+    def __init__(self, rules: list[tuple[str, str | Callable[[re.Match], str] | None]] = NEGATIVE_RULES):
+        self.rules = [(re.compile(pattern, re.IGNORECASE), replacement) for pattern, replacement in rules]
+        self.matcher = re.compile(
+            "|".join(f"(?P<r{index}>{pattern})" for index, (pattern, _) in enumerate(rules)),
+            re.IGNORECASE,
+        )
+        self.checked = 0
+        self.applied = 0
+        self.unresolved = 0
+
+
+    def apply(self, text: str) -> tuple[str, list[str]]:
+        """Применение правил.
+
+        Returns:
+            tuple: (исправленный текст, фрагменты, которые нужно переписать моделью)
+
+        """
+        unresolved = []
+
+        def replace(match: re.Match) -> str:
+            regex, replacement = self.rules[int(match.lastgroup[1:])]
+            source = match.group()
+            if replacement is None:
+                unresolved.append(source)
+                return source
+            self.applied += 1
+            return _keep_case(source, regex.sub(replacement, source, count=1))
+
+        text = self.matcher.sub(replace, text)
+        self.checked += 1
+        if unresolved:
+            self.unresolved += 1
+        return text, unresolved
+
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self.rules),
+            "checked": self.checked,
+            "applied": self.applied,
+            "unresolved": self.unresolved,
+        }
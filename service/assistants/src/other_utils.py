@@ -1,13 +1,51 @@
-
 import httpx
 
-from .settings import DJANGO_API_URL, logger
+from .circuit_breaker import get_breaker
+from .settings import (
+    DJANGO_API_URL,
+    DJANGO_HTTP_CONNECT_TIMEOUT,
+    DJANGO_HTTP_KEEPALIVE_EXPIRY,
+    DJANGO_HTTP_MAX_CONNECTIONS,
+    DJANGO_HTTP_MAX_KEEPALIVE,
+    DJANGO_HTTP_TIMEOUT,
+    SERVICE_API_TOKEN,
+    logger,
+)
+
+
+def create_django_client() -> httpx.AsyncClient:
+    """Создание долгоживущего клиента с пулом keep-alive соединений к Django API."""
+    return httpx.AsyncClient(
+        base_url=DJANGO_API_URL or "",
+        limits=httpx.Limits(
+            max_connections=DJANGO_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=DJANGO_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=DJANGO_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(DJANGO_HTTP_TIMEOUT, connect=DJANGO_HTTP_CONNECT_TIMEOUT),
+    )
+
+# Предохранитель создается при импорте, чтобы его состояние было видно на эндпоинте здоровья до первого вызова
+_django_breaker = get_breaker("django")
+
+
+async def django_get(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    """GET к Django API через предохранитель "django".
+
+    Ошибки сети, таймауты и ответы 5xx считаются отказами. При разомкнутой цепи
+    CircuitOpen возникает сразу, без ожидания таймаута.
+    """
+    return await _django_breaker.call(
+        lambda: client.get(url, **kwargs),
+        is_failed_result=lambda response: response.status_code >= 500,
+    )
 
 
-async def get_related_products(domain: str, products_name: list[str]) -> dict:
+async def get_related_products(client: httpx.AsyncClient, domain: str, products_name: list[str]) -> dict:
     """Получение связанных товаров через Django API.
 
     Args:
+        client: общий клиент Django API (см. create_django_client)
         domain: домен ("main" или URL сателлита)
         products_name: список названий товаров
 
@@ -20,8 +58,7 @@ async def get_related_products(domain: str, products_name: list[str]) -> dict:
         if domain and domain != "main":
             params["domain_url"] = domain
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{DJANGO_API_URL}/api/products/links/", params=params)
+        response = await django_get(client, "/api/products/links/", params=params)
 
         if response.status_code == 200:
             data = response.json()
@@ -35,14 +72,15 @@ async def get_related_products(domain: str, products_name: list[str]) -> dict:
         return {}
 
 
-async def get_products_links(domain: str, products_name: list[str]):
+async def get_products_links(client: httpx.AsyncClient, domain: str, products_name: list[str]):
     """Получение ссылки на товар через Django API.
 
     Args:
+        client: общий клиент Django API (см. create_django_client)
         domain: домен ("main" или URL сателлита)
         products_name: список названий товаров или ["_all"] для всех
     Returns:
-        str или dict: ссылка на товар или словарь всех ссылок
+        dict | None: словарь {название: ссылка} или None, если Django недоступен
 
     """
     try:
@@ -50,16 +88,119 @@ async def get_products_links(domain: str, products_name: list[str]):
         if domain and domain != "main":
             params["domain_url"] = domain
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{DJANGO_API_URL}/link/", params=params)
+        response = await django_get(client, "/api/products/link/", params=params)
 
         if response.status_code == 200:
-            data = response.json()
-            return data.get("data", {})
+            # Django возвращает словарь {название: ссылка} без обертки
+            return response.json()
         else:
             logger.warning(f"get_product_link() failed: {response.status_code} - {response.text}")
-            return {}
+            return None
 
     except Exception as e:
         logger.error(f"get_product_link() error: {e}")
-        return {}
+        return None
+
+
+async def get_catalog_documents(client: httpx.AsyncClient, domain: str) -> list[dict]:
+    """Получение товаров домена с описаниями для поискового индекса через Django API.
+
+    Args:
+        client: общий клиент Django API (см. create_django_client)
+        domain: домен ("main" или URL сателлита)
+
+    Returns:
+        list: [{title, link, description, relations}] или [] при ошибке
+
+    """
+    try:
+        params = {}
+        if domain and domain != "main":
+            params["domain_url"] = domain
+
+        response = await django_get(client, "/api/products/catalog/", params=params)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"get_catalog_documents() failed: {response.status_code} - {response.text}")
+            return []
+
+    except Exception as e:
+        logger.error(f"get_catalog_documents() error: {e}")
+        return []
+
+
+async def get_assistant_limits(client: httpx.AsyncClient) -> dict | None:
+    """Получение лимитов ассистентов (Assistant.maks_token) через Django API.
+
+    Args:
+        client: общий клиент Django API (см. create_django_client)
+
+    Returns:
+        dict | None: {key_title: {"max_output_tokens": int | None}} или None, если Django недоступен
+
+    """
+    try:
+        response = await django_get(client, "/api/assistants/limits")
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"get_assistant_limits() failed: {response.status_code} - {response.text}")
+            return None
+
+    except Exception as e:
+        logger.error(f"get_assistant_limits() error: {e}")
+        return None
+
+
+async def get_llm_endpoints(client: httpx.AsyncClient) -> dict | None:
+    """Получение активных AI моделей (Models) через Django API.
+
+    Args:
+        client: общий клиент Django API (см. create_django_client)
+
+    Returns:
+        dict | None: {"version": str, "models": [{id, name, url, encrypted_key}]} или None, если Django
+            недоступен или не задан SERVICE_API_TOKEN
+
+    """
+    if not SERVICE_API_TOKEN:
+        return None
+    try:
+        response = await django_get(client, "/api/assistants/models", headers={"X-Service-Token": SERVICE_API_TOKEN})
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"get_llm_endpoints() failed: {response.status_code} - {response.text}")
+            return None
+
+    except Exception as e:
+        logger.error(f"get_llm_endpoints() error: {e}")
+        return None
+
+
+async def get_catalog_version(client: httpx.AsyncClient) -> int | None:
+    """Получение текущей версии каталога через Django API.
+
+    Args:
+        client: общий клиент Django API (см. create_django_client)
+
+    Returns:
+        int | None: версия каталога или None, если Django недоступен
+
+    """
+    try:
+        response = await django_get(client, "/api/products/catalog-version/")
+
+        if response.status_code == 200:
+            return response.json().get("version")
+        else:
+            logger.warning(f"get_catalog_version() failed: {response.status_code} - {response.text}")
+            return None
+
+    except Exception as e:
+        logger.error(f"get_catalog_version() error: {e}")
+        return None
@@ -0,0 +1,59 @@
+import re
+
+# Ссылка с маркером в href: <a href="[[product:Название]]">текст</a>
+_MARKER_LINK_RE = re.compile(
+    r"<a\s+([^>]*?)href=([\"'])\[\[product:\s*(?P<title>[^\]]+?)\s*\]\]\2(?P<attrs>[^>]*)>(?P<text>.*?)</a>",
+    re.IGNORECASE | re.DOTALL,
+)
+# Маркер вне ссылки: [[product:Название]]
+_MARKER_RE = re.compile(r"\[\[product:\s*(?P<title>[^\]]+?)\s*\]\]", re.IGNORECASE)
+_QUOTES_RE = re.compile(r"[«»\"'“”„]")
+
+
+def normalize_title(title: str) -> str:
+    """Ключ для сопоставления названий: без учета регистра, кавычек, ё/е и лишних пробелов."""
+    title = _QUOTES_RE.sub("", title.lower().replace("ё", "е"))
+    return " ".join(title.split())
+
+
+def format_products_list(titles) -> str:
+    """Список названий товаров для промпта (вместо словаря {название: ссылка})."""
+    return "\n".join(f"- {title}" for title in titles)
+
+
+def resolve_product_markers(text: str, links: dict[str, str]) -> tuple[str, list[str]]:
+    """Замена маркеров [[product:Название]] на ссылки домена.
+
+    links - словарь {название: ссылка} для домена (ссылки сателлитов уже склеены
+    в Django через _join_url). Маркер с неизвестным названием заменяется на текст
+    без ссылки, чтобы в ответ не попали битые href.
+
+    Returns:
+        tuple: (текст со ссылками, нераспознанные названия)
+
+    """
+    index = {normalize_title(title): url for title, url in links.items() if url}
+    unresolved = []
+
+    def lookup(title: str) -> str | None:
+        url = index.get(normalize_title(title))
+        if url is None:
+            unresolved.append(title)
+        return url
+
+    def replace_link(match: re.Match) -> str:
+        url = lookup(match.group("title"))
+        if url is None:
+            return match.group("text")
+        return f'<a {match.group(1)}href="{url}"{match.group("attrs")}>{match.group("text")}</a>'
+
+    def replace_marker(match: re.Match) -> str:
+        title = match.group("title")
+        url = lookup(title)
+        if url is None:
+            return title
+        return f'<a href="{url}">{title}</a>'
+
+    text = _MARKER_LINK_RE.sub(replace_link, text)
+    text = _MARKER_RE.sub(replace_marker, text)
+    return text, unresolved
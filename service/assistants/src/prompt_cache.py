@@ -0,0 +1,38 @@
+class PromptCacheStats:
+    """Учет кэширования префикса промпта на стороне OpenAI по ассистентам.
+
+    Доля попаданий - usage.input_tokens_details.cached_tokens / usage.input_tokens.
+    Учитываются только реальные вызовы OpenAI (без ответов из локального кэша и объединенных запросов).
+    """
+
+    def __init__(self):
+        self._methods: dict[str, dict] = {}
+
+
+    def record(self, method: str | None, response) -> None:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        input_details = getattr(usage, "input_tokens_details", None)
+        cached_tokens = getattr(input_details, "cached_tokens", None) or 0
+        entry = self._methods.setdefault(method or "unknown", {
+            "calls": 0,
+            "calls_with_cache": 0,
+            "input_tokens": 0,
+            "cached_tokens": 0,
+        })
+        entry["calls"] += 1
+        entry["input_tokens"] += getattr(usage, "input_tokens", None) or 0
+        entry["cached_tokens"] += cached_tokens
+        if cached_tokens:
+            entry["calls_with_cache"] += 1
+
+
+    def stats(self) -> dict:
+        return {
+            method: {
+                **entry,
+                "hit_ratio": round(entry["cached_tokens"] / entry["input_tokens"], 4) if entry["input_tokens"] else 0.0,
+            }
+            for method, entry in self._methods.items()
+        }
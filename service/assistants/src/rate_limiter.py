@@ -0,0 +1,295 @@
+import asyncio
+import re
+import time
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from typing import Any
+
+import httpx
+import openai
+
+from .settings import (
+    RATE_LIMIT_CHARS_PER_TOKEN,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_IMAGE_TOKENS,
+    RATE_LIMIT_MAX_CONCURRENCY,
+    RATE_LIMIT_MAX_RETRIES,
+    RATE_LIMIT_OUTPUT_TOKENS,
+    RATE_LIMIT_RPM,
+    RATE_LIMIT_TPM,
+    logger,
+)
+
+# Лимитер, через который идет текущий вызов OpenAI (для чтения заголовков ответа в event hook httpx)
+_current_limiter: ContextVar["ModelLimiter | None"] = ContextVar("current_limiter", default=None)
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Длительность из заголовков OpenAI ("20ms", "1s", "6m0s") в секундах."""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def estimate_tokens(instruction: str | None, prompt, output_tokens: int = RATE_LIMIT_OUTPUT_TOKENS) -> int:
+    """Грубая оценка стоимости запроса в токенах (вход по числу символов + ожидаемый выход)."""
+    chars = len(instruction or "")
+    images = 0
+    if isinstance(prompt, str):
+        chars += len(prompt)
+    elif isinstance(prompt, list):
+        for message in prompt:
+            content = message.get("content") if isinstance(message, dict) else None
+            if isinstance(content, str):
+                chars += len(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "input_image":
+                    images += 1
+                else:
+                    chars += len(part.get("text") or "")
+    return int(chars / RATE_LIMIT_CHARS_PER_TOKEN) + images * RATE_LIMIT_IMAGE_TOKENS + output_tokens
+
+
+def retry_after(headers: httpx.Headers) -> float:
+    """Пауза после 429: Retry-After, затем время сброса лимита из x-ratelimit-reset-*."""
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    delays = [
+        parse_duration(headers.get(name))
+        for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+    ]
+    delays = [delay for delay in delays if delay]
+    return max(delays) if delays else 1.0
+
+
+class ModelLimiter:
+    """Token bucket по запросам и токенам в минуту плюс ограничение одновременных запросов.
+
+    Начальные лимиты берутся из настроек и уточняются по заголовкам
+    x-ratelimit-limit-*/x-ratelimit-remaining-* ответов OpenAI.
+    Вызовы, для которых нет бюджета, ждут в очереди в порядке поступления.
+    """
+
+    def __init__(self, name: str, rpm: float = RATE_LIMIT_RPM, tpm: float = RATE_LIMIT_TPM,
+        max_concurrency: int = RATE_LIMIT_MAX_CONCURRENCY,
+    ):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.max_concurrency = max_concurrency
+        self.admitted = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+        self.waiting = 0
+        self.inflight = 0
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._queue_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+
+    async def acquire(self, cost: int) -> int:
+        """Ожидание бюджета на запрос стоимостью cost токенов.
+
+        Returns:
+            int: списанное число токенов (передается в release)
+
+        """
+        started = time.monotonic()
+        # Запрос больше всего ведра иначе ждал бы бесконечно
+        cost = min(cost, int(self.tpm))
+        self.waiting += 1
+        try:
+            # Бюджет списывается уже после получения слота, когда остаток уточнен ответами предыдущих вызовов
+            await self._semaphore.acquire()
+            try:
+                async with self._queue_lock:
+                    while (delay := self._reserve(cost)) > 0:
+                        await asyncio.sleep(delay)
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.inflight += 1
+        if waited > 0.01:
+            self.waited += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+        return cost
+
+
+    def release(self, cost: int, used_tokens: int | None = None) -> None:
+        """Освобождение слота; разница между оценкой и фактическим расходом возвращается в ведро."""
+        self.inflight -= 1
+        self._semaphore.release()
+        if used_tokens is not None:
+            self._refill()
+            self.tokens = min(self.tpm, self.tokens + cost - used_tokens)
+
+
+    def update(self, headers: httpx.Headers) -> None:
+        """Уточнение лимитов и остатка по заголовкам ответа OpenAI."""
+        self._refill()
+        limit_requests = headers.get("x-ratelimit-limit-requests")
+        limit_tokens = headers.get("x-ratelimit-limit-tokens")
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if limit_requests:
+            self.rpm = float(limit_requests)
+        if limit_tokens:
+            self.tpm = float(limit_tokens)
+        # Сервер знает о расходе других процессов с тем же ключом - берем меньшее
+        if remaining_requests:
+            self.requests = min(self.requests, float(remaining_requests))
+        if remaining_tokens:
+            self.tokens = min(self.tokens, float(remaining_tokens))
+        if remaining_requests == "0" or remaining_tokens == "0":
+            reset = max(
+                parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+            )
+            self.pause(reset)
+
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+    def throttle(self, seconds: float) -> None:
+        """Реакция на 429: приостановка выдачи бюджета до сброса лимита."""
+        self.throttled += 1
+        self._refill()
+        self.requests = min(self.requests, 0.0)
+        self.pause(seconds)
+
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "available_requests": round(self.requests, 1),
+            "available_tokens": round(self.tokens),
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "max_wait": round(self.max_wait, 3),
+            "throttled": self.throttled,
+        }
+
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+
+    def _reserve(self, cost: int) -> float:
+        """Списание бюджета; если его не хватает - время ожидания в секундах."""
+        self._refill()
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            return delay
+
+        delay = max(
+            (1 - self.requests) * 60 / self.rpm if self.requests < 1 else 0,
+            (cost - self.tokens) * 60 / self.tpm if self.tokens < cost else 0,
+        )
+        if delay > 0:
+            return delay
+
+        self.requests -= 1
+        self.tokens -= cost
+        return 0
+
+
+class RateLimiter:
+    """Клиентское ограничение частоты запросов к OpenAI по паре (API ключ, модель).
+
+    При 429 вызов не завершается ошибкой, а возвращается в очередь своего лимитера
+    (не более max_retries раз), лимитер при этом приостанавливается до сброса лимита.
+    """
+
+    def __init__(self, enabled: bool = RATE_LIMIT_ENABLED, max_retries: int = RATE_LIMIT_MAX_RETRIES):
+        self.enabled = enabled
+        self.max_retries = max_retries
+        self.requeued = 0
+        self._limiters: dict[tuple[str, str], ModelLimiter] = {}
+
+
+    def get(self, key: str, model: str) -> ModelLimiter:
+        limiter = self._limiters.get((key, model))
+        if limiter is None:
+            limiter = self._limiters[(key, model)] = ModelLimiter(f"{key}:{model}")
+        return limiter
+
+
+    async def run(self, key: str, model: str, cost: int, fn: Callable[[], Awaitable[Any]], requeue: bool = True) -> Any:
+        """Выполнение вызова OpenAI fn() в пределах лимитов (key, model).
+
+        requeue=False - 429 сразу возвращается вызывающему (например, для переноса на другой ключ).
+        """
+        if not self.enabled:
+            return await fn()
+
+        limiter = self.get(key, model)
+        for attempt in range(self.max_retries + 1):
+            charged = await limiter.acquire(cost)
+            token = _current_limiter.set(limiter)
+            used_tokens = None
+            try:
+                response = await fn()
+                usage = getattr(response, "usage", None)
+                used_tokens = getattr(usage, "total_tokens", None)
+                return response
+            except openai.RateLimitError as e:
+                # Исчерпанная квота не восстановится ожиданием
+                if not requeue or attempt == self.max_retries or getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                delay = retry_after(e.response.headers)
+                limiter.throttle(delay)
+                self.requeued += 1
+                logger.warning(f"RateLimiter - 429 for {limiter.name}, requeued for {delay:.2f}s (attempt {attempt + 1})")
+            finally:
+                _current_limiter.reset(token)
+                limiter.release(charged, used_tokens)
+
+
+    async def on_response(self, response: httpx.Response) -> None:
+        """Event hook httpx клиента OpenAI: обновление лимитов по заголовкам ответа."""
+        limiter = _current_limiter.get()
+        if limiter is not None:
+            limiter.update(response.headers)
+            # Встроенные повторы SDK тоже должны видеть паузу лимитера
+            if response.status_code == 429:
+                limiter.pause(retry_after(response.headers))
+
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "requeued": self.requeued,
+            "limiters": {limiter.name: limiter.stats() for limiter in self._limiters.values()},
+        }
@@ -0,0 +1,259 @@
+import asyncio
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from typing import Any
+
+import httpx
+import openai
+from pydantic import BaseModel
+
+from .settings import (
+    HEDGE_MIN_SAMPLES,
+    HEDGE_QUANTILE,
+    REQUEST_DEADLINE,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+    RETRY_POLICIES,
+    logger,
+)
+from .streaming import deltas_sent, emit
+
+# Маршрут текущего HTTP запроса (None - вызов не из HTTP, например из сервиса sheets)
+request_route: ContextVar[str | None] = ContextVar("request_route", default=None)
+# Момент (time.monotonic()), к которому запрос должен быть выполнен
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени запроса исчерпан."""
+
+
+class RetryPolicy(BaseModel):
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+    deadline: float = REQUEST_DEADLINE
+    hedge: bool = False
+
+
+# "default" - вызовы без HTTP запроса (пакетная обработка таблиц),
+# "interactive" - одиночные эндпоинты, которые ждет пользователь (AssistantsAPI ждет 120 с)
+POLICIES = {
+    "default": RetryPolicy(),
+    "interactive": RetryPolicy(max_attempts=3, max_delay=5, deadline=110, hedge=True),
+    "/api/v1/batch": RetryPolicy(max_attempts=6, deadline=600),
+}
+for _name, _overrides in RETRY_POLICIES.items():
+    POLICIES[_name] = POLICIES.get(_name, POLICIES["default"]).model_copy(update=_overrides)
+
+
+def get_policy(route: str | None = None) -> RetryPolicy:
+    """Политика для маршрута: явно заданная, иначе interactive для HTTP запросов и default для остальных."""
+    route = route if route is not None else request_route.get()
+    if route is None:
+        return POLICIES["default"]
+    return POLICIES.get(route, POLICIES["interactive"])
+
+
+def start_deadline(route: str | None = None) -> float:
+    """Установка дедлайна текущего запроса по политике маршрута."""
+    deadline = time.monotonic() + get_policy(route).deadline
+    request_deadline.set(deadline)
+    return deadline
+
+
+def parse_deadline_header(value: str | None) -> float | None:
+    """Дедлайн из заголовка X-Request-Deadline (Unix time в секундах) в шкале time.monotonic()."""
+    if not value:
+        return None
+    try:
+        deadline = float(value)
+    except ValueError:
+        return None
+    return time.monotonic() + deadline - time.time()
+
+
+async def run_with_deadline(fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Выполнение fn() целиком в пределах дедлайна запроса.
+
+    В отличие от Resilience.call, ограничивает не только вызовы OpenAI, но и запросы к Django
+    (каталог, связанные товары): по истечении дедлайна все незавершенные операции отменяются.
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return await fn()
+    timeout = asyncio.timeout_at(deadline)
+    try:
+        async with timeout:
+            return await fn()
+    except TimeoutError:
+        if not timeout.expired():
+            raise
+        raise DeadlineExceeded("request deadline exceeded") from None
+
+
+def is_retryable(e: Exception, rate_limits: bool = True) -> bool:
+    """Временные ошибки: сеть и таймауты, 408, 409, 429 (кроме исчерпанной квоты) и 5xx.
+
+    rate_limits=False - 429 не повторяется (его уже повторяет RateLimiter).
+    """
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    if isinstance(e, openai.RateLimitError):
+        return rate_limits and getattr(e, "code", None) != "insufficient_quota"
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in (408, 409) or e.status_code >= 500
+    return False
+
+
+def server_delay(headers: httpx.Headers) -> float | None:
+    """Пауза, запрошенная сервером (Retry-After / retry-after-ms)."""
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных вызовов по моделям."""
+
+    def __init__(self, window: int = 200, quantile: float = HEDGE_QUANTILE, min_samples: int = HEDGE_MIN_SAMPLES):
+        self.window = window
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._samples: dict[str, deque[float]] = {}
+
+
+    def add(self, model: str, latency: float) -> None:
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(latency)
+
+
+    def threshold(self, model: str) -> float | None:
+        """Квантиль длительности (по умолчанию p95) или None, пока данных мало."""
+        samples = self._samples.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.quantile))]
+
+
+class Resilience:
+    """Повторы с экспоненциальной задержкой и джиттером, дедлайн запроса и хеджирование.
+
+    Хеджирование: если вызов не завершился за p95 недавних вызовов той же модели,
+    отправляется второй такой же запрос и берется ответ, пришедший первым.
+    """
+
+    def __init__(self, retry_rate_limits: bool = True):
+        # 429 повторяются здесь, только если их не возвращает в свою очередь RateLimiter
+        self.retry_rate_limits = retry_rate_limits
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+
+    async def call(self, model: str, fn: Callable[[], Awaitable[Any]], hedge: bool = True) -> Any:
+        """Выполнение вызова OpenAI fn() по политике текущего маршрута.
+
+        hedge=False запрещает хеджирование (например, для стриминга, где дельты уже ушли клиенту).
+        """
+        policy = get_policy()
+        deadline = request_deadline.get() or time.monotonic() + policy.deadline
+
+        for attempt in range(1, policy.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.deadline_exceeded += 1
+                raise DeadlineExceeded(f"deadline exceeded before attempt {attempt}")
+
+            started = time.monotonic()
+            sent = deltas_sent()
+            timeout = asyncio.timeout(remaining)
+            try:
+                async with timeout:
+                    hedge_delay = self.latency.threshold(model) if hedge and policy.hedge else None
+                    if hedge_delay is not None and hedge_delay < remaining:
+                        response = await self._hedged(fn, hedge_delay)
+                    else:
+                        response = await fn()
+            except TimeoutError:
+                if not timeout.expired():
+                    raise
+                self.deadline_exceeded += 1
+                raise DeadlineExceeded(f"deadline exceeded on attempt {attempt}") from None
+            except Exception as e:
+                if not is_retryable(e, self.retry_rate_limits) or attempt == policy.max_attempts:
+                    raise
+                # Часть ответа уже ушла в SSE-поток - повтор продублировал бы текст
+                if deltas_sent() > sent:
+                    raise
+                delay = self._backoff(policy, attempt, e)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                self.retries += 1
+                logger.warning(
+                    f"Resilience - {type(e).__name__} on attempt {attempt}/{policy.max_attempts}, retry in {delay:.2f}s",
+                )
+                await emit("retry", {"attempt": attempt + 1, "error": type(e).__name__, "delay": round(delay, 2)})
+                await asyncio.sleep(delay)
+            else:
+                self.latency.add(model, time.monotonic() - started)
+                return response
+
+
+    def stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedge_thresholds": {
+                model: self.latency.threshold(model) for model in self.latency._samples
+            },
+        }
+
+
+    def _backoff(self, policy: RetryPolicy, attempt: int, e: Exception) -> float:
+        # Full jitter, но не меньше паузы, которую просит сервер
+        delay = random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** (attempt - 1)))
+        response = getattr(e, "response", None)
+        if response is not None:
+            delay = max(delay, server_delay(response.headers) or 0)
+        return delay
+
+
+    async def _hedged(self, fn: Callable[[], Awaitable[Any]], hedge_delay: float) -> Any:
+        tasks = [asyncio.ensure_future(fn())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done:
+                return tasks[0].result()
+
+            self.hedged += 1
+            tasks.append(asyncio.ensure_future(fn()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Проигравший (или оба при отмене/дедлайне) запрос прерывается
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from pathlib import Path
+
+from fastapi import Request
+from openai.types.responses import Response
+
+from .settings import (
+    LLM_CACHE_DB,
+    LLM_CACHE_DISK_ITEMS,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_MEMORY_ITEMS,
+    LLM_CACHE_TTL,
+    logger,
+)
+
+# Обход чтения из кэша для текущего запроса (заголовок Cache-Control: no-cache или ?no_cache=1)
+cache_bypass: ContextVar[bool] = ContextVar("cache_bypass", default=False)
+
+
+def is_cache_bypass_requested(request: Request) -> bool:
+    return (
+        "no-cache" in request.headers.get("cache-control", "")
+        or request.query_params.get("no_cache", "").lower() in ("1", "true")
+    )
+
+
+class ResponseCache:
+    """Двухуровневый кэш ответов LLM по хэшу содержимого запроса.
+
+    Первый уровень - LRU в памяти, второй - SQLite с TTL и ограничением числа записей.
+    Операции с диском выполняются в пуле потоков, чтобы не блокировать event loop.
+    """
+
+    def __init__(self,
+        enabled: bool = LLM_CACHE_ENABLED, db_path: Path = LLM_CACHE_DB, ttl: float = LLM_CACHE_TTL,
+        memory_items: int = LLM_CACHE_MEMORY_ITEMS, disk_items: int = LLM_CACHE_DISK_ITEMS,
+    ):
+        self.enabled = enabled
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[float, Response]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+
+
+    @staticmethod
+    def make_key(model: str, instruction: str | None, temperature: float | None, prompt, text_format=None,
+        max_output_tokens: int | None = None,
+    ) -> str:
+        """Ключ кэша: sha256 от модели, инструкции, температуры, нормализованного промпта, схемы ответа
+        и лимита ответа (только если он задан, чтобы не менять ключи прежних записей).
+        """
+        if isinstance(prompt, str):
+            prompt = "\n".join(line.rstrip() for line in prompt.strip().splitlines())
+        schema = text_format.model_json_schema() if text_format else None
+        parts = [model, instruction, temperature, prompt, schema]
+        if max_output_tokens is not None:
+            parts.append(max_output_tokens)
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+    async def get(self, key: str) -> Response | None:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            created_at, response = entry
+            if now - created_at < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return response
+            del self._memory[key]
+
+        try:
+            row = await asyncio.to_thread(self._db_get, key, now)
+        except Exception as e:
+            logger.error(f"ResponseCache.get() error: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+
+        created_at, data = row
+        response = Response.model_validate_json(data)
+        self._remember(key, created_at, response)
+        self.hits_disk += 1
+        return response
+
+
+    async def set(self, key: str, response: Response) -> None:
+        created_at = time.time()
+        self._remember(key, created_at, response)
+        try:
+            await asyncio.to_thread(self._db_set, key, created_at, response.model_dump_json())
+        except Exception as e:
+            logger.error(f"ResponseCache.set() error: {e}")
+
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_disk
+        total = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_ratio": hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+
+    def _remember(self, key: str, created_at: float, response: Response) -> None:
+        self._memory[key] = (created_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, created_at REAL NOT NULL, accessed_at REAL NOT NULL, data TEXT NOT NULL)",
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+        return self._db
+
+
+    def _db_get(self, key: str, now: float) -> tuple[float, str] | None:
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute("SELECT created_at, data FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[0] >= self.ttl:
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            return row
+
+
+    def _db_set(self, key: str, created_at: float, data: str) -> None:
+        with self._db_lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, created_at, accessed_at, data) VALUES (?, ?, ?, ?)",
+                (key, created_at, created_at, data),
+            )
+            self._writes += 1
+            # Периодическая очистка: истекшие записи и самые давно использованные сверх лимита
+            if self._writes % 50 == 1:
+                db.execute("DELETE FROM llm_cache WHERE created_at < ?", (created_at - self.ttl,))
+                db.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_items,),
+                )
+            db.commit()
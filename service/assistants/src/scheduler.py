@@ -0,0 +1,282 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from typing import Any
+
+from fastapi import Request
+from pydantic import BaseModel
+
+from .metrics import SCHEDULER_ACTIVE, SCHEDULER_PROMOTED, SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT
+from .settings import (
+    SCHEDULER_BULK_CONCURRENCY,
+    SCHEDULER_CONCURRENCY,
+    SCHEDULER_ENABLED,
+    SCHEDULER_MAX_WAIT,
+    SCHEDULER_POLICIES,
+    logger,
+)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Маршруты сервиса ассистентов, запросы которых по умолчанию считаются фоновыми
+BULK_ROUTES = ("/api/v1/batch",)
+
+
+class Job(BaseModel):
+    """От чьего имени выполняется вызов OpenAI: класс приоритета, пользователь и задание (таблица, пакет)."""
+
+    priority: str = INTERACTIVE
+    user: str = "anonymous"
+    name: str | None = None
+
+
+# Задание текущего запроса или строки таблицы (None - интерактивный вызов анонимного пользователя)
+current_job: ContextVar[Job | None] = ContextVar("current_job", default=None)
+
+
+def job_from_request(request: Request, rid: str | None = None) -> Job:
+    """Задание HTTP запроса по заголовкам X-Priority, X-User-ID и X-Job-ID.
+
+    Без X-Priority запросы BULK_ROUTES фоновые, остальные интерактивные. Пакет без X-Job-ID - отдельное задание.
+    """
+    bulk = request.url.path in BULK_ROUTES
+    priority = (request.headers.get("x-priority") or "").strip().lower()
+    if priority not in POLICIES:
+        priority = BULK if bulk else INTERACTIVE
+    return Job(
+        priority=priority,
+        user=request.headers.get("x-user-id") or "anonymous",
+        name=request.headers.get("x-job-id") or (rid if bulk else None),
+    )
+
+
+class ClassPolicy(BaseModel):
+    # Меньшее значение обслуживается раньше
+    rank: int
+    max_concurrency: int = SCHEDULER_CONCURRENCY
+    # Защита от голодания: вызов, ждущий дольше, получает ближайший свободный слот вне очереди (None - не нужно)
+    max_wait: float | None = None
+
+
+POLICIES = {
+    INTERACTIVE: ClassPolicy(rank=0),
+    BULK: ClassPolicy(rank=1, max_concurrency=SCHEDULER_BULK_CONCURRENCY, max_wait=SCHEDULER_MAX_WAIT),
+}
+for _name, _overrides in SCHEDULER_POLICIES.items():
+    POLICIES[_name] = POLICIES.get(_name, POLICIES[BULK]).model_copy(update=_overrides)
+
+
+def priority_rank(job: Job | None) -> int:
+    """Ранг класса приоритета задания (меньшее значение обслуживается раньше)."""
+    policy = POLICIES.get((job or Job()).priority) or POLICIES[INTERACTIVE]
+    return policy.rank
+
+
+class _Flow:
+    """Очередь одного задания пользователя внутри класса приоритета."""
+
+    __slots__ = ("key", "finish", "queued", "active")
+
+    def __init__(self, key: tuple[str, str | None]):
+        self.key = key
+        self.finish = 0.0
+        self.queued = 0
+        self.active = 0
+
+
+class _Ticket:
+    __slots__ = ("priority", "flow", "start", "enqueued_at", "future", "done")
+
+    def __init__(self, priority: str, flow: _Flow, start: float):
+        self.priority = priority
+        self.flow = flow
+        self.start = start
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Слот выдан или ожидание отменено - билет больше не в очереди
+        self.done = False
+
+
+class _PriorityClass:
+    def __init__(self, name: str, policy: ClassPolicy):
+        self.name = name
+        self.policy = policy
+        self.virtual_time = 0.0
+        self.flows: dict[tuple[str, str | None], _Flow] = {}
+        self.heap: list[tuple[float, int, _Ticket]] = []
+        self.arrivals: deque[_Ticket] = deque()
+        self.queued = 0
+        self.active = 0
+        self.admitted = 0
+        self.promoted = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+
+    def oldest_wait(self, now: float) -> float:
+        while self.arrivals and self.arrivals[0].done:
+            self.arrivals.popleft()
+        return now - self.arrivals[0].enqueued_at if self.arrivals else 0.0
+
+
+    def pop(self) -> _Ticket:
+        while True:
+            ticket = heapq.heappop(self.heap)[2]
+            if not ticket.done:
+                return ticket
+
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "active": self.active,
+            "flows": sum(1 for flow in self.flows.values() if flow.queued or flow.active),
+            "admitted": self.admitted,
+            "promoted": self.promoted,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "max_wait": round(self.max_wait, 3),
+            "oldest_wait": round(self.oldest_wait(time.monotonic()), 3),
+            "max_concurrency": self.policy.max_concurrency,
+        }
+
+
+class Scheduler:
+    """Очередь вызовов OpenAI с классами приоритета и справедливым разделением слотов.
+
+    Слоты (не больше concurrency одновременных вызовов) выдаются классам по рангу: фоновые вызовы
+    получают слот, только если нет ждущих интерактивных, и занимают не больше max_concurrency
+    своего класса. Внутри класса очередь справедливая (start-time fair queuing): каждый пользователь
+    получает равную долю токенов, а доля пользователя делится поровну между его заданиями.
+    Вызов класса с max_wait, прождавший дольше, получает ближайший свободный слот вне очереди.
+    """
+
+    def __init__(self, enabled: bool = SCHEDULER_ENABLED, concurrency: int = SCHEDULER_CONCURRENCY):
+        self.enabled = enabled
+        self.concurrency = concurrency
+        self.active = 0
+        self._classes = {name: _PriorityClass(name, policy) for name, policy in POLICIES.items()}
+        self._sequence = itertools.count()
+
+
+    async def run(self, cost: int, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнение вызова fn() стоимостью cost токенов в слоте задания current_job."""
+        if not self.enabled:
+            return await fn()
+
+        ticket = await self.acquire(current_job.get() or Job(), cost)
+        try:
+            return await fn()
+        finally:
+            self.release(ticket)
+
+
+    async def acquire(self, job: Job, cost: int) -> _Ticket:
+        priority = self._classes.get(job.priority) or self._classes[INTERACTIVE]
+        ticket = self._enqueue(priority, job, cost)
+        # Свободный слот выдается сразу: future уже завершена, и await не переключает задачу
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Слот выдан одновременно с отменой - возвращается следующему в очереди
+                self.release(ticket)
+            else:
+                ticket.done = True
+                ticket.flow.queued -= 1
+                priority.queued -= 1
+                SCHEDULER_QUEUE_DEPTH.dec(priority=priority.name)
+                self._forget(priority, ticket.flow)
+            raise
+        return ticket
+
+
+    def release(self, ticket: _Ticket) -> None:
+        priority = self._classes[ticket.priority]
+        self.active -= 1
+        priority.active -= 1
+        ticket.flow.active -= 1
+        SCHEDULER_ACTIVE.dec(priority=priority.name)
+        self._forget(priority, ticket.flow)
+        self._dispatch()
+
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "classes": {name: priority.stats() for name, priority in self._classes.items()},
+        }
+
+
+    def _enqueue(self, priority: _PriorityClass, job: Job, cost: int) -> _Ticket:
+        key = (job.user, job.name)
+        flow = priority.flows.get(key)
+        if flow is None:
+            flow = priority.flows[key] = _Flow(key)
+        # Доля пользователя делится между его заданиями: стоимость умножается на их число
+        jobs = sum(
+            1 for other in priority.flows.values()
+            if other.key[0] == job.user and (other.queued or other.active or other is flow)
+        )
+        start = max(priority.virtual_time, flow.finish)
+        flow.finish = start + max(cost, 1) * jobs
+        flow.queued += 1
+        ticket = _Ticket(priority.name, flow, start)
+        priority.queued += 1
+        SCHEDULER_QUEUE_DEPTH.inc(priority=priority.name)
+        heapq.heappush(priority.heap, (start, next(self._sequence), ticket))
+        priority.arrivals.append(ticket)
+        return ticket
+
+
+    def _dispatch(self) -> None:
+        while self.active < self.concurrency:
+            now = time.monotonic()
+            candidates = [
+                priority for priority in self._classes.values()
+                if priority.queued and priority.active < priority.policy.max_concurrency
+            ]
+            if not candidates:
+                return
+            starving = [
+                priority for priority in candidates
+                if priority.policy.max_wait is not None and priority.oldest_wait(now) >= priority.policy.max_wait
+            ]
+            priority = min(starving or candidates, key=lambda priority: priority.policy.rank)
+            promoted = bool(starving) and priority.policy.rank > min(candidate.policy.rank for candidate in candidates)
+            ticket = priority.pop()
+            self._grant(priority, ticket, promoted)
+            ticket.future.set_result(None)
+
+
+    def _grant(self, priority: _PriorityClass, ticket: _Ticket, promoted: bool) -> None:
+        waited = time.monotonic() - ticket.enqueued_at
+        ticket.done = True
+        ticket.flow.queued -= 1
+        ticket.flow.active += 1
+        priority.queued -= 1
+        priority.active += 1
+        self.active += 1
+        priority.virtual_time = max(priority.virtual_time, ticket.start)
+        priority.admitted += 1
+        priority.wait_seconds += waited
+        priority.max_wait = max(priority.max_wait, waited)
+        SCHEDULER_QUEUE_DEPTH.dec(priority=priority.name)
+        SCHEDULER_ACTIVE.inc(priority=priority.name)
+        SCHEDULER_WAIT.observe(waited, priority=priority.name)
+        if promoted:
+            priority.promoted += 1
+            SCHEDULER_PROMOTED.inc(priority=priority.name)
+            logger.info(f"Scheduler - {priority.name} call of {ticket.flow.key} waited {waited:.1f}s, promoted")
+
+
+    def _forget(self, priority: _PriorityClass, flow: _Flow) -> None:
+        """Удаление простаивающего задания, очередь которого уже не опережает виртуальное время класса."""
+        if not flow.queued and not flow.active and flow.finish <= priority.virtual_time:
+            priority.flows.pop(flow.key, None)
@@ -1,4 +1,5 @@
 
+import json
 import logging
 import os
 import sys
@@ -37,3 +38,125 @@ logging.getLogger("httpcore").setLevel(logging.INFO)
 PROXY = os.getenv("PROXY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DJANGO_API_URL = os.getenv("DJANGO_API_URL")
+
+# Пул соединений к Django API (keep-alive)
+DJANGO_HTTP_MAX_CONNECTIONS = int(os.getenv("DJANGO_HTTP_MAX_CONNECTIONS", "100"))
+DJANGO_HTTP_MAX_KEEPALIVE = int(os.getenv("DJANGO_HTTP_MAX_KEEPALIVE", "20"))
+DJANGO_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("DJANGO_HTTP_KEEPALIVE_EXPIRY", "30"))
+DJANGO_HTTP_TIMEOUT = float(os.getenv("DJANGO_HTTP_TIMEOUT", "30"))
+DJANGO_HTTP_CONNECT_TIMEOUT = float(os.getenv("DJANGO_HTTP_CONNECT_TIMEOUT", "5"))
+
+# Кэш каталога (ссылки на товары) с инвалидацией по версии из Django
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "3600"))
+CATALOG_VERSION_CHECK_INTERVAL = float(os.getenv("CATALOG_VERSION_CHECK_INTERVAL", "30"))
+# Число наиболее релевантных товаров каталога в промпте (0 - весь каталог)
+CATALOG_TOP_K = int(os.getenv("CATALOG_TOP_K", "30"))
+# JSON вида {"change_tech_instruction": 40}
+CATALOG_TOP_K_BY_METHOD = json.loads(os.getenv("CATALOG_TOP_K_BY_METHOD", "{}"))
+
+# Кэш ответов LLM (LRU в памяти + SQLite на диске)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("true", "1", "t", "on")
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256"))
+LLM_CACHE_DISK_ITEMS = int(os.getenv("LLM_CACHE_DISK_ITEMS", "5000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_DB = Path(os.getenv("LLM_CACHE_DB", SERVICE_DIR / "data/cache/llm_cache.sqlite3"))
+os.makedirs(LLM_CACHE_DB.parent, exist_ok=True)
+
+# Журнал запросов к LLM (сжатый JSONL с ротацией)
+TRANSCRIPTS_DIR = SERVICE_DIR / "data/transcripts/"
+os.makedirs(TRANSCRIPTS_DIR, exist_ok=True)
+TRANSCRIPTS_MAX_FILE_MB = float(os.getenv("TRANSCRIPTS_MAX_FILE_MB", "50"))
+TRANSCRIPTS_RETENTION_DAYS = int(os.getenv("TRANSCRIPTS_RETENTION_DAYS", "30"))
+TRANSCRIPTS_QUEUE_SIZE = int(os.getenv("TRANSCRIPTS_QUEUE_SIZE", "10000"))
+
+# Пакетная генерация (POST /api/v1/batch)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+# Клиентское ограничение частоты запросов к OpenAI (уточняется по заголовкам x-ratelimit-*)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("true", "1", "t", "on")
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "500"))
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM", "200000"))
+RATE_LIMIT_MAX_CONCURRENCY = int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", "16"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+RATE_LIMIT_OUTPUT_TOKENS = int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "1500"))
+RATE_LIMIT_CHARS_PER_TOKEN = float(os.getenv("RATE_LIMIT_CHARS_PER_TOKEN", "3"))
+RATE_LIMIT_IMAGE_TOKENS = int(os.getenv("RATE_LIMIT_IMAGE_TOKENS", "1000"))
+
+# Повторы, дедлайны и хеджирование запросов к OpenAI (политики по маршрутам см. src/resilience.py)
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "300"))
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# JSON вида {"/api/v1/change/article": {"deadline": 180, "hedge": false}}
+RETRY_POLICIES = json.loads(os.getenv("RETRY_POLICIES", "{}"))
+
+# Проверка текста по negative_instruction: "llm" - всегда запрос к модели; "rules" - локальные правила,
+# модель только для того, что нельзя исправить механически; "rules_only" - только правила.
+# Часть требований (синонимы, подготовка поверхности, связки систем) правилами не проверяется,
+# поэтому по умолчанию "llm", а "rules" включается для ассистентов, где этого достаточно
+NEGATIVE_PASS_MODE = os.getenv("NEGATIVE_PASS_MODE", "llm")
+# JSON вида {"get_description": "llm"}
+NEGATIVE_PASS_MODES = json.loads(os.getenv("NEGATIVE_PASS_MODES", "{}"))
+
+# Ссылки на товары в tech_instruction/category_description: "placeholders" - модель получает только
+# названия и ставит маркеры [[product:...]], ссылки подставляются локально; "inline" - словарь ссылок в промпте
+PRODUCT_LINKS_MODE = os.getenv("PRODUCT_LINKS_MODE", "placeholders")
+
+# Предобработка фото work_results (нужен Pillow, без него фото только проверяются и отправляются как есть)
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() in ("true", "1", "t", "on")
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_CACHE_ITEMS = int(os.getenv("IMAGE_CACHE_ITEMS", "64"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Уровень детализации изображений для модели: auto | low | high
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "auto")
+
+# Бюджет токенов на поля запроса: при превышении - truncate | summarize | reject (413)
+TOKEN_BUDGET_ENABLED = os.getenv("TOKEN_BUDGET_ENABLED", "true").lower() in ("true", "1", "t", "on")
+TOKEN_BUDGET_MAX_INPUT_TOKENS = int(os.getenv("TOKEN_BUDGET_MAX_INPUT_TOKENS", "16000"))
+TOKEN_BUDGET_MAX_KEYWORDS = int(os.getenv("TOKEN_BUDGET_MAX_KEYWORDS", "60"))
+# JSON вида {"change_article": {"max_input_tokens": 32000, "on_overflow": "reject"}}
+TOKEN_BUDGET_POLICIES = json.loads(os.getenv("TOKEN_BUDGET_POLICIES", "{}"))
+# Как часто перечитывать Assistant.maks_token из Django, секунды
+ASSISTANT_LIMITS_TTL = float(os.getenv("ASSISTANT_LIMITS_TTL", "300"))
+# У reasoning-моделей (o1, o3, o4, gpt-5) max_output_tokens включает токены рассуждений: к maks_token
+# добавляется этот запас, 0 - лимит им не передается
+REASONING_OUTPUT_HEADROOM = int(os.getenv("REASONING_OUTPUT_HEADROOM", "0"))
+
+# Маршрутизация запросов по активным моделям из Django (Models): ключи расшифровываются ENCRYPTION_KEY,
+# без строк Models для модели запросы идут через OPENAI_API_KEY
+LLM_ROUTER_ENABLED = os.getenv("LLM_ROUTER_ENABLED", "true").lower() in ("true", "1", "t", "on")
+ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
+# Токен внутренних эндпоинтов Django (X-Service-Token), без него ключи моделей не запрашиваются
+SERVICE_API_TOKEN = os.getenv("SERVICE_API_TOKEN", "")
+# Как часто проверять изменения моделей в Django, секунды
+LLM_ROUTER_REFRESH = float(os.getenv("LLM_ROUTER_REFRESH", "30"))
+# Пауза ключа после 429/5xx/ошибки сети и после 401/403/исчерпанной квоты, секунды
+LLM_ROUTER_COOLDOWN = float(os.getenv("LLM_ROUTER_COOLDOWN", "5"))
+LLM_ROUTER_BAN = float(os.getenv("LLM_ROUTER_BAN", "300"))
+
+# Предохранители зависимостей (OpenAI по ключам, Django): после CIRCUIT_BREAKER_FAILURES ошибок подряд
+# вызовы отклоняются без обращения к зависимости, через CIRCUIT_BREAKER_RECOVERY секунд пропускается пробный вызов
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() in ("true", "1", "t", "on")
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RECOVERY = float(os.getenv("CIRCUIT_BREAKER_RECOVERY", "30"))
+CIRCUIT_BREAKER_MAX_RECOVERY = float(os.getenv("CIRCUIT_BREAKER_MAX_RECOVERY", "300"))
+# JSON вида {"django": {"failure_threshold": 3, "recovery_timeout": 10}}
+CIRCUIT_BREAKER_POLICIES = json.loads(os.getenv("CIRCUIT_BREAKER_POLICIES", "{}"))
+
+# Планировщик вызовов OpenAI: интерактивные генерации получают слоты раньше фоновых (строки таблиц, /api/v1/batch),
+# внутри класса слоты делятся поровну между пользователями и их заданиями
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("true", "1", "t", "on")
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", str(RATE_LIMIT_MAX_CONCURRENCY)))
+# Сколько слотов могут занять фоновые вызовы (остальные остаются свободными для интерактивных)
+SCHEDULER_BULK_CONCURRENCY = int(os.getenv("SCHEDULER_BULK_CONCURRENCY", "12"))
+# Фоновый вызов, ждущий дольше, получает ближайший свободный слот вне очереди, секунды
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "30"))
+# JSON вида {"bulk": {"max_concurrency": 8, "max_wait": 60}}
+SCHEDULER_POLICIES = json.loads(os.getenv("SCHEDULER_POLICIES", "{}"))
@@ -0,0 +1,74 @@
+import asyncio
+import contextvars
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых запросов в один вызов.
+
+    Первый вызов с ключом запускает задачу, остальные ждут ее результат.
+    Отмена одного ожидающего не затрагивает остальных; задача отменяется,
+    только когда не осталось ни одного ожидающего.
+
+    Задача выполняется в переданном контексте (contextvars), а не в контексте первого вызова,
+    чтобы его дедлайн или SSE-поток не распространялись на остальных. Вызов с более высоким
+    приоритетом (меньший rank) не ждет чужую задачу, а запускает свою, и к ней присоединяются следующие.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._ranks: dict[asyncio.Task, int] = {}
+        self._waiters: dict[asyncio.Task, int] = {}
+
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+        context: contextvars.Context | None = None, rank: int = 0,
+    ) -> tuple[Any, bool]:
+        """Выполнение fn() с объединением по ключу.
+
+        Returns:
+            tuple: (результат, True если результат получен от чужого вызова)
+
+        """
+        task = self._tasks.get(key)
+        shared = task is not None and self._ranks[task] <= rank
+        if not shared:
+            task = asyncio.get_running_loop().create_task(fn(), context=context)
+            self._tasks[key] = task
+            self._ranks[task] = rank
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if self._waiters.get(task, 0) <= 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] = self._waiters.get(task, 1) - 1
+            if self._waiters[task] <= 0:
+                self._waiters.pop(task, None)
+
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._tasks),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        self._ranks.pop(task, None)
+        # Исключение уже передано ожидающим, гасим предупреждение "never retrieved"
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,80 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextvars import ContextVar
+
+from fastapi import Request
+from pydantic import BaseModel
+
+class StreamSink(asyncio.Queue):
+    """Очередь событий SSE-запроса со счетчиком уже отправленных дельт текста."""
+
+    def __init__(self):
+        super().__init__()
+        self.deltas = 0
+
+
+# Очередь событий текущего SSE-запроса (None - обычный запрос без стриминга)
+stream_sink: ContextVar[StreamSink | None] = ContextVar("stream_sink", default=None)
+
+
+def is_stream_requested(request: Request, stream: bool = False) -> bool:
+    """Стриминг включается через ?stream=1 или заголовок Accept: text/event-stream."""
+    return stream or "text/event-stream" in request.headers.get("accept", "")
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def emit(event: str, data: dict) -> None:
+    """Отправка события в SSE-поток текущего запроса (ничего не делает вне стриминга)."""
+    sink = stream_sink.get()
+    if sink is not None:
+        if event == "delta":
+            sink.deltas += 1
+        await sink.put((event, data))
+
+
+def deltas_sent() -> int:
+    """Число дельт, отправленных в SSE-поток текущего запроса (0 вне стриминга).
+
+    После первой дельты вызов OpenAI нельзя повторить или перенести на другой ключ:
+    клиент получил бы текст двух ответов подряд.
+    """
+    sink = stream_sink.get()
+    return sink.deltas if sink is not None else 0
+
+
+async def iter_sse(
+    generate: Callable[[], Awaitable[BaseModel]],
+    on_error: Callable[[Exception], dict],
+) -> AsyncIterator[str]:
+    """Запуск генерации с трансляцией событий в формате SSE.
+
+    Промежуточные события (start, delta) отдаются по мере поступления,
+    в конце отправляется result с телом обычного ответа эндпоинта или error.
+    """
+    queue = StreamSink()
+    token = stream_sink.set(queue)
+    try:
+        task = asyncio.create_task(generate())
+    finally:
+        stream_sink.reset(token)
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+
+    try:
+        # Сразу отдаем первый байт, не дожидаясь запросов к Django и OpenAI
+        yield ": stream started\n\n"
+        while (item := await queue.get()) is not None:
+            yield format_sse(*item)
+        try:
+            result = task.result()
+        except Exception as e:
+            yield format_sse("error", on_error(e))
+        else:
+            yield format_sse("result", result.model_dump())
+    finally:
+        # Клиент отключился - прекращаем генерацию
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,252 @@
+import asyncio
+import math
+import re
+import time
+from collections.abc import Awaitable, Callable
+from typing import Literal
+
+import httpx
+from pydantic import BaseModel
+
+from .other_utils import get_assistant_limits
+from .settings import (
+    ASSISTANT_LIMITS_TTL,
+    RATE_LIMIT_CHARS_PER_TOKEN,
+    REASONING_OUTPUT_HEADROOM,
+    TOKEN_BUDGET_ENABLED,
+    TOKEN_BUDGET_MAX_INPUT_TOKENS,
+    TOKEN_BUDGET_MAX_KEYWORDS,
+    TOKEN_BUDGET_POLICIES,
+    logger,
+)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Ключи ассистентов (Assistant.key_title в Django) по методам OpenAIAgent
+ASSISTANT_KEYS = {
+    "get_sub_description": "sub_description",
+    "get_description": "description",
+    "get_usage": "usage",
+    "get_features": "features",
+    "get_preview": "preview",
+    "get_reviews": "reviews",
+    "get_work_results": "work_results",
+    "change_article": "change_article",
+    "get_article": "article",
+    "change_tech_instruction": "tech_instruction",
+    "change_category_description": "category_description",
+}
+# Минимальное значение max_output_tokens, которое принимает OpenAI
+MIN_OUTPUT_TOKENS = 16
+# Reasoning-модели OpenAI (gpt-5-chat - обычная чат-модель без рассуждений)
+_REASONING_MODEL_RE = re.compile(r"^(?:[\w-]+/)?(?:o\d|gpt-5(?!-chat))", re.IGNORECASE)
+
+_KEYWORDS_SPLIT_RE = re.compile(r"[,;\n]+")
+# Границы, по которым обрезается текст (от предпочтительной к менее предпочтительной)
+_CUT_BOUNDARIES = ("</p>", "</li>", "</ul>", "</ol>", "</table>", "\n", ". ", " ")
+_encoding = None
+
+
+def is_reasoning_model(model: str) -> bool:
+    """Модель тратит часть max_output_tokens на рассуждения (o1/o3/o4-mini, gpt-5...)."""
+    return bool(_REASONING_MODEL_RE.match(model.strip()))
+
+
+class TokenBudgetExceeded(Exception):
+    """Поля запроса не помещаются в бюджет ассистента с политикой reject."""
+
+
+class BudgetPolicy(BaseModel):
+    max_input_tokens: int = TOKEN_BUDGET_MAX_INPUT_TOKENS
+    max_keywords: int = TOKEN_BUDGET_MAX_KEYWORDS
+    dedupe_keywords: bool = True
+    on_overflow: Literal["truncate", "summarize", "reject"] = "truncate"
+    # Больше этого в запрос на сжатие не отправляется (остаток обрезается)
+    max_summarize_tokens: int = 60000
+
+
+# Статью нельзя молча обрезать, а техническую инструкцию и описание категории можно сжать моделью
+POLICIES = {
+    "default": BudgetPolicy(),
+    "change_article": BudgetPolicy(max_input_tokens=32000, on_overflow="reject"),
+    "change_tech_instruction": BudgetPolicy(max_input_tokens=24000, on_overflow="summarize"),
+    "change_category_description": BudgetPolicy(on_overflow="summarize"),
+}
+for _name, _overrides in TOKEN_BUDGET_POLICIES.items():
+    POLICIES[_name] = POLICIES.get(_name, POLICIES["default"]).model_copy(update=_overrides)
+
+
+def get_policy(method: str) -> BudgetPolicy:
+    return POLICIES.get(method, POLICIES["default"])
+
+
+def count_tokens(text: str | None) -> int:
+    """Число токенов текста: tiktoken (o200k_base), если установлен, иначе оценка по числу символов."""
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning(f"count_tokens() - tiktoken encoding is unavailable, using estimate: {e}")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / RATE_LIMIT_CHARS_PER_TOKEN)
+
+
+def dedupe_keywords(text: str, max_keywords: int) -> str:
+    """Список ключевых слов без повторов (без учета регистра, ё/е и пробелов), не длиннее max_keywords."""
+    keywords = []
+    seen = set()
+    for keyword in _KEYWORDS_SPLIT_RE.split(text):
+        keyword = " ".join(keyword.split())
+        key = keyword.lower().replace("ё", "е")
+        if keyword and key not in seen:
+            seen.add(key)
+            keywords.append(keyword)
+    return ", ".join(keywords[:max_keywords])
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Обрезка текста до max_tokens по ближайшей границе абзаца, строки или предложения."""
+    tokens = count_tokens(text)
+    while tokens > max_tokens and text:
+        limit = int(len(text) * max_tokens / tokens)
+        cut = limit
+        for boundary in _CUT_BOUNDARIES:
+            position = text.rfind(boundary, int(limit * 0.8), limit)
+            if position != -1:
+                cut = position + len(boundary)
+                break
+        text = text[:cut].rstrip()
+        tokens = count_tokens(text)
+    return text
+
+
+class TokenBudget:
+    """Ограничение размера полей запроса по политикам ассистентов (BudgetPolicy).
+
+    Ключевые слова (поля seo_*) очищаются от повторов. Если поля все равно не помещаются
+    в max_input_tokens, самое длинное поле сжимается моделью (summarize) или обрезается
+    (truncate), либо запрос отклоняется (reject -> 413).
+    """
+
+    def __init__(self, enabled: bool = TOKEN_BUDGET_ENABLED):
+        self.enabled = enabled
+        self.checked = 0
+        self.deduped = 0
+        self.truncated = 0
+        self.summarized = 0
+        self.rejected = 0
+
+
+    async def fit(self, method: str, fields: dict[str, str | None],
+        summarize: Callable[[str, int], Awaitable[str]],
+    ) -> dict[str, str | None]:
+        """Поля в том же порядке, уложенные в бюджет метода.
+
+        summarize(text, max_tokens) - сжатие текста моделью для политики summarize.
+        """
+        if not self.enabled:
+            return fields
+
+        self.checked += 1
+        policy = get_policy(method)
+        fields = dict(fields)
+        if policy.dedupe_keywords:
+            for name, value in fields.items():
+                if name.startswith("seo_") and value:
+                    deduped = dedupe_keywords(value, policy.max_keywords)
+                    if deduped != value:
+                        self.deduped += 1
+                        fields[name] = deduped
+
+        tokens = {name: count_tokens(value) for name, value in fields.items()}
+        total = sum(tokens.values())
+        if total <= policy.max_input_tokens:
+            return fields
+
+        if policy.on_overflow == "reject":
+            self.rejected += 1
+            raise TokenBudgetExceeded(
+                f"{method}: input is ~{total} tokens, limit is {policy.max_input_tokens} tokens",
+            )
+
+        logger.info(f"TokenBudget - {method} input ~{total} tokens > {policy.max_input_tokens}, {policy.on_overflow}")
+        summarize_first = policy.on_overflow == "summarize"
+        while total > policy.max_input_tokens:
+            name = max(tokens, key=tokens.get)
+            target = max(tokens[name] - (total - policy.max_input_tokens), 0)
+            if summarize_first and target >= MIN_OUTPUT_TOKENS:
+                summarize_first = False
+                source = truncate_text(fields[name], policy.max_summarize_tokens)
+                fields[name] = await summarize(source, target)
+                self.summarized += 1
+            if count_tokens(fields[name]) > target:
+                fields[name] = truncate_text(fields[name], target)
+                self.truncated += 1
+            tokens[name] = count_tokens(fields[name])
+            total = sum(tokens.values())
+        return fields
+
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "tokenizer": "tiktoken" if _encoding else "estimate",
+            "checked": self.checked,
+            "deduped": self.deduped,
+            "truncated": self.truncated,
+            "summarized": self.summarized,
+            "rejected": self.rejected,
+        }
+
+
+class AssistantLimits:
+    """Кэш Assistant.maks_token из Django для передачи в OpenAI как max_output_tokens."""
+
+    def __init__(self, ttl: float = ASSISTANT_LIMITS_TTL):
+        self.ttl = ttl
+        self._limits: dict = {}
+        self._fetched_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+
+    async def max_output_tokens(self, client: httpx.AsyncClient, method: str | None, model: str | None = None) -> int | None:
+        """Лимит ответа для ассистента метода (None - не задан в Django или метод не ассистент).
+
+        maks_token ограничивает видимый текст. Reasoning-модели расходуют max_output_tokens и на
+        рассуждения, поэтому им лимит передается с запасом REASONING_OUTPUT_HEADROOM или не передается.
+        """
+        key = ASSISTANT_KEYS.get(method)
+        if key is None:
+            return None
+        limits = await self._get(client)
+        value = (limits.get(key) or {}).get("max_output_tokens")
+        if not value:
+            return None
+        if model and is_reasoning_model(model):
+            if REASONING_OUTPUT_HEADROOM <= 0:
+                return None
+            value += REASONING_OUTPUT_HEADROOM
+        return max(value, MIN_OUTPUT_TOKENS)
+
+
+    async def _get(self, client: httpx.AsyncClient) -> dict:
+        if time.monotonic() - self._fetched_at < self.ttl:
+            return self._limits
+
+        async with self._lock:
+            if time.monotonic() - self._fetched_at < self.ttl:
+                return self._limits
+            limits = await get_assistant_limits(client)
+            # При недоступном Django остаются прежние лимиты до следующей попытки
+            if limits is not None:
+                self._limits = limits
+            self._fetched_at = time.monotonic()
+            return self._limits
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import gzip
+import json
+import re
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from .settings import (
+    TRANSCRIPTS_DIR,
+    TRANSCRIPTS_MAX_FILE_MB,
+    TRANSCRIPTS_QUEUE_SIZE,
+    TRANSCRIPTS_RETENTION_DAYS,
+    logger,
+)
+
+# ID текущего HTTP запроса (заголовок X-Request-ID или сгенерированный)
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+_FILE_RE = re.compile(r"^transcripts-(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.jsonl\.gz$")
+
+
+class TranscriptStore:
+    """Журнал запросов к LLM в виде сжатых JSONL файлов с ротацией по дате и размеру.
+
+    Записи складываются в очередь и пишутся на диск фоновой задачей в пуле потоков,
+    поэтому логирование не блокирует event loop.
+    """
+
+    def __init__(self,
+        directory: Path = TRANSCRIPTS_DIR, max_file_mb: float = TRANSCRIPTS_MAX_FILE_MB,
+        retention_days: int = TRANSCRIPTS_RETENTION_DAYS, queue_size: int = TRANSCRIPTS_QUEUE_SIZE,
+    ):
+        self.directory = Path(directory)
+        self.max_file_bytes = int(max_file_mb * 1024 * 1024)
+        self.retention_days = retention_days
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._path: Path | None = None
+        self._path_date: str | None = None
+
+
+    async def start(self) -> None:
+        self._ensure_writer()
+
+
+    async def stop(self) -> None:
+        """Дописывает оставшиеся записи и останавливает фоновую задачу."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+
+    def record(self, method: str | None, model: str, response, latency: float,
+        source: str = "openai", product_name: str | None = None,
+    ) -> None:
+        """Постановка записи о вызове LLM в очередь на запись (без ожидания диска)."""
+        # Без lifespan (или после остановки) писатель запускается по требованию
+        self._ensure_writer()
+
+        usage = getattr(response, "usage", None)
+        input_details = getattr(usage, "input_tokens_details", None)
+        entry = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "request_id": request_id.get() or uuid.uuid4().hex,
+            "method": method,
+            "model": model,
+            "source": source,
+            "product_name": product_name,
+            "latency_ms": round(latency * 1000, 1),
+            "usage": {
+                "input_tokens": getattr(usage, "input_tokens", None),
+                "cached_tokens": getattr(input_details, "cached_tokens", None),
+                "output_tokens": getattr(usage, "output_tokens", None),
+                "total_tokens": getattr(usage, "total_tokens", None),
+            },
+            "response_id": getattr(response, "id", None),
+            "output": getattr(response, "output_text", None),
+        }
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"TranscriptStore.record() - queue is full, record dropped ({self.dropped} total)")
+
+
+    def _ensure_writer(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._writer())
+
+
+    async def _writer(self) -> None:
+        queue = self._queue
+        stop = False
+        while not stop:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < 500:
+                batch.append(queue.get_nowait())
+            if None in batch:
+                stop = True
+                batch = [entry for entry in batch if entry is not None]
+            if batch:
+                try:
+                    await asyncio.to_thread(self._write_batch, batch)
+                except Exception as e:
+                    logger.error(f"TranscriptStore._writer() error: {e}")
+
+
+    def _write_batch(self, batch: list[dict]) -> None:
+        path = self._current_path()
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+        # Каждая пачка - отдельный gzip member, записанный одним вызовом write в режиме append:
+        # файл остается читаемым целиком, даже если в него пишут несколько воркеров
+        with open(path, "ab") as f:
+            f.write(gzip.compress(data.encode("utf-8")))
+
+
+    def _current_path(self) -> Path:
+        today = date.today().isoformat()
+        if self._path_date != today:
+            self._path_date = today
+            self._path = self._latest_path(today)
+            self._cleanup()
+        if self._path.exists() and self._path.stat().st_size >= self.max_file_bytes:
+            match = _FILE_RE.match(self._path.name)
+            index = int(match.group(2) or 0) + 1
+            self._path = self.directory / f"transcripts-{today}.{index}.jsonl.gz"
+        return self._path
+
+
+    def _latest_path(self, day: str) -> Path:
+        indexes = [int(m.group(2) or 0) for m in self._iter_files() if m.group(1) == day]
+        index = max(indexes, default=0)
+        suffix = f".{index}" if index else ""
+        return self.directory / f"transcripts-{day}{suffix}.jsonl.gz"
+
+
+    def _cleanup(self) -> None:
+        """Удаление файлов старше срока хранения."""
+        border = (date.today() - timedelta(days=self.retention_days)).isoformat()
+        for match in self._iter_files():
+            if match.group(1) < border:
+                (self.directory / match.group(0)).unlink(missing_ok=True)
+
+
+    def _iter_files(self):
+        for path in self.directory.iterdir():
+            match = _FILE_RE.match(path.name)
+            if match:
+                yield match
+
+
+    def search(self, date_from: str | None = None, date_to: str | None = None,
+        method: str | None = None, product: str | None = None, limit: int = 100,
+    ) -> list[dict]:
+        """Поиск записей по диапазону дат (YYYY-MM-DD), методу и подстроке названия товара.
+
+        Returns:
+            list[dict]: последние limit подходящих записей, новые первыми
+
+        """
+        # Файлы читаются от новых к старым, из каждого хранится не больше недостающего числа записей
+        files = sorted(
+            self._iter_files(),
+            key=lambda m: (m.group(1), int(m.group(2) or 0)),
+            reverse=True,
+        )
+        product = product.lower() if product else None
+        found = []
+        for match in files:
+            if len(found) >= limit:
+                break
+            day = match.group(1)
+            if (date_from and day < date_from) or (date_to and day > date_to):
+                continue
+            latest = deque(maxlen=limit - len(found))
+            try:
+                with gzip.open(self.directory / match.group(0), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        if method and entry.get("method") != method:
+                            continue
+                        if product and product not in (entry.get("product_name") or "").lower():
+                            continue
+                        latest.append(entry)
+            except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+                # Файл дописывается прямо сейчас - берем то, что успели прочитать
+                pass
+            found.extend(reversed(latest))
+        return found
+
+
+def main() -> None:
+    """CLI: python -m src.transcripts --date-from 2025-01-01 --method get_description --product "88PU"."""
+    parser = argparse.ArgumentParser(description="Поиск по журналу запросов к LLM")
+    parser.add_argument("--date-from")
+    parser.add_argument("--date-to")
+    parser.add_argument("--method")
+    parser.add_argument("--product")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    entries = TranscriptStore().search(args.date_from, args.date_to, args.method, args.product, args.limit)
+    for entry in entries:
+        print(json.dumps(entry, ensure_ascii=False))
+    print(f"# {len(entries)} records, {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Общие фикстуры тестов сервиса ассистентов.
+
+Сервис и заглушка upstream (OpenAI Responses API и Django API) запускаются настоящими uvicorn
+в отдельных потоках: отключение клиента доходит до сервиса только через реальное соединение.
+"""
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+UPSTREAM_URL = f"http://127.0.0.1:{free_port()}"
+SERVICE_URL = f"http://127.0.0.1:{free_port()}"
+
+# Настройки читаются при импорте src.settings, поэтому задаются до импорта сервиса
+os.environ.update(
+    DEBUG="False",
+    OPENAI_API_KEY="test",
+    OPENAI_BASE_URL=f"{UPSTREAM_URL}/v1",
+    DJANGO_API_URL=UPSTREAM_URL,
+    LLM_CACHE_ENABLED="false",
+    LLM_CACHE_DB=str(Path(tempfile.mkdtemp()) / "llm_cache.sqlite3"),
+)
+os.environ.pop("SERVICE_API_TOKEN", None)
+# Сервис импортирует src.*, клиент AssistantsAPI - interface.*
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+# Длительность ответа заглушки: тест завершится раньше, только если запрос отменен
+UPSTREAM_SECONDS = 10
+
+
+class Upstream:
+    """Заглушка OpenAI и Django, которая записывает начало, завершение и обрыв каждого ответа."""
+
+    def __init__(self):
+        self.events: list[tuple[float, str]] = []
+        self._condition = threading.Condition()
+        self.app = Starlette(routes=[
+            Route("/v1/responses", self.responses, methods=["POST"]),
+            Route("/api/products/links/", self.links),
+            Route("/api/assistants/limits", lambda request: JSONResponse({})),
+        ])
+
+
+    def log(self, event: str) -> None:
+        with self._condition:
+            self.events.append((time.monotonic(), event))
+            self._condition.notify_all()
+
+
+    def mark(self) -> int:
+        with self._condition:
+            return len(self.events)
+
+
+    def since(self, mark: int) -> list[str]:
+        with self._condition:
+            return [event for _, event in self.events[mark:]]
+
+
+    def wait_for(self, mark: int, event: str, timeout: float = 3.0) -> float | None:
+        """Время (monotonic) события после mark или None, если его не было за timeout секунд."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for at, name in self.events[mark:]:
+                    if name == event:
+                        return at
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+
+    async def slow_body(self, name: str, chunks):
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except BaseException:
+            self.log(f"{name}_aborted")
+            raise
+        self.log(f"{name}_done")
+
+
+    async def responses(self, request):
+        body = await request.json()
+        self.log("openai_start")
+        if body.get("stream"):
+            return StreamingResponse(self.slow_body("openai", self._stream_events()), media_type="text/event-stream")
+        return StreamingResponse(self.slow_body("openai", self._json_response()), media_type="application/json")
+
+
+    async def links(self, request):
+        self.log("django_start")
+
+        async def chunks():
+            for _ in range(UPSTREAM_SECONDS * 10):
+                await asyncio.sleep(0.1)
+                yield " "
+            yield json.dumps({"product_name": {}})
+
+        return StreamingResponse(self.slow_body("django", chunks()), media_type="application/json")
+
+
+    async def _json_response(self):
+        # Пробелы перед JSON держат соединение открытым, как долгая генерация
+        for _ in range(UPSTREAM_SECONDS * 10):
+            await asyncio.sleep(0.1)
+            yield " "
+        yield json.dumps(_response("done"))
+
+
+    async def _stream_events(self):
+        sequence = 0
+
+        def event(name: str, data: dict) -> str:
+            nonlocal sequence
+            sequence += 1
+            return f"event: {name}\ndata: {json.dumps({'type': name, 'sequence_number': sequence, **data})}\n\n"
+
+        yield event("response.created", {"response": _response("", "in_progress")})
+        yield event("response.output_item.added", {
+            "output_index": 0,
+            "item": {"id": "msg_1", "type": "message", "role": "assistant", "status": "in_progress", "content": []},
+        })
+        yield event("response.content_part.added", {
+            "item_id": "msg_1", "output_index": 0, "content_index": 0,
+            "part": {"type": "output_text", "text": "", "annotations": []},
+        })
+        for index in range(UPSTREAM_SECONDS * 10):
+            await asyncio.sleep(0.1)
+            yield event("response.output_text.delta", {
+                "item_id": "msg_1", "output_index": 0, "content_index": 0, "delta": f"w{index} ", "logprobs": [],
+            })
+        yield event("response.completed", {"response": _response("done")})
+
+
+def _response(text: str, status: str = "completed") -> dict:
+    output = [{
+        "id": "msg_1", "type": "message", "role": "assistant", "status": "completed",
+        "content": [{"type": "output_text", "text": text, "annotations": []}],
+    }] if status == "completed" else []
+    return {
+        "id": "resp_1", "object": "response", "created_at": 0, "model": "gpt-4.1", "status": status, "output": output,
+        "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+        "usage": {
+            "input_tokens": 10, "output_tokens": 5, "total_tokens": 15,
+            "input_tokens_details": {"cached_tokens": 0}, "output_tokens_details": {"reasoning_tokens": 0},
+        },
+    }
+
+
+def serve(app, url: str) -> uvicorn.Server:
+    port = int(url.rsplit(":", 1)[1])
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"server {url} did not start")
+        time.sleep(0.05)
+    return server
+
+
+@pytest.fixture(scope="session")
+def upstream():
+    stub = Upstream()
+    server = serve(stub.app, UPSTREAM_URL)
+    yield stub
+    server.should_exit = True
+
+
+@pytest.fixture(scope="session")
+def service(upstream):
+    from main import app
+
+    server = serve(app, SERVICE_URL)
+    yield SERVICE_URL
+    server.should_exit = True
@@ -0,0 +1,97 @@
+"""Отмена генерации при отключении клиента и по дедлайну запроса: заглушка upstream видит обрыв."""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+USAGE = {"llm_model": "gpt-4.1", "usage": "текст", "domain": "main"}
+DESCRIPTION = {
+    **USAGE,
+    "product_name": "товар",
+    "description": "описание",
+    "seo_high_freq": "",
+    "seo_medium_freq": "",
+    "seo_low_freq": "",
+}
+
+
+def test_client_disconnect_cancels_upstream(service, upstream):
+    mark = upstream.mark()
+    with pytest.raises(httpx.ReadTimeout):
+        httpx.post(f"{service}/api/v1/change/usage", json=USAGE, timeout=1.0)
+    left_at = time.monotonic()
+
+    aborted_at = upstream.wait_for(mark, "openai_aborted")
+    assert aborted_at is not None, upstream.since(mark)
+    assert aborted_at - left_at < 1.0
+    assert "openai_done" not in upstream.since(mark)
+
+
+def test_sse_disconnect_cancels_upstream(service, upstream):
+    mark = upstream.mark()
+    deltas = 0
+    with httpx.stream("POST", f"{service}/api/v1/change/usage?stream=1", json=USAGE, timeout=10.0) as response:
+        assert response.status_code == 200
+        for line in response.iter_lines():
+            if line.startswith("event: delta"):
+                deltas += 1
+                if deltas == 3:
+                    break
+    closed_at = time.monotonic()
+
+    aborted_at = upstream.wait_for(mark, "openai_aborted")
+    assert aborted_at is not None, upstream.since(mark)
+    assert aborted_at - closed_at < 1.0
+    assert "openai_done" not in upstream.since(mark)
+
+
+def test_deadline_cancels_upstream(service, upstream):
+    mark = upstream.mark()
+    started = time.monotonic()
+    response = httpx.post(
+        f"{service}/api/v1/change/usage", json=USAGE, timeout=10.0,
+        headers={"X-Request-Deadline": str(time.time() + 1)},
+    )
+
+    assert response.status_code == 504
+    assert time.monotonic() - started < 3.0
+    assert upstream.wait_for(mark, "openai_aborted") is not None, upstream.since(mark)
+    assert "openai_done" not in upstream.since(mark)
+
+
+def test_deadline_cancels_catalog_lookup(service, upstream):
+    mark = upstream.mark()
+    response = httpx.post(
+        f"{service}/api/v1/change/description", json=DESCRIPTION, timeout=10.0,
+        headers={"X-Request-Deadline": str(time.time() + 1)},
+    )
+
+    assert response.status_code == 504
+    assert upstream.wait_for(mark, "django_aborted") is not None, upstream.since(mark)
+    assert "django_done" not in upstream.since(mark)
+
+
+def test_expired_deadline_skips_upstream(service, upstream):
+    mark = upstream.mark()
+    response = httpx.post(
+        f"{service}/api/v1/change/usage", json=USAGE, timeout=10.0,
+        headers={"X-Request-Deadline": str(time.time() - 1)},
+    )
+
+    assert response.status_code == 504
+    time.sleep(0.2)
+    assert "openai_start" not in upstream.since(mark)
+
+
+def test_assistants_api_sends_deadline(service, upstream):
+    from interface.assistants import AssistantsAPI
+
+    mark = upstream.mark()
+    # Дедлайн = таймаут клиента минус запас 2 с: сервис сдается раньше клиента и отменяет вызов OpenAI
+    api = AssistantsAPI(base_url=service, timeout=3.5)
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(api.change_usage("gpt-4.1", "текст"))
+
+    assert error.value.response.status_code == 504
+    assert upstream.wait_for(mark, "openai_aborted") is not None, upstream.since(mark)
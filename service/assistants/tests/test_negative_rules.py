@@ -0,0 +1,24 @@
+"""Правила negative_instruction: температура после времени сушки/полимеризации."""
+import pytest
+
+from src.negative_rules import RuleEngine
+
+
+@pytest.mark.parametrize("text", [
+    "Время полимеризации 24 часа при температуре 20 градусов",
+    "Время полимеризации 24 часа при температуре +20 град.",
+    "Время высыхания 2 часа при +20°C",
+    "Время высыхания 2 часа (при 20 °С).",
+    "Время высыхания 2 часа t +20",
+    "Время высыхания 2 часа (t=20°C)",
+])
+def test_stated_temperature_is_kept(text):
+    assert RuleEngine().apply(text) == (text, [])
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Время высыхания 2 часа.", "Время высыхания 2 часа (при t +20°C)."),
+    ("Межслойная сушка 4-6 ч, затем второй слой.", "Межслойная сушка 4-6 ч (при t +20°C), затем второй слой."),
+])
+def test_missing_temperature_is_added(text, expected):
+    assert RuleEngine().apply(text) == (expected, [])
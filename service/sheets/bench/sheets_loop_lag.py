@@ -0,0 +1,127 @@
+"""Задержка event loop сервиса листов: вызовы gspread прямо в loop против пула потоков SheetsBackend.
+
+Несколько одновременных заданий на поддельном клиенте gspread с задержками Google API,
+задержка loop измеряется тикером с периодом 10 мс. Запуск из корня репозитория:
+
+    python service/sheets/bench/sheets_loop_lag.py
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from gspread.worksheet import ValueRange
+
+JOBS = 6
+# Задержки Google API (секунды) и генерации строки
+LATENCY = {"open": 0.3, "get": 0.4, "update": 0.2, "llm": 0.2}
+TICK = 0.01
+
+
+def fake_credentials() -> str:
+    """Сервисный аккаунт с новым ключом: gspread только разбирает его, запросов к Google нет."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    )
+    return json.dumps({
+        "type": "service_account", "project_id": "bench", "private_key_id": "bench", "private_key": key.decode(),
+        "client_email": "bench@bench.iam.gserviceaccount.com", "client_id": "1",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    })
+
+
+os.environ.setdefault("DEBUG", "False")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("GOOGLE_SH_CREDS", fake_credentials())
+os.environ["SHEETS_JOBS_DB"] = str(Path(tempfile.mkdtemp()) / "sheet_jobs.sqlite3")
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+import service.sheets.src.utils as utils  # noqa: E402
+from service.sheets.src.models import ProcessGoogleSheetRequest  # noqa: E402
+from service.sheets.src.sheets_backend import SheetsBackend  # noqa: E402
+
+
+class FakeWorksheet:
+    row_count = 100
+    spreadsheet_id = "bench"
+
+    def batch_get(self, ranges):
+        time.sleep(LATENCY["get"])
+        return [ValueRange([["Товар", "Описание", "Результат"]]), ValueRange([[f"t{i}", "d", ""] for i in range(3)])]
+
+    def batch_update(self, data, value_input_option=None):
+        time.sleep(LATENCY["update"])
+
+
+class FakeSpreadsheet:
+    def get_worksheet(self, sheet_id):
+        time.sleep(LATENCY["open"] / 2)
+        return FakeWorksheet()
+
+
+class FakeClient:
+    def open_by_url(self, link):
+        time.sleep(LATENCY["open"] / 2)
+        return FakeSpreadsheet()
+
+
+class InlineBackend(SheetsBackend):
+    """Как было до SheetsBackend: вызов gspread прямо в event loop."""
+
+    async def _run(self, operation, fn):
+        return fn()
+
+
+async def generate(*args):
+    await asyncio.sleep(LATENCY["llm"])
+    return "<p>результат</p>"
+
+
+async def save(*args):
+    pass
+
+
+async def run(backend: SheetsBackend, label: str) -> None:
+    utils.sheets = backend
+    lags = []
+    stop = False
+
+    async def ticker():
+        while not stop:
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - started - TICK)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        utils.process_google_sheet(ProcessGoogleSheetRequest(
+            user_id=1, llm_model="bench", link=f"{label}-{job}", assistant="usage", sheet_id=0,
+        ))
+        for job in range(JOBS)
+    ))
+    total = time.perf_counter() - started
+    stop = True
+    await tick
+    lags.sort()
+    print(
+        f"{label:14} {JOBS} jobs in {total:.2f}s, loop lag p50 {statistics.median(lags) * 1000:.1f} ms, "
+        f"p99 {lags[int(len(lags) * 0.99)] * 1000:.0f} ms, max {lags[-1] * 1000:.0f} ms"
+    )
+
+
+def main():
+    utils.assistant_func["usage"] = generate
+    utils._save_process_data = save
+    asyncio.run(run(InlineBackend(FakeClient()), "inline gspread"))
+    asyncio.run(run(SheetsBackend(FakeClient(), workers=8), "SheetsBackend"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,36 @@
 
+from contextlib import asynccontextmanager
+
 import gspread
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-from service.sheets.src.models import ProcessGoogleSheetRequest, ProcessGoogleSheetsRequest, ProcessResponse
+from service.assistants.src.circuit_breaker import health
+from service.assistants.src.metrics import CONTENT_TYPE, REGISTRY, metrics_middleware
+from service.sheets.src.job_store import DONE
+from service.sheets.src.models import JobResponse, ProcessGoogleSheetRequest, ProcessGoogleSheetsRequest, ProcessResponse
 from service.sheets.src.settings import logger
-from service.sheets.src.utils import process_google_sheet, process_google_sheets
+from service.sheets.src.utils import agent, job_store, jobs, process_google_sheets, sheets
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await agent.startup()
+    # Незавершенные задания (в том числе прерванные перезапуском) возобновляются в фоне
+    await jobs.start()
+    try:
+        yield
+    finally:
+        await jobs.stop()
+        await agent.shutdown()
+        sheets.shutdown()
+
 
 app = FastAPI(
     title="Politaks sheets API",
     version="0.0.1",
+    lifespan=lifespan,
 )
 # app.add_middleware(
 #     CORSMiddleware,
@@ -20,19 +41,50 @@ app = FastAPI(
 # )
 
 
+app.middleware("http")(metrics_middleware)
+
+
+@app.get("/health")
+async def health_endpoint():
+    """Состояние предохранителей OpenAI и Django (503, если генерация невозможна)."""
+    result = health()
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE if result["status"] == "unavailable" else status.HTTP_200_OK
+    return JSONResponse(result, status_code=status_code)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def _job_detail(results: list[dict]) -> str:
+    """success, если все строки обработаны, иначе ошибка задания или число необработанных строк
+    (в том числе готовых, но не записанных в лист или не сохраненных в Django)."""
+    failed = [job for job in results if job["status"] != DONE]
+    if not failed:
+        return "success"
+    rows = sum(
+        job["rows"]["pending"] + job["rows"]["running"] + job["rows"]["failed"]
+        + max(job["rows"]["unwritten"], job["rows"]["unsaved"])
+        for job in failed
+    )
+    errors = "; ".join(job["error"] for job in failed if job["error"])
+    return f"failed: {errors or f'{rows} rows not processed'}"
+
+
 @app.post(rout1:="/process/google_sheet", response_model=ProcessResponse)
-async def process_google_sheet_endpoint(request: ProcessGoogleSheetRequest):
-    """Эндпоинт для обработки одного листа Google таблицы."""
+async def process_google_sheet_endpoint(request: ProcessGoogleSheetRequest, response: Response, background: bool = False):
+    """Эндпоинт для обработки одного листа Google таблицы.
+
+    С background=true только запускает задание (202), его состояние - GET /process/jobs/{job_id}.
+    """
     try:
-        await process_google_sheet(
-            request.user_id,
-            request.llm_model,
-            request.link,
-            request.assistant,
-            request.sheet_id,
-            request.from_row,
-            request.to_row,
-        )
+        job_id = await jobs.submit(request)
+        if background:
+            response.status_code = status.HTTP_202_ACCEPTED
+            return ProcessResponse(status_code=status.HTTP_202_ACCEPTED, detail="accepted", job_id=job_id)
+        job = await jobs.wait(job_id)
     except gspread.exceptions.WorksheetNotFound as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -63,14 +115,14 @@ async def process_google_sheet_endpoint(request: ProcessGoogleSheetRequest):
         logger.exception(f"Exception {rout1} - {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception {rout1} - {e}") from e
     else:
-        return ProcessResponse(status_code=status.HTTP_200_OK, detail="success")
+        return ProcessResponse(status_code=status.HTTP_200_OK, detail=_job_detail([job]), job_id=job_id)
 
 
 @app.post(rout2:="/process/google_sheets", response_model=ProcessResponse)
 async def process_google_sheets_endpoint(request: ProcessGoogleSheetsRequest):
     """Эндпоинт для обработки всей Google таблицы."""
     try:
-        await process_google_sheets(
+        result = await process_google_sheets(
             request.user_id,
             request.llm_model,
             request.link,
@@ -106,7 +158,16 @@ async def process_google_sheets_endpoint(request: ProcessGoogleSheetsRequest):
         logger.exception(f"Exception {rout2} - {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Exception {rout2} - {e}") from e
     else:
-        return ProcessResponse(status_code=status.HTTP_200_OK, detail="success")
+        return ProcessResponse(status_code=status.HTTP_200_OK, detail=_job_detail(result))
+
+
+@app.get("/process/jobs/{job_id}", response_model=JobResponse)
+async def job_endpoint(job_id: str):
+    """Состояние задания обработки листа и число его строк по статусам."""
+    job = await job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Задание {job_id} не найдено")
+    return JobResponse(**job)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+import asyncio
+from collections import deque
+
+from .settings import (
+    SHEETS_WINDOW_DECREASE,
+    SHEETS_WINDOW_INITIAL,
+    SHEETS_WINDOW_LATENCY_FACTOR,
+    SHEETS_WINDOW_MAX,
+    SHEETS_WINDOW_MIN,
+)
+
+# Вес новой задержки в сглаженной (EWMA)
+_LATENCY_ALPHA = 0.3
+# Лучшая задержка понемногу растет, чтобы одна случайно быстрая строка не держала окно минимальным
+_BASE_LATENCY_DRIFT = 1.002
+
+
+class AdaptiveWindow:
+    """Скользящее окно одновременных строк с размером по AIMD.
+
+    Новая строка запускается, как только завершилась любая из выполняющихся. За каждое окно
+    успешных строк размер растет на 1 (только если окно заполнено), при перегрузке уменьшается
+    в decrease раз, но не ниже min_size. Перегрузка - 429 OpenAI или Google во время строки или
+    сглаженная задержка строк выше лучшей в latency_factor раз. Сигналы строк, запущенных до
+    последнего уменьшения, не учитываются: они отражают прежний размер окна.
+    """
+
+    def __init__(self,
+        min_size: int = SHEETS_WINDOW_MIN, max_size: int = SHEETS_WINDOW_MAX, initial: int = SHEETS_WINDOW_INITIAL,
+        decrease: float = SHEETS_WINDOW_DECREASE, latency_factor: float = SHEETS_WINDOW_LATENCY_FACTOR,
+    ):
+        self.min_size = max(min_size, 1)
+        self.max_size = max(max_size, self.min_size)
+        self.size = float(min(max(initial, self.min_size), self.max_size))
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.inflight = 0
+        self.peak = int(self.size)
+        self.increased = 0
+        self.decreased = 0
+        self.latency: float | None = None
+        self.base_latency: float | None = None
+        self._epoch = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+
+    async def acquire(self) -> int:
+        """Ожидание места в окне. Возвращает номер эпохи (передается в release)."""
+        while self.inflight >= int(self.size):
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if not future.done():
+                    self._waiters.remove(future)
+                else:
+                    self._wake()
+                raise
+        self.inflight += 1
+        return self._epoch
+
+
+    def release(self, epoch: int, latency: float | None, congested: bool) -> None:
+        """Завершение строки: latency - ее длительность (None - строка с ошибкой), congested - был ли сигнал превышения квот."""
+        full = self.inflight >= int(self.size)
+        self.inflight -= 1
+        if not congested and latency is not None:
+            self.latency = latency if self.latency is None else _LATENCY_ALPHA * latency + (1 - _LATENCY_ALPHA) * self.latency
+            self.base_latency = self.latency if self.base_latency is None else min(self.latency, self.base_latency * _BASE_LATENCY_DRIFT)
+            congested = self.latency > self.base_latency * self.latency_factor
+
+        if congested and epoch == self._epoch:
+            self.size = max(self.size * self.decrease, self.min_size)
+            self._epoch += 1
+            self.decreased += 1
+            # Задержка после уменьшения окна оценивается заново
+            self.latency = None
+        elif not congested and full and self.size < self.max_size:
+            self.size = min(self.size + 1 / self.size, self.max_size)
+            self.increased += 1
+            self.peak = max(self.peak, int(self.size))
+        self._wake()
+
+
+    def stats(self) -> dict:
+        return {
+            "size": round(self.size, 2),
+            "peak": self.peak,
+            "inflight": self.inflight,
+            "increased": self.increased,
+            "decreased": self.decreased,
+            "latency": round(self.latency or 0, 3),
+            "base_latency": round(self.base_latency or 0, 3),
+        }
+
+
+    def _wake(self) -> None:
+        free = int(self.size) - self.inflight
+        while free > 0 and self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                free -= 1
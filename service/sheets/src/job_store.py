@@ -0,0 +1,381 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from functools import partial
+from pathlib import Path
+
+from .models import ProcessGoogleSheetRequest
+from .settings import SHEETS_JOB_LEASE, SHEETS_JOB_MAX_ATTEMPTS, SHEETS_JOBS_DB, logger
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+_UNFINISHED = (PENDING, RUNNING)
+
+
+def spec_key(spec: ProcessGoogleSheetRequest) -> str:
+    """Ключ задания: одинаковые незавершенные задания не создаются повторно."""
+    return hashlib.sha256(spec.model_dump_json().encode("utf-8")).hexdigest()
+
+
+class JobStore:
+    """Задания обработки листов и статусы их строк в SQLite.
+
+    Строка задания хранит запись листа, статус (pending, running, done, failed), число попыток и
+    результат LLM. Результат сохраняется сразу после генерации, а запись в лист и в Django
+    отмечаются отдельно, поэтому возобновленное задание не генерирует готовые строки повторно,
+    а только дописывает то, что не успело записаться. Незавершенные строки завершенного задания
+    (ошибка генерации, записи в лист или в Django) переходят в следующее задание того же листа
+    с теми же параметрами. Задание выполняет процесс, который его захватил (owner) и продлевает
+    аренду (heartbeat).
+    """
+
+    def __init__(self, db_path: Path = SHEETS_JOBS_DB, max_attempts: int = SHEETS_JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+
+    async def create(self, spec: ProcessGoogleSheetRequest) -> tuple[str, bool]:
+        """ID задания и признак, что оно создано (False - такое же задание еще выполняется)."""
+        return await self._run(self._db_create, spec)
+
+
+    async def get(self, job_id: str) -> dict | None:
+        return await self._run(self._db_get, job_id)
+
+
+    async def claim(self, job_id: str, owner: str, lease: float) -> bool:
+        """Захват незавершенного задания, если оно свободно или аренда прежнего владельца истекла."""
+        return await self._run(self._db_claim, job_id, owner, lease)
+
+
+    async def renew(self, owner: str) -> None:
+        await self._run(self._execute, "UPDATE jobs SET heartbeat = ? WHERE owner = ?", (time.time(), owner))
+
+
+    async def release(self, owner: str) -> None:
+        """Освобождение незавершенных заданий владельца (при остановке процесса)."""
+        await self._run(self._execute, "UPDATE jobs SET owner = NULL WHERE owner = ?", (owner,))
+
+
+    async def orphaned(self, lease: float) -> list[str]:
+        """Незавершенные задания без владельца или с истекшей арендой."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT id FROM jobs WHERE status IN (?, ?) AND (owner IS NULL OR heartbeat < ?) ORDER BY created_at",
+            (*_UNFINISHED, time.time() - lease),
+        )
+        return [row[0] for row in rows]
+
+
+    async def add_rows(self, job_id: str, result_col: int, rows: list[tuple[int, dict]]) -> None:
+        await self._run(self._db_add_rows, job_id, result_col, rows)
+
+
+    async def rows_to_process(self, job_id: str) -> list[dict]:
+        """Строки, которые еще нужно сгенерировать, записать в лист или сохранить в Django."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT row, record, result, written, saved FROM job_rows WHERE job_id = ? "
+            "AND ((status != ? AND attempts < ?) OR (status = ? AND (written = 0 OR saved = 0))) ORDER BY row",
+            (job_id, DONE, self.max_attempts, DONE),
+        )
+        return [
+            {"row": row, "record": json.loads(record), "result": result, "written": bool(written), "saved": bool(saved)}
+            for row, record, result, written, saved in rows
+        ]
+
+
+    async def start_row(self, job_id: str, row: int) -> None:
+        await self._update_row(job_id, row, "status = ?, attempts = attempts + 1", (RUNNING,))
+
+
+    async def finish_row(self, job_id: str, row: int, result: str) -> None:
+        await self._update_row(job_id, row, "status = ?, result = ?, error = NULL", (DONE, result))
+
+
+    async def fail_row(self, job_id: str, row: int, error: str) -> None:
+        await self._update_row(job_id, row, "status = ?, error = ?", (FAILED, error[:1000]))
+
+
+    async def mark_saved(self, job_id: str, row: int) -> None:
+        await self._update_row(job_id, row, "saved = 1", ())
+
+
+    async def mark_written(self, job_id: str, rows: list[int]) -> None:
+        await self._run(
+            self._executemany, "UPDATE job_rows SET written = 1 WHERE job_id = ? AND row = ?",
+            [(job_id, row) for row in rows],
+        )
+
+
+    async def finish(self, job_id: str, error: str | None = None) -> str:
+        """Завершение задания: failed, если задана ошибка или остались незавершенные строки, иначе done."""
+        return await self._run(self._db_finish, job_id, error)
+
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._locked, fn, *args)
+
+
+    def _locked(self, fn, *args):
+        with self._db_lock:
+            return fn(self._connect(), *args)
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            # Хранилище общее для воркеров uvicorn, запись ждет освобождения блокировки другого процесса
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, spec_key TEXT NOT NULL, spec TEXT NOT NULL, status TEXT NOT NULL, "
+                "result_col INTEGER, error TEXT, owner TEXT, heartbeat REAL, created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, spec_key);"
+                "CREATE TABLE IF NOT EXISTS job_rows ("
+                "job_id TEXT NOT NULL, row INTEGER NOT NULL, record TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, "
+                "written INTEGER NOT NULL DEFAULT 0, saved INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (job_id, row));",
+            )
+        return self._db
+
+
+    @staticmethod
+    def _fetch(db: sqlite3.Connection, sql: str, params: tuple) -> list[tuple]:
+        return db.execute(sql, params).fetchall()
+
+
+    @staticmethod
+    def _execute(db: sqlite3.Connection, sql: str, params: tuple) -> None:
+        db.execute(sql, params)
+        db.commit()
+
+
+    @staticmethod
+    def _executemany(db: sqlite3.Connection, sql: str, params: list[tuple]) -> None:
+        db.executemany(sql, params)
+        db.commit()
+
+
+    async def _update_row(self, job_id: str, row: int, assignments: str, params: tuple) -> None:
+        await self._run(
+            self._execute, f"UPDATE job_rows SET {assignments}, updated_at = ? WHERE job_id = ? AND row = ?",
+            (*params, time.time(), job_id, row),
+        )
+
+
+    def _db_create(self, db: sqlite3.Connection, spec: ProcessGoogleSheetRequest) -> tuple[str, bool]:
+        key = spec_key(spec)
+        with db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE spec_key = ? AND status IN (?, ?)", (key, *_UNFINISHED),
+            ).fetchone()
+            if row is not None:
+                return row[0], False
+            previous = db.execute(
+                "SELECT id FROM jobs WHERE spec_key = ? ORDER BY created_at DESC LIMIT 1", (key,),
+            ).fetchone()
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            db.execute(
+                "INSERT INTO jobs (id, spec_key, spec, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, key, spec.model_dump_json(), PENDING, now, now),
+            )
+            if previous is not None:
+                # Готовые результаты прошлого задания не генерируются повторно: строки без записи в лист
+                # или в Django переходят в новое задание (лист перечитывается, но эти строки не заменяются)
+                cursor = db.execute(
+                    "INSERT INTO job_rows (job_id, row, record, status, attempts, result, written, saved, updated_at) "
+                    "SELECT ?, row, record, CASE WHEN result IS NULL THEN ? ELSE ? END, 0, result, written, saved, ? "
+                    "FROM job_rows WHERE job_id = ? AND (status != ? OR written = 0 OR saved = 0)",
+                    (job_id, PENDING, DONE, now, previous[0], DONE),
+                )
+                if cursor.rowcount:
+                    logger.info(f"JobStore - job {job_id} took over {cursor.rowcount} unfinished rows of job {previous[0]}")
+            return job_id, True
+
+
+    def _db_get(self, db: sqlite3.Connection, job_id: str) -> dict | None:
+        row = db.execute(
+            "SELECT spec, status, result_col, error, owner, created_at, updated_at FROM jobs WHERE id = ?", (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        spec, status, result_col, error, owner, created_at, updated_at = row
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        counts.update(db.execute("SELECT status, COUNT(*) FROM job_rows WHERE job_id = ? GROUP BY status", (job_id,)).fetchall())
+        # Готовые строки, которые еще не записаны в лист или не сохранены в Django
+        counts["unwritten"], counts["unsaved"] = db.execute(
+            "SELECT COALESCE(SUM(written = 0), 0), COALESCE(SUM(saved = 0), 0) FROM job_rows WHERE job_id = ? AND status = ?",
+            (job_id, DONE),
+        ).fetchone()
+        return {
+            "job_id": job_id,
+            "spec": ProcessGoogleSheetRequest.model_validate_json(spec),
+            "status": status,
+            "result_col": result_col,
+            "error": error,
+            "owner": owner,
+            "rows": counts,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+
+    def _db_claim(self, db: sqlite3.Connection, job_id: str, owner: str, lease: float) -> bool:
+        now = time.time()
+        with db:
+            cursor = db.execute(
+                "UPDATE jobs SET owner = ?, heartbeat = ?, status = ?, updated_at = ? "
+                "WHERE id = ? AND status IN (?, ?) AND (owner IS NULL OR owner = ? OR heartbeat < ?)",
+                (owner, now, RUNNING, now, job_id, *_UNFINISHED, owner, now - lease),
+            )
+            return cursor.rowcount == 1
+
+
+    def _db_add_rows(self, db: sqlite3.Connection, job_id: str, result_col: int, rows: list[tuple[int, dict]]) -> None:
+        now = time.time()
+        with db:
+            db.executemany(
+                "INSERT OR IGNORE INTO job_rows (job_id, row, record, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, row, json.dumps(record, ensure_ascii=False), PENDING, now) for row, record in rows],
+            )
+            db.execute("UPDATE jobs SET result_col = ?, updated_at = ? WHERE id = ?", (result_col, now, job_id))
+
+
+    def _db_finish(self, db: sqlite3.Connection, job_id: str, error: str | None) -> str:
+        failed = db.execute(
+            "SELECT COUNT(*) FROM job_rows WHERE job_id = ? AND (status != ? OR written = 0 OR saved = 0)", (job_id, DONE),
+        ).fetchone()[0]
+        status = FAILED if error or failed else DONE
+        with db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, owner = NULL, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+        return status
+
+
+class JobRunner:
+    """Выполнение заданий из JobStore в текущем процессе.
+
+    Задание выполняется в фоновой задаче и не зависит от HTTP запроса, который его создал.
+    Раз в треть аренды процесс продлевает аренду своих заданий и захватывает брошенные (в том числе
+    незавершенные на момент остановки сервиса), поэтому задания возобновляются при старте и после
+    падения другого воркера. При остановке задачи отменяются, а задания освобождаются.
+    """
+
+    def __init__(self, store: JobStore, run: Callable[[str, ProcessGoogleSheetRequest], Awaitable[None]],
+        lease: float = SHEETS_JOB_LEASE,
+    ):
+        self.store = store
+        self.run = run
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.resumed = 0
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._watchdog: asyncio.Task | None = None
+
+
+    async def start(self) -> None:
+        if self._watchdog is None:
+            self._watchdog = asyncio.create_task(self._watch())
+
+
+    async def stop(self) -> None:
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            await asyncio.gather(self._watchdog, return_exceptions=True)
+            self._watchdog = None
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        await self.store.release(self.owner)
+        self.store.close()
+
+
+    async def submit(self, spec: ProcessGoogleSheetRequest) -> str:
+        """Создание задания (или возврат такого же незавершенного) и запуск, если его никто не выполняет."""
+        job_id, _ = await self.store.create(spec)
+        await self._start(job_id, spec)
+        return job_id
+
+
+    async def wait(self, job_id: str, poll_interval: float = 2.0) -> dict:
+        """Ожидание завершения задания. Исключения задания этого процесса передаются вызывающему.
+
+        Отмена ожидания (например, клиент отключился) задание не отменяет.
+        """
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+        # Задание выполняет другой процесс
+        while (job := await self.store.get(job_id)) is not None and job["status"] in _UNFINISHED:
+            await asyncio.sleep(poll_interval)
+        return job
+
+
+    def stats(self) -> dict:
+        return {"owner": self.owner, "running": len(self._tasks), "resumed": self.resumed}
+
+
+    async def _start(self, job_id: str, spec: ProcessGoogleSheetRequest) -> bool:
+        if job_id in self._tasks or not await self.store.claim(job_id, self.owner, self.lease):
+            return False
+        task = self._tasks[job_id] = asyncio.create_task(self._execute(job_id, spec))
+        task.add_done_callback(partial(self._forget, job_id))
+        return True
+
+
+    def _forget(self, job_id: str, task: asyncio.Task) -> None:
+        self._tasks.pop(job_id, None)
+        # Ошибка задания уже записана в хранилище, даже если его никто не ждет
+        if not task.cancelled():
+            task.exception()
+
+
+    async def _execute(self, job_id: str, spec: ProcessGoogleSheetRequest) -> None:
+        try:
+            await self.run(job_id, spec)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status = await self.store.finish(job_id, f"{type(e).__name__}: {e}")
+            logger.error(f"JobRunner - job {job_id} {status}: {e}")
+            raise
+        else:
+            status = await self.store.finish(job_id)
+            logger.info(f"JobRunner - job {job_id} {status}")
+
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                await self.store.renew(self.owner)
+                for job_id in await self.store.orphaned(self.lease):
+                    job = await self.store.get(job_id)
+                    if job is not None and await self._start(job_id, job["spec"]):
+                        self.resumed += 1
+                        logger.info(f"JobRunner - resumed job {job_id} ({job['rows']})")
+            except Exception as e:
+                logger.error(f"JobRunner - watchdog error: {e}")
+            await asyncio.sleep(self.lease / 3)
@@ -0,0 +1,21 @@
+from service.assistants.src.metrics import REGISTRY, Counter, Gauge, Histogram
+
+# Метрики обработки листов регистрируются в общем реестре только в процессе сервиса sheets
+SHEET_ROWS = REGISTRY.register(Counter(
+    "sheet_rows_total", "Обработанные строки Google таблиц", ("assistant", "status"),
+))
+SHEET_ROW_DURATION = REGISTRY.register(Histogram(
+    "sheet_row_duration_seconds", "Длительность обработки строки Google таблицы", ("assistant",),
+))
+SHEET_ROWS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "sheet_rows_in_flight", "Строки Google таблиц в обработке", ("assistant",),
+))
+SHEET_WRITE_REQUESTS = REGISTRY.register(Counter(
+    "sheet_write_requests_total", "Запросы записи результатов в Google таблицы (ok, retry, error)", ("status",),
+))
+SHEET_CELLS_WRITTEN = REGISTRY.register(Counter(
+    "sheet_cells_written_total", "Ячейки, записанные в Google таблицы",
+))
+SHEETS_API_DURATION = REGISTRY.register(Histogram(
+    "sheets_api_duration_seconds", "Длительность вызовов Google Sheets API вместе с ожиданием потока", ("operation",),
+))
@@ -20,3 +20,14 @@ class ProcessGoogleSheetRequest(BaseModel):
 class ProcessResponse(BaseModel):
     status_code: int
     detail: str
+    job_id: str | None = None
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    error: str | None = None
+    # Число строк по статусам (pending, running, done, failed), из готовых - не записанных в лист (unwritten)
+    # и не сохраненных в Django (unsaved)
+    rows: dict[str, int]
+    created_at: float
+    updated_at: float
@@ -41,4 +41,34 @@ if get_env:
     except json.JSONDecodeError:
         logger.exception("Invalid GOOGLE_SH_CREDS format.")
     except Exception as e:
-        logger.exception(f"Error initializing GOOGLE_SH_CREDS: {e}")
\ No newline at end of file
+        logger.exception(f"Error initializing GOOGLE_SH_CREDS: {e}")
+# Запись результатов в лист: ячейки копятся и записываются одним batch_update,
+# когда набралось SHEETS_WRITE_BATCH_CELLS ячеек или прошло SHEETS_WRITE_INTERVAL секунд с первой из них
+SHEETS_WRITE_BATCH_CELLS = int(os.getenv("SHEETS_WRITE_BATCH_CELLS", "50"))
+SHEETS_WRITE_INTERVAL = float(os.getenv("SHEETS_WRITE_INTERVAL", "5"))
+# Повторы записи при 429 и 5xx с экспоненциальной паузой (не больше SHEETS_WRITE_MAX_BACKOFF секунд)
+SHEETS_WRITE_MAX_RETRIES = int(os.getenv("SHEETS_WRITE_MAX_RETRIES", "6"))
+SHEETS_WRITE_MAX_BACKOFF = float(os.getenv("SHEETS_WRITE_MAX_BACKOFF", "64"))
+
+# Потоки для синхронных вызовов gspread (запросы к Google Sheets не блокируют event loop)
+SHEETS_WORKERS = int(os.getenv("SHEETS_WORKERS", "8"))
+
+# Окно одновременно обрабатываемых строк листа (AIMD): растет на 1 за окно успешных строк
+# и уменьшается в SHEETS_WINDOW_DECREASE раз при 429 OpenAI/Google или росте задержки строк
+SHEETS_WINDOW_MIN = int(os.getenv("SHEETS_WINDOW_MIN", "1"))
+SHEETS_WINDOW_MAX = int(os.getenv("SHEETS_WINDOW_MAX", "12"))
+SHEETS_WINDOW_INITIAL = int(os.getenv("SHEETS_WINDOW_INITIAL", "3"))
+SHEETS_WINDOW_DECREASE = float(os.getenv("SHEETS_WINDOW_DECREASE", "0.5"))
+# Задержка строки (сглаженная) во столько раз выше лучшей - признак перегрузки
+SHEETS_WINDOW_LATENCY_FACTOR = float(os.getenv("SHEETS_WINDOW_LATENCY_FACTOR", "2.5"))
+
+# Задания обработки листов (SQLite): спецификация и статусы строк переживают перезапуск сервиса,
+# незавершенные задания возобновляются при старте
+SHEETS_JOBS_DB = Path(os.getenv("SHEETS_JOBS_DB", SERVICE_DIR / "data/jobs/sheet_jobs.sqlite3"))
+os.makedirs(SHEETS_JOBS_DB.parent, exist_ok=True)
+# Сколько раз задание проходит по строкам с ошибкой генерации, записи в лист или в Django
+SHEETS_JOB_MAX_ATTEMPTS = int(os.getenv("SHEETS_JOB_MAX_ATTEMPTS", "3"))
+# Пауза перед повтором строк с ошибками, секунды (удваивается с каждым кругом)
+SHEETS_JOB_RETRY_DELAY = float(os.getenv("SHEETS_JOB_RETRY_DELAY", "5"))
+# Задание процесса, который не продлевал аренду дольше, возобновляет другой процесс, секунды
+SHEETS_JOB_LEASE = float(os.getenv("SHEETS_JOB_LEASE", "60"))
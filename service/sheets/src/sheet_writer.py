@@ -0,0 +1,134 @@
+import asyncio
+import random
+from collections.abc import Awaitable, Callable
+
+import gspread
+from gspread.utils import rowcol_to_a1
+
+from .metrics import SHEET_CELLS_WRITTEN, SHEET_WRITE_REQUESTS
+from .settings import (
+    SHEETS_WRITE_BATCH_CELLS,
+    SHEETS_WRITE_INTERVAL,
+    SHEETS_WRITE_MAX_BACKOFF,
+    SHEETS_WRITE_MAX_RETRIES,
+    logger,
+)
+from .sheets_backend import SheetsBackend
+
+
+def is_retryable(e: gspread.exceptions.APIError) -> bool:
+    """Превышена квота (429) или временная ошибка Google (5xx)."""
+    status_code = e.response.status_code
+    return status_code == 429 or status_code >= 500
+
+
+def backoff_delay(e: gspread.exceptions.APIError, attempt: int, max_backoff: float = SHEETS_WRITE_MAX_BACKOFF) -> float:
+    """Пауза перед повтором: Retry-After, иначе 2^attempt секунд со случайной добавкой (как рекомендует Google)."""
+    retry_after = e.response.headers.get("retry-after")
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), max_backoff)
+    return min(2 ** attempt + random.random(), max_backoff)
+
+
+class SheetWriter:
+    """Буфер записи результатов в лист Google таблицы.
+
+    Ячейки копятся и записываются одним batch_update, когда набралось max_cells ячеек или прошло
+    interval секунд с первой из них. При 429 и 5xx запись повторяется с экспоненциальной паузой,
+    новые ячейки тем временем копятся в буфере. close() (выход из async with) записывает остаток,
+    в том числе при отмене задания. on_written получает номера строк каждой успешной записи.
+    """
+
+    def __init__(self, backend: SheetsBackend, worksheet: gspread.Worksheet, max_cells: int = SHEETS_WRITE_BATCH_CELLS,
+        interval: float = SHEETS_WRITE_INTERVAL, max_retries: int = SHEETS_WRITE_MAX_RETRIES,
+        on_written: Callable[[list[int]], Awaitable[None]] | None = None,
+    ):
+        self.backend = backend
+        self.worksheet = worksheet
+        self.on_written = on_written
+        self.max_cells = max_cells
+        self.interval = interval
+        self.max_retries = max_retries
+        self.written = 0
+        self.failed = 0
+        # Ответы 429 (сигнал для окна строк, см. AdaptiveWindow)
+        self.throttled = 0
+        self._cells: dict[tuple[int, int], str] = {}
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.Task | None = None
+
+
+    async def __aenter__(self) -> "SheetWriter":
+        return self
+
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+    async def write(self, row: int, col: int, value) -> None:
+        """Добавление ячейки в буфер (повторная запись той же ячейки заменяет значение)."""
+        self._cells[(row, col)] = value
+        if len(self._cells) >= self.max_cells:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+
+    async def flush(self) -> None:
+        """Запись накопленных ячеек одним запросом."""
+        async with self._lock:
+            if self._timer is not None and self._timer is not asyncio.current_task():
+                self._timer.cancel()
+            self._timer = None
+            if not self._cells:
+                return
+            cells, self._cells = self._cells, {}
+            await self._write(cells)
+
+
+    async def close(self) -> None:
+        # Остаток записывается, даже если задание отменено во время записи
+        await asyncio.shield(self.flush())
+
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+
+    async def _write(self, cells: dict[tuple[int, int], str]) -> None:
+        data = [{"range": rowcol_to_a1(row, col), "values": [[value]]} for (row, col), value in sorted(cells.items())]
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.backend.batch_update(self.worksheet, data)
+            except gspread.exceptions.APIError as e:
+                if attempt < self.max_retries and is_retryable(e):
+                    delay = backoff_delay(e, attempt)
+                    if e.response.status_code == 429:
+                        self.throttled += 1
+                    SHEET_WRITE_REQUESTS.inc(status="retry")
+                    logger.warning(f"SheetWriter - {e.response.status_code} for {len(cells)} cells, retry in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                self._on_error(cells, e)
+                return
+            except Exception as e:
+                self._on_error(cells, e)
+                return
+            else:
+                self.written += len(cells)
+                SHEET_WRITE_REQUESTS.inc(status="ok")
+                SHEET_CELLS_WRITTEN.inc(len(cells))
+                if self.on_written is not None:
+                    await self.on_written(sorted({row for row, _ in cells}))
+                return
+
+
+    def _on_error(self, cells: dict[tuple[int, int], str], e: Exception) -> None:
+        # Строки остаются неотмеченными в хранилище заданий (JobStore): задание повторит запись
+        # в следующем круге, а после исчерпания попыток - следующее задание того же листа
+        self.failed += len(cells)
+        SHEET_WRITE_REQUESTS.inc(status="error")
+        rows = sorted({row for row, _ in cells})
+        logger.error(f"SheetWriter - failed to write {len(cells)} cells (rows {rows[0]}..{rows[-1]}): {e}")
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any
+
+import gspread
+from gspread.utils import ValueInputOption
+
+from .metrics import SHEETS_API_DURATION
+from .settings import SHEETS_WORKERS
+
+
+class SheetsBackend:
+    """Доступ к Google Sheets без блокировки event loop.
+
+    gspread синхронный, поэтому каждый вызов выполняется в отдельном пуле из workers потоков.
+    Размер пула ограничивает число одновременных запросов к Google, остальные ждут свободный поток,
+    не задерживая вызовы OpenAI и другие задания. Исключения gspread передаются вызывающему как есть.
+    """
+
+    def __init__(self, client: gspread.Client, workers: int = SHEETS_WORKERS):
+        self.client = client
+        self.workers = workers
+        self._executor: ThreadPoolExecutor | None = None
+
+
+    async def open_worksheet(self, link: str, sheet_id: int) -> gspread.Worksheet:
+        return await self._run("open_worksheet", lambda: self.client.open_by_url(link).get_worksheet(sheet_id))
+
+
+    async def batch_get(self, worksheet: gspread.Worksheet, ranges: list[str]) -> list[list[list]]:
+        return await self._run("batch_get", partial(worksheet.batch_get, ranges))
+
+
+    async def batch_update(self, worksheet: gspread.Worksheet, data: list[dict]) -> None:
+        await self._run(
+            "batch_update", partial(worksheet.batch_update, data, value_input_option=ValueInputOption.user_entered),
+        )
+
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+    async def _run(self, operation: str, fn: Callable[[], Any]) -> Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sheets")
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn)
+        finally:
+            SHEETS_API_DURATION.observe(time.perf_counter() - started, operation=operation)
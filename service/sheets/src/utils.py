@@ -1,15 +1,28 @@
 
 import asyncio
 import json
+import time
+from functools import partial
 
 import aiohttp
 import gspread
+import openai
+from gspread.utils import numericise_all, rightpad
 
+from service.assistants.src.circuit_breaker import CircuitOpen
 from service.assistants.src.llm_utils import OpenAIAgent
+from service.assistants.src.scheduler import BULK, Job, current_job
 
-from .settings import DJANGO_API_URL, GOOGLE_SH_CREDS, logger
+from .adaptive_window import AdaptiveWindow
+from .job_store import JobRunner, JobStore
+from .metrics import SHEET_ROW_DURATION, SHEET_ROWS, SHEET_ROWS_IN_FLIGHT
+from .models import ProcessGoogleSheetRequest
+from .settings import DJANGO_API_URL, GOOGLE_SH_CREDS, SHEETS_JOB_RETRY_DELAY, logger
+from .sheet_writer import SheetWriter
+from .sheets_backend import SheetsBackend
 
 gc = gspread.service_account_from_dict(GOOGLE_SH_CREDS)
+sheets = SheetsBackend(gc)
 agent = OpenAIAgent()
 assistant_func = {
     "sub_description": agent.get_sub_description,
@@ -26,6 +39,19 @@ assistant_func = {
 }
 
 
+def throttle_events(writer: SheetWriter) -> int:
+    """Счетчик сигналов превышения квот: 429 OpenAI (возвраты в очередь лимитера и переносы на другой ключ)
+    и 429 Google при записи в лист. Счетчики OpenAI общие для процесса - окна всех заданий делят одну квоту.
+    """
+    return agent.rate_limiter.requeued + agent.llm_router.failovers + writer.throttled
+
+
+def is_throttle_error(e: Exception) -> bool:
+    return isinstance(e, (openai.RateLimitError, CircuitOpen)) or (
+        isinstance(e, gspread.exceptions.APIError) and e.response.status_code == 429
+    )
+
+
 async def _save_process_data(record: dict, user_id: str, llm_model: str, assistant: str, result: str, idx: int):
     record.popitem()
     parameters = [
@@ -47,58 +73,145 @@ async def _save_process_data(record: dict, user_id: str, llm_model: str, assista
         if resp.status not in {200, 201}:
             error_text = await resp.text()
             logger.error(f"_save_process_data() - Failed for '{assistant}' row={idx}: {resp.status} - {error_text}")
-
-
-async def process_google_sheet(user_id: str, llm_model: str, link: str, assistant: str, sheet_id: int, from_row: int, to_row: int):
-    from_row = max(from_row-2, 1)
-    spreadsheet = gc.open_by_url(link)
-    worksheet = spreadsheet.get_worksheet(sheet_id)
-
-    wsh_records: list[dict] = worksheet.get_all_records()
-    wsh_records = wsh_records[from_row:to_row-1] if to_row != -1 else wsh_records[from_row:]
-    headers = worksheet.row_values(1)
-    result_col_index = headers.index("Результат") + 1
-    result_col_data = worksheet.col_values(result_col_index)
-
-    async def handle_row(idx: int, record: dict):
+            # Строка остается несохраненной в хранилище заданий и сохраняется повторно
+            resp.raise_for_status()
+
+
+async def read_pending_rows(worksheet: gspread.Worksheet, from_row: int, to_row: int) -> tuple[int, list[tuple[int, dict]]]:
+    """Номер столбца "Результат" и строки from_row..to_row (to_row=-1 - до конца листа), в которых еще нет результата.
+
+    Заголовок и диапазон строк читаются одним запросом. Результат проверяется по его столбцу,
+    в записи (заголовок -> значение, как в get_all_records) превращаются только строки без результата.
+    Строки 1 (заголовок) и 2 не обрабатываются.
+    """
+    first_row = max(from_row, 3)
+    last_row = worksheet.row_count if to_row == -1 else to_row
+    ranges = ["1:1", f"{first_row}:{last_row}"] if last_row >= first_row else ["1:1"]
+    header_range, *rows_range = await sheets.batch_get(worksheet, ranges)
+    headers = header_range[0] if header_range else []
+    duplicates = sorted({header for header in headers if headers.count(header) > 1})
+    if duplicates:
+        raise gspread.exceptions.GSpreadException(f"the header row in the worksheet contains duplicates: {duplicates}")
+    result_index = headers.index("Результат")
+
+    pending = []
+    for idx, row in enumerate(rows_range[0] if rows_range else [], first_row):
+        result = row[result_index] if result_index < len(row) else ""
+        if len(str(result)) < 6:
+            row = rightpad(row, len(headers))
+            pending.append((idx, dict(zip(headers, numericise_all(row)))))
+    return result_index + 1, pending
+
+
+async def run_sheet_job(job_id: str, spec: ProcessGoogleSheetRequest):
+    """Выполнение (или возобновление) задания обработки листа.
+
+    При первом запуске строки без результата читаются из листа и сохраняются в хранилище, при
+    возобновлении берутся из него. Строка, результат которой уже сгенерирован, в OpenAI повторно
+    не отправляется: она только дописывается в лист и сохраняется в Django, если не успела.
+    Строки с ошибкой генерации, записи или сохранения повторяются следующим кругом после паузы,
+    всего не больше SHEETS_JOB_MAX_ATTEMPTS кругов.
+    """
+    user_id, llm_model, assistant = str(spec.user_id), spec.llm_model, spec.assistant
+    worksheet = await sheets.open_worksheet(spec.link, spec.sheet_id)
+    stored = await job_store.get(job_id)
+    result_col_index = stored["result_col"]
+    if result_col_index is None:
+        result_col_index, pending = await read_pending_rows(worksheet, spec.from_row, spec.to_row)
+        await job_store.add_rows(job_id, result_col_index, pending)
+    # Лист таблицы - фоновое задание пользователя: интерактивные генерации получают слоты OpenAI раньше
+    job = Job(priority=BULK, user=user_id, name=f"{worksheet.spreadsheet_id}:{spec.sheet_id}")
+    # Результаты строк записываются в лист пачками (см. SheetWriter), записанные отмечаются в хранилище
+    writer = SheetWriter(sheets, worksheet, on_written=partial(job_store.mark_written, job_id))
+    # Число одновременных строк подстраивается под квоты OpenAI и Google (см. AdaptiveWindow)
+    window = AdaptiveWindow()
+
+    async def handle_row(row: dict, epoch: int):
+        idx, record, result = row["row"], row["record"], row["result"]
+        started = time.perf_counter()
+        throttled_before = throttle_events(writer)
+        latency = None
+        congested = False
+        # Каждая строка выполняется в своей задаче, контекст задания не выходит за ее пределы
+        current_job.set(job)
+        SHEET_ROWS_IN_FLIGHT.inc(assistant=assistant)
         try:
-            args = list(record.values())[:-1]
-            result = await assistant_func[assistant](llm_model, *args)
-            worksheet.update_cell(idx, result_col_index, result)
-            await _save_process_data(record, user_id, llm_model, assistant, result, idx)
+            if result is None:
+                await job_store.start_row(job_id, idx)
+                args = list(record.values())[:-1]
+                try:
+                    result = await assistant_func[assistant](llm_model, *args)
+                except Exception as e:
+                    await job_store.fail_row(job_id, idx, f"{type(e).__name__}: {e}")
+                    raise
+                await job_store.finish_row(job_id, idx, result)
+                latency = time.perf_counter() - started
+            if not row["written"]:
+                await writer.write(idx, result_col_index, result)
+            if not row["saved"]:
+                await _save_process_data(record, user_id, llm_model, assistant, result, idx)
+                await job_store.mark_saved(job_id, idx)
         except Exception as e:
+            congested = is_throttle_error(e)
+            SHEET_ROWS.inc(assistant=assistant, status="error")
             logger.error(f"Error process_google_sheet().handle_row() - {assistant} - row {idx} - {e}")
-
-    tasks_data = [
-        (i, record) for i, record in enumerate(wsh_records, from_row+2)
-        if (i-1)>=len(result_col_data) or len(str(result_col_data[i-1])) < 6
-    ]
-
-    batch_size = 3
-    for i in range(0, len(tasks_data), batch_size):
-        batch = tasks_data[i:i + batch_size]
-        current_tasks = [
-            asyncio.create_task(handle_row(idx, rec))
-            for idx, rec in batch
-        ]
-        await asyncio.gather(*current_tasks)
-        if i + batch_size < len(tasks_data):
-            await asyncio.sleep(10)
-
-
-async def process_google_sheets(user_id: str, llm_model: str, link: str, name_sheet: dict[str, int]):
-    tasks = [
-        asyncio.create_task(
-            process_google_sheet(
-                user_id=user_id,
-                llm_model=llm_model,
-                assistant=assistant_name,
-                link=link,
-                sheet_id=sheet_id,
-                from_row=3,
-                to_row=-1,
-            ),
+        else:
+            SHEET_ROWS.inc(assistant=assistant, status="ok")
+        finally:
+            # Строки без вызова OpenAI не влияют на оценку задержки
+            window.release(epoch, latency, congested or throttle_events(writer) > throttled_before)
+            SHEET_ROWS_IN_FLIGHT.dec(assistant=assistant)
+            SHEET_ROW_DURATION.observe(time.perf_counter() - started, assistant=assistant)
+
+    tasks = []
+    rows = 0
+    async with writer:
+        try:
+            for attempt in range(job_store.max_attempts):
+                tasks_data = await job_store.rows_to_process(job_id)
+                if not tasks_data:
+                    break
+                if attempt:
+                    delay = SHEETS_JOB_RETRY_DELAY * 2 ** (attempt - 1)
+                    logger.warning(f"process_google_sheet() - {assistant} - job {job_id} - retry {len(tasks_data)} rows in {delay:.0f}s")
+                    await asyncio.sleep(delay)
+                rows += len(tasks_data)
+                # Следующая строка запускается, как только в окне освободилось место
+                tasks = []
+                for row in tasks_data:
+                    epoch = await window.acquire()
+                    tasks.append(asyncio.create_task(handle_row(row, epoch)))
+                await asyncio.gather(*tasks)
+                # Записанные в лист строки отмечаются до выбора строк следующего круга
+                await writer.flush()
+        finally:
+            # При отмене задания выполняющиеся строки отменяются до записи остатка результатов
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    logger.info(f"process_google_sheet() - {assistant} - job {job_id} - {rows} rows, window {window.stats()}")
+
+
+job_store = JobStore()
+jobs = JobRunner(job_store, run_sheet_job)
+
+
+async def process_google_sheet(spec: ProcessGoogleSheetRequest) -> dict:
+    """Запуск задания обработки листа и ожидание его завершения (отмена ожидания задание не прерывает)."""
+    return await jobs.wait(await jobs.submit(spec))
+
+
+async def process_google_sheets(user_id: int, llm_model: str, link: str, name_sheet: dict[str, int]) -> list[dict]:
+    specs = [
+        ProcessGoogleSheetRequest(
+            user_id=user_id,
+            llm_model=llm_model,
+            assistant=assistant_name,
+            link=link,
+            sheet_id=sheet_id,
+            from_row=3,
+            to_row=-1,
         )
         for assistant_name, sheet_id in name_sheet.items()
     ]
-    await asyncio.gather(*tasks)
+    return await asyncio.gather(*(process_google_sheet(spec) for spec in specs))